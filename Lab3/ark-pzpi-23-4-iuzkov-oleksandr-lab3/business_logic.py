@@ -10,21 +10,249 @@
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, desc, or_
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple, Any
-import statistics
-import json
+from sqlalchemy.engine import Row
+from sqlalchemy import Select, bindparam, delete, func, and_, case, desc, exists, inspect, literal, or_, insert, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Dict, NamedTuple, Optional, Tuple, Any
+from collections import OrderedDict, deque
+import orjson
 import hashlib
+import math
+import threading
+import time
 
 import models
 import schemas
+from cache import cache_delete, cache_get, cache_get_raw, cache_hpop_all, cache_hset, cache_lock, cache_set, cache_unlock, cache_wait
 
 
 # ============================================
 # ОБРОБКА ПОКАЗНИКІВ СЕНСОРІВ (Sequence Diagram 1)
 # ============================================
 
+class ThresholdSnapshot(NamedTuple):
+    """Незмінна копія порогових значень приміщення для кешу"""
+    min_temperature: Optional[float]
+    max_temperature: Optional[float]
+    min_humidity: Optional[float]
+    max_humidity: Optional[float]
+    auto_control_enabled: bool
+
+
+# LRU кеш приміщень сенсорів: sensor_id -> room_id
+# Сенсор не переноситься між приміщеннями, а id не використовуються повторно,
+# тому запис не застаріває і кеш може бути локальним для процесу. Пороги
+# приміщень змінюються - вони кешуються спільно для всіх воркерів у Redis
+# (load_room_threshold). При переповненні витісняється сенсор, до якого
+# найдовше не зверталися
+SENSOR_CACHE_MAX_SIZE = 10000
+_sensor_cache: "OrderedDict[int, int]" = OrderedDict()
+_sensor_cache_lock = threading.Lock()
+
+
+def _load_sensor_rooms(db: Session, sensor_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Повернути {sensor_id: room_id} з кешу, а відсутні - одним запитом з IN
+    
+    Неіснуючих сенсорів у результаті немає.
+    """
+    rooms = {}
+    missing = []
+    
+    with _sensor_cache_lock:
+        for sensor_id in sensor_ids:
+            room_id = _sensor_cache.get(sensor_id)
+            if room_id is not None:
+                _sensor_cache.move_to_end(sensor_id)
+                rooms[sensor_id] = room_id
+            else:
+                missing.append(sensor_id)
+    
+    if missing:
+        rows = db.query(models.Sensor.id, models.Sensor.room_id)\
+            .filter(models.Sensor.id.in_(missing)).all()
+        
+        with _sensor_cache_lock:
+            for sensor_id, room_id in rows:
+                rooms[sensor_id] = _sensor_cache[sensor_id] = room_id
+                _sensor_cache.move_to_end(sensor_id)
+            while len(_sensor_cache) > SENSOR_CACHE_MAX_SIZE:
+                _sensor_cache.popitem(last=False)
+    
+    return rooms
+
+
+def _load_sensor_context(
+    db: Session,
+    sensor_id: int
+) -> Optional[Tuple[int, Optional[ThresholdSnapshot]]]:
+    """
+    Повернути (room_id, пороги) для сенсора
+    
+    Returns:
+        None якщо сенсор не знайдено
+    """
+    return _load_sensor_contexts(db, (sensor_id,)).get(sensor_id)
+
+
+def _load_sensor_contexts(
+    db: Session,
+    sensor_ids: Iterable[int]
+) -> Dict[int, Tuple[int, Optional[ThresholdSnapshot]]]:
+    """
+    Повернути {sensor_id: (room_id, пороги)} для набору сенсорів
+    
+    Пороги читаються один раз на приміщення. Неіснуючих сенсорів у результаті немає.
+    """
+    rooms = _load_sensor_rooms(db, sensor_ids)
+    thresholds = {
+        room_id: load_room_threshold(db, room_id) for room_id in set(rooms.values())
+    }
+    
+    return {
+        sensor_id: (room_id, thresholds[room_id]) for sensor_id, room_id in rooms.items()
+    }
+
+
+def invalidate_sensor_cache(sensor_id: int) -> None:
+    """Видалити сенсор з кешу (після видалення сенсора)"""
+    with _sensor_cache_lock:
+        _sensor_cache.pop(sensor_id, None)
+
+
+# Пороги приміщення в Redis (спільно для всіх воркерів): {"threshold": [...] або null}
+ROOM_THRESHOLD_CACHE_TTL = 60  # секунд
+
+
+def _room_threshold_key(room_id: int) -> str:
+    return f"threshold:{room_id}"
+
+
+def load_room_threshold(db: Session, room_id: int) -> Optional[ThresholdSnapshot]:
+    """
+    Повернути пороги приміщення з Redis або з БД
+    
+    Returns:
+        None якщо пороги для приміщення не налаштовані
+    """
+    key = _room_threshold_key(room_id)
+    cached = cache_get(key)
+    
+    if cached is not None:
+        values = cached["threshold"]
+        return ThresholdSnapshot(*values) if values is not None else None
+    
+    row = db.query(
+        models.ClimateThreshold.min_temperature,
+        models.ClimateThreshold.max_temperature,
+        models.ClimateThreshold.min_humidity,
+        models.ClimateThreshold.max_humidity,
+        models.ClimateThreshold.auto_control_enabled
+    ).filter(
+        models.ClimateThreshold.room_id == room_id
+    ).first()
+    
+    snapshot = ThresholdSnapshot(*row) if row is not None else None
+    cache_set(key, {"threshold": list(snapshot) if snapshot else None}, ROOM_THRESHOLD_CACHE_TTL)
+    
+    return snapshot
+
+
+def invalidate_room_cache(room_id: int) -> None:
+    """Видалити з кешу пороги приміщення (після зміни порогів або приміщення)"""
+    cache_delete(_room_threshold_key(room_id))
+    invalidate_system_config()
+
+
+# Знімок конфігурації системи (export_system_configuration) у Redis як готовий JSON.
+# Скидається при зміні приміщень, сенсорів, пристроїв та порогів
+SYSTEM_CONFIG_CACHE_KEY = "system_configuration"
+SYSTEM_CONFIG_CACHE_TTL = 60 * 60  # секунд
+
+
+def invalidate_system_config() -> None:
+    """Видалити знімок конфігурації системи з кешу"""
+    cache_delete(SYSTEM_CONFIG_CACHE_KEY)
+
+
+# last_online сенсорів накопичується в Redis (хеш sensor_id -> ISO час) і
+# записується в БД фоновим завданням одним UPDATE, а не UPDATE на кожен показник
+SENSOR_ONLINE_KEY = "sensor_last_online"
+SENSOR_ONLINE_FLUSH_INTERVAL = 30  # секунд
+
+
+def touch_sensors(db: Session, sensor_ids: Iterable[int], now: datetime) -> None:
+    """
+    Позначити сенсори як онлайн
+    
+    Час записується в Redis; якщо Redis недоступний - UPDATE у поточній транзакції.
+    """
+    sensor_ids = list(sensor_ids)
+    timestamp = now.isoformat()
+    
+    if cache_hset(SENSOR_ONLINE_KEY, {sensor_id: timestamp for sensor_id in sensor_ids}):
+        return
+    
+    db.execute(
+        update(models.Sensor)
+        .where(models.Sensor.id.in_(sensor_ids))
+        .values(last_online=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def flush_sensor_last_online(db: Session) -> int:
+    """
+    Записати накопичені в Redis last_online в БД одним UPDATE ... CASE
+    
+    Returns:
+        Кількість оновлених сенсорів
+    """
+    pending = cache_hpop_all(SENSOR_ONLINE_KEY)
+    
+    if not pending:
+        return 0
+    
+    last_online = {
+        int(sensor_id): datetime.fromisoformat(timestamp.decode())
+        for sensor_id, timestamp in pending.items()
+    }
+    
+    # Якщо UPDATE не вдасться, значення втрачаються лише до наступного
+    # показника сенсора: активні сенсори знову потраплять у хеш за секунди
+    db.execute(
+        update(models.Sensor)
+        .where(models.Sensor.id.in_(last_online))
+        .values(last_online=case(last_online, value=models.Sensor.id))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    
+    return len(last_online)
+
+
+def _room_sensor_ids(db: Session, room_id: int) -> List[int]:
+    """Повернути id сенсорів приміщення"""
+    return [
+        sensor_id for (sensor_id,) in
+        db.query(models.Sensor.id).filter(models.Sensor.room_id == room_id)
+    ]
+
+
+def _room_readings_filter(db: Session, room_id: int, sensor_ids: Optional[List[int]] = None):
+    """
+    Фільтр показників приміщення за id його сенсорів
+    
+    Сенсори приміщення читаються одним коротким запитом, після чого вибірки
+    показників за період йдуть діапазонами по індексу (sensor_id, timestamp)
+    без JOIN з таблицею sensor.
+    """
+    if sensor_ids is None:
+        sensor_ids = _room_sensor_ids(db, room_id)
+    return models.SensorReading.sensor_id.in_(sensor_ids)
+
+
 class SensorReadingProcessor:
     """
     Процес обробки показників сенсора згідно Sequence Diagram 1:
@@ -53,46 +281,243 @@ class SensorReadingProcessor:
            - створити_сповіщення()
         6. Повернути результат
         """
+        # Один час на весь запит: мітка показника та last_online сенсора
+        now = datetime.utcnow()
         
-        # Крок 1: Отримати сенсор
-        sensor = db.query(models.Sensor).filter(
-            models.Sensor.id == sensor_id
-        ).first()
+        # Крок 1 та 3: Отримати приміщення сенсора та його порогові значення (з кешу)
+        context = _load_sensor_context(db, sensor_id)
         
-        if not sensor:
+        if context is None:
             return {
                 "success": False,
                 "error": "Sensor not found",
                 "status_code": 404
             }
         
+        room_id, threshold = context
+        
         # Крок 2: Створити запис показника
         sensor_reading = models.SensorReading(
             sensor_id=sensor_id,
             temperature=temperature,
             humidity=humidity,
-            timestamp=timestamp or datetime.utcnow()
+            timestamp=timestamp or now
         )
         
-        # Крок 3: Отримати порогові значення для приміщення
-        threshold = db.query(models.ClimateThreshold).filter(
-            models.ClimateThreshold.room_id == sensor.room_id
-        ).first()
-        
         # Крок 4: Перевірити умови
+        commands_created, alerts_created = SensorReadingProcessor._check_thresholds(
+            db, room_id, threshold, temperature, humidity
+        )
+        
+        # Виявлення аномалій
+        is_anomaly = AnomalyDetector.detect_anomaly(
+            db, sensor_id, temperature, humidity
+        )
+        sensor_reading.is_anomaly = is_anomaly
+        
+        # Зберегти показник
+        db.add(sensor_reading)
+        
+        # Зберегти alerts
+        for alert_data in alerts_created:
+            alert = models.Alert(**alert_data)
+            db.add(alert)
+        
+        # Оновити last_online сенсора
+        touch_sensors(db, (sensor_id,), now)
+        
+        try:
+            # id показника повертає INSERT при flush - без SELECT після commit
+            db.flush()
+            reading_id = sensor_reading.id
+            db.commit()
+        except IntegrityError:
+            # Сенсор видалено після того, як його контекст потрапив у кеш
+            db.rollback()
+            invalidate_sensor_cache(sensor_id)
+            return {
+                "success": False,
+                "error": "Sensor not found",
+                "status_code": 404
+            }
+        
+        # Повернути результат (200 OK)
+        return {
+            "success": True,
+            "status_code": 200,
+            "reading_id": reading_id,
+            "is_anomaly": is_anomaly,
+            "commands_executed": len(commands_created),
+            "alerts_created": len(alerts_created),
+            "threshold_check": threshold is not None
+        }
+    
+    @staticmethod
+    def process_readings_batch(
+        db: Session,
+        readings: Iterable[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Обробити пакет показників одним commit
+        
+        Кожен показник проходить валідацію даних (Flowchart 2) та ті ж перевірки
+        порогів і аномалій, що й у process_reading, але показники та alerts
+        записуються пакетними INSERT, а last_online всіх сенсорів записується
+        одним HSET (touch_sensors). Показники неіснуючих сенсорів відхиляються,
+        не зупиняючи решту пакета. Стан детектора аномалій та last_online
+        оновлюються лише після commit.
+        
+        Args:
+            readings: словники з ключами sensor_id, temperature, humidity
+                та необов'язковим timestamp (підходить і генератор)
+        """
+        now = datetime.utcnow()
+        
+        # Контексти всіх сенсорів пакета завантажуються одним запитом
+        readings = list(readings)
+        contexts = _load_sensor_contexts(db, {reading["sensor_id"] for reading in readings})
+        
+        # Кеш міг пережити видалення сенсора: існування перевіряється одним запитом,
+        # а FOR KEY SHARE не дає видалити сенсори до commit, тому INSERT показників
+        # не порушить зовнішній ключ
+        if contexts:
+            existing = set(db.scalars(
+                select(models.Sensor.id)
+                .where(models.Sensor.id.in_(list(contexts)))
+                .with_for_update(key_share=True)
+            ))
+            for sensor_id in set(contexts) - existing:
+                invalidate_sensor_cache(sensor_id)
+                del contexts[sensor_id]
+        
+        # Пристрої приміщень з автокеруванням - одним запитом на пакет
+        devices = SensorReadingProcessor._load_devices(db, {
+            room_id for room_id, threshold in contexts.values()
+            if threshold is not None and threshold.auto_control_enabled
+        })
+        
+        reading_rows = []
+        alert_rows = []
+        sensor_ids = set()
+        rejected = 0
+        commands_executed = 0
+        
+        for reading in readings:
+            sensor_id = reading["sensor_id"]
+            temperature = reading.get("temperature")
+            humidity = reading.get("humidity")
+            
+            context = contexts.get(sensor_id)
+            if context is None or not DataValidationFlow.is_valid_reading(temperature, humidity):
+                rejected += 1
+                continue
+            
+            room_id, threshold = context
+            
+            commands, alerts = SensorReadingProcessor._check_thresholds(
+                db, room_id, threshold, temperature, humidity, devices
+            )
+            
+            reading_rows.append({
+                "sensor_id": sensor_id,
+                "temperature": temperature,
+                "humidity": humidity,
+                "timestamp": reading.get("timestamp") or now,
+                "is_anomaly": False
+            })
+            alert_rows.extend(alerts)
+            sensor_ids.add(sensor_id)
+            commands_executed += len(commands)
+        
+        # Аномалії - після перевірки всього пакета: статистика всіх його
+        # сенсорів заповнюється одним запитом
+        checked = [
+            (row["sensor_id"], row["temperature"], row["humidity"]) for row in reading_rows
+        ]
+        flags = AnomalyDetector.detect_anomalies(db, checked)
+        for row, is_anomaly in zip(reading_rows, flags):
+            row["is_anomaly"] = is_anomaly
+        anomalies = sum(flags)
+        
+        if reading_rows:
+            db.execute(insert(models.SensorReading), reading_rows)
+            if alert_rows:
+                db.execute(insert(models.Alert), alert_rows)
+        db.commit()
+        
+        if reading_rows:
+            AnomalyDetector.record_readings(checked)
+            touch_sensors(db, sensor_ids, now)
+            # UPDATE last_online, якщо Redis недоступний
+            db.commit()
+        
+        return {
+            "success": True,
+            "status_code": 200,
+            "readings_saved": len(reading_rows),
+            "readings_rejected": rejected,
+            "anomalies_detected": anomalies,
+            "commands_executed": commands_executed,
+            "alerts_created": len(alert_rows)
+        }
+    
+    @staticmethod
+    def _load_devices(
+        db: Session,
+        room_ids: Iterable[int]
+    ) -> Dict[Tuple[int, str], models.ClimateDevice]:
+        """
+        Завантажити пристрої приміщень одним запитом
+        
+        Returns:
+            {(room_id, тип пристрою): пристрій} - перший за id пристрій кожного типу,
+            як і в _send_device_command
+        """
+        room_ids = list(room_ids)
+        devices = {}
+        
+        if room_ids:
+            for device in db.query(models.ClimateDevice).filter(
+                models.ClimateDevice.room_id.in_(room_ids)
+            ).order_by(models.ClimateDevice.id):
+                devices.setdefault((device.room_id, device.device_type), device)
+        
+        return devices
+    
+    @staticmethod
+    def _check_thresholds(
+        db: Session,
+        room_id: int,
+        threshold: Optional[ThresholdSnapshot],
+        temperature: Optional[float],
+        humidity: Optional[float],
+        devices: Optional[Dict[Tuple[int, str], models.ClimateDevice]] = None
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Перевірити показник на порогові значення приміщення
+        
+        Args:
+            devices: пристрої, завантажені заздалегідь (див. _load_devices)
+        
+        Returns:
+            (виконані команди, дані для alerts)
+        """
         commands_created = []
         alerts_created = []
         
         if threshold:
-            # Alt: Перевірка температури поза межами
-            if temperature is not None:
+            # Alt: Перевірка температури поза межами (лише якщо задано хоча б одну межу)
+            if temperature is not None and (
+                threshold.min_temperature is not None or threshold.max_temperature is not None
+            ):
                 temp_result = SensorReadingProcessor._check_temperature_threshold(
                     db=db,
-                    room_id=sensor.room_id,
+                    room_id=room_id,
                     temperature=temperature,
                     min_temp=threshold.min_temperature,
                     max_temp=threshold.max_temperature,
-                    auto_control=threshold.auto_control_enabled
+                    auto_control=threshold.auto_control_enabled,
+                    devices=devices
                 )
                 
                 if temp_result["command"]:
@@ -100,15 +525,18 @@ class SensorReadingProcessor:
                 if temp_result["alert"]:
                     alerts_created.append(temp_result["alert"])
             
-            # Alt: Перевірка вологості поза межами
-            if humidity is not None:
+            # Alt: Перевірка вологості поза межами (лише якщо задано хоча б одну межу)
+            if humidity is not None and (
+                threshold.min_humidity is not None or threshold.max_humidity is not None
+            ):
                 humid_result = SensorReadingProcessor._check_humidity_threshold(
                     db=db,
-                    room_id=sensor.room_id,
+                    room_id=room_id,
                     humidity=humidity,
                     min_humid=threshold.min_humidity,
                     max_humid=threshold.max_humidity,
-                    auto_control=threshold.auto_control_enabled
+                    auto_control=threshold.auto_control_enabled,
+                    devices=devices
                 )
                 
                 if humid_result["command"]:
@@ -116,36 +544,7 @@ class SensorReadingProcessor:
                 if humid_result["alert"]:
                     alerts_created.append(humid_result["alert"])
         
-        # Виявлення аномалій
-        is_anomaly = AnomalyDetector.detect_anomaly(
-            db, sensor_id, temperature, humidity
-        )
-        sensor_reading.is_anomaly = is_anomaly
-        
-        # Зберегти показник
-        db.add(sensor_reading)
-        
-        # Зберегти alerts
-        for alert_data in alerts_created:
-            alert = models.Alert(**alert_data)
-            db.add(alert)
-        
-        # Оновити last_online сенсора
-        sensor.last_online = datetime.utcnow()
-        
-        db.commit()
-        db.refresh(sensor_reading)
-        
-        # Повернути результат (200 OK)
-        return {
-            "success": True,
-            "status_code": 200,
-            "reading_id": sensor_reading.id,
-            "is_anomaly": is_anomaly,
-            "commands_executed": len(commands_created),
-            "alerts_created": len(alerts_created),
-            "threshold_check": threshold is not None
-        }
+        return commands_created, alerts_created
     
     @staticmethod
     def _check_temperature_threshold(
@@ -154,13 +553,14 @@ class SensorReadingProcessor:
         temperature: float,
         min_temp: Optional[float],
         max_temp: Optional[float],
-        auto_control: bool
+        auto_control: bool,
+        devices: Optional[Dict[Tuple[int, str], models.ClimateDevice]] = None
     ) -> Dict:
         """Перевірити поріг температури та створити команду"""
         result = {"command": None, "alert": None}
         
-        # Температура поза межами?
-        if max_temp and temperature > max_temp:
+        # Температура поза межами? (межа 0.0 - теж валідне значення)
+        if max_temp is not None and temperature > max_temp:
             # Створити сповіщення
             result["alert"] = {
                 "room_id": room_id,
@@ -172,11 +572,11 @@ class SensorReadingProcessor:
             # Якщо автокерування увімкнено - створити команду
             if auto_control:
                 command = SensorReadingProcessor._send_device_command(
-                    db, room_id, "air_conditioner", "turn_on"
+                    db, room_id, "air_conditioner", "turn_on", devices=devices
                 )
                 result["command"] = command
         
-        elif min_temp and temperature < min_temp:
+        elif min_temp is not None and temperature < min_temp:
             result["alert"] = {
                 "room_id": room_id,
                 "alert_type": "temperature_low",
@@ -186,7 +586,7 @@ class SensorReadingProcessor:
             
             if auto_control:
                 command = SensorReadingProcessor._send_device_command(
-                    db, room_id, "heater", "turn_on"
+                    db, room_id, "heater", "turn_on", devices=devices
                 )
                 result["command"] = command
         
@@ -199,12 +599,13 @@ class SensorReadingProcessor:
         humidity: float,
         min_humid: Optional[float],
         max_humid: Optional[float],
-        auto_control: bool
+        auto_control: bool,
+        devices: Optional[Dict[Tuple[int, str], models.ClimateDevice]] = None
     ) -> Dict:
         """Перевірити поріг вологості та створити команду"""
         result = {"command": None, "alert": None}
         
-        if max_humid and humidity > max_humid:
+        if max_humid is not None and humidity > max_humid:
             result["alert"] = {
                 "room_id": room_id,
                 "alert_type": "humidity_high",
@@ -214,11 +615,11 @@ class SensorReadingProcessor:
             
             if auto_control:
                 command = SensorReadingProcessor._send_device_command(
-                    db, room_id, "dehumidifier", "turn_on"
+                    db, room_id, "dehumidifier", "turn_on", devices=devices
                 )
                 result["command"] = command
         
-        elif min_humid and humidity < min_humid:
+        elif min_humid is not None and humidity < min_humid:
             result["alert"] = {
                 "room_id": room_id,
                 "alert_type": "humidity_low",
@@ -228,7 +629,7 @@ class SensorReadingProcessor:
             
             if auto_control:
                 command = SensorReadingProcessor._send_device_command(
-                    db, room_id, "humidifier", "turn_on"
+                    db, room_id, "humidifier", "turn_on", devices=devices
                 )
                 result["command"] = command
         
@@ -239,24 +640,42 @@ class SensorReadingProcessor:
         db: Session,
         room_id: int,
         device_type: str,
-        command: str
+        command: str,
+        issued_by_user_id: Optional[int] = None,
+        devices: Optional[Dict[Tuple[int, str], models.ClimateDevice]] = None
     ) -> Optional[Dict]:
         """
         Надіслати команду пристрою (device_id, дія)
         Повертає інформацію про виконану команду
+        
+        Якщо вказано issued_by_user_id, команда записується в DeviceCommand
+        у тій самій транзакції, що й зміна статусу пристрою.
+        Якщо передано devices, пристрій береться з них без запиту до БД.
         """
-        device = db.query(models.ClimateDevice).filter(
-            and_(
-                models.ClimateDevice.room_id == room_id,
-                models.ClimateDevice.device_type == device_type
-            )
-        ).first()
+        if devices is not None:
+            device = devices.get((room_id, device_type))
+        else:
+            device = db.query(models.ClimateDevice).filter(
+                and_(
+                    models.ClimateDevice.room_id == room_id,
+                    models.ClimateDevice.device_type == device_type
+                )
+            ).order_by(models.ClimateDevice.id).first()
         
         if not device:
             return None
         
-        # Оновити статус пристрою БЕЗ створення DeviceCommand
-        # (бо issued_by є обов'язковим, а для автоматичних команд немає користувача)
+        # Для автоматичних команд DeviceCommand не створюється
+        # (issued_by є обов'язковим, а користувача немає)
+        if issued_by_user_id is not None:
+            db.add(models.DeviceCommand(
+                device_id=device.id,
+                command=command,
+                issued_by=issued_by_user_id,
+                parameters=None
+            ))
+        
+        # Оновити статус пристрою
         if command == "turn_on":
             device.status = "on"
         elif command == "turn_off":
@@ -268,69 +687,48 @@ class SensorReadingProcessor:
             "command": command,
             "status": "executed"
         }
-    
-@staticmethod
-def _send_device_command(
-    db: Session,
-    room_id: int,
-    device_type: str,
-    command: str,
-    issued_by_user_id: Optional[int] = None
-) -> Optional[Dict]:
-    """
-    Надіслати команду пристрою (device_id, дія)
-    Повертає інформацію про виконану команду
-    """
-    device = db.query(models.ClimateDevice).filter(
-        and_(
-            models.ClimateDevice.room_id == room_id,
-            models.ClimateDevice.device_type == device_type
-        )
-    ).first()
-    
-    if not device:
-        return None
-    
-    # Якщо issued_by не вказано, НЕ створюємо команду
-    # Просто змінюємо статус пристрою
-    if issued_by_user_id:
-        try:
-            device_command = models.DeviceCommand(
-                device_id=device.id,
-                command=command,
-                issued_by=issued_by_user_id,
-                parameters=None
-            )
-            db.add(device_command)
-        except Exception as e:
-            print(f"Warning: Could not create DeviceCommand: {e}")
-    
-    # Оновити статус пристрою
-    if command == "turn_on":
-        device.status = "on"
-    elif command == "turn_off":
-        device.status = "off"
-    
-    return {
-        "device_id": device.id,
-        "device_type": device_type,
-        "command": command,
-        "status": "executed"
-    }
 
 
 # ============================================
 # АНАЛІТИКА З КЕШУВАННЯМ (Sequence Diagram 2)
 # ============================================
 
+class PeriodStatistics(NamedTuple):
+    """Показники за період для get_analytics (з погодинних агрегатів або сирих даних)"""
+    total_readings: int
+    anomalies_count: int
+    avg_temperature: Optional[float]
+    min_temperature: Optional[float]
+    max_temperature: Optional[float]
+    median_temperature: Optional[float]
+    temperature_slope: Optional[float]
+    temperature_stdev: Optional[float]
+    avg_humidity: Optional[float]
+    min_humidity: Optional[float]
+    max_humidity: Optional[float]
+    median_humidity: Optional[float]
+    humidity_slope: Optional[float]
+    humidity_stdev: Optional[float]
+    # Медіана з погодинних агрегатів - за середніми значеннями годин, не точна
+    median_approximate: bool
+
+
+# Ключі блоків temperature/humidity у відповіді аналітики (порядок як у PeriodStatistics)
+_SUMMARY_KEYS = ("average", "min", "max", "median")
+
+# Відповідь get_analytics для кешованих даних: серіалізований JSON з кешу
+# вставляється між префіксом та суфіксом без розбору та повторної серіалізації
+_CACHED_RESPONSE_PREFIX = b'{"success":true,"data":'
+_CACHED_RESPONSE_SUFFIX = b',"from_cache":true,"status_code":200}'
+
+
 class AnalyticsService:
     """
     Сервіс аналітики з кешуванням згідно Sequence Diagram 2:
     Користувач -> API -> Cache -> Бізнес-логіка -> База даних
     """
     
-    # Простий in-memory cache (у продакшені використовувати Redis)
-    _cache = {}
+    # Кеш у Redis (спільний для всіх воркерів), термін життя задається через SETEX
     _cache_ttl = 3600  # 1 година в секундах
     
     @staticmethod
@@ -361,6 +759,14 @@ class AnalyticsService:
         # Крок 2: Перевірити кеш
         cached_data = AnalyticsService._check_cache(cache_key)
         
+        # Alt: Даних немає в кеші - згенерувати аналітику.
+        # Якщо її вже генерує інший запит, дочекатися його результату
+        locked = False
+        if not cached_data:
+            locked = cache_lock(cache_key)
+            if not locked:
+                cached_data = cache_wait(cache_key)
+        
         # Alt: Дані в кеші
         if cached_data:
             return {
@@ -370,62 +776,75 @@ class AnalyticsService:
                 "status_code": 200
             }
         
-        # Alt: Даних немає в кеші - згенерувати аналітику
-        cutoff_date = datetime.utcnow() - timedelta(days=period_days)
-        
-        # Запит показників (період)
-        query = db.query(models.SensorReading).join(models.Sensor)
+        try:
+            return AnalyticsService._generate_analytics(db, room_id, period_days, cache_key)
+        finally:
+            if locked:
+                cache_unlock(cache_key)
+    
+    @staticmethod
+    def get_cached_response(room_id: Optional[int], period_days: int) -> Optional[bytes]:
+        """
+        Готова JSON відповідь get_analytics з кешу або None при відсутності в кеші
         
-        if room_id:
-            query = query.filter(models.Sensor.room_id == room_id)
+        Для endpoint'а: кешовані дані повертаються клієнту байтами з Redis,
+        без orjson.loads та повторної серіалізації відповіді.
+        """
+        cache_key = AnalyticsService._generate_cache_key(room_id, period_days)
+        raw = cache_get_raw(cache_key)
         
-        readings = query.filter(
-            models.SensorReading.timestamp >= cutoff_date
-        ).all()
+        if raw is None:
+            return None
         
-        if not readings:
+        return _CACHED_RESPONSE_PREFIX + raw + _CACHED_RESPONSE_SUFFIX
+    
+    @staticmethod
+    def _generate_analytics(
+        db: Session,
+        room_id: Optional[int],
+        period_days: int,
+        cache_key: str
+    ) -> Dict[str, Any]:
+        """згенерувати_аналітику(): запит показників, розрахунок та збереження в кеш"""
+        now = datetime.utcnow()
+        cutoff_date = now - timedelta(days=period_days)
+        
+        # Запит показників (період): за період від доби - з погодинних агрегатів
+        # (~24 рядки на добу замість усіх показників), інакше або поки агрегати
+        # ще не заповнені - з сирих показників
+        stats = None
+        if period_days >= 1:
+            stats = AnalyticsService._rollup_statistics(db, room_id, cutoff_date)
+        if stats is None:
+            stats = AnalyticsService._raw_statistics(db, room_id, cutoff_date)
+        
+        if stats is None:
             return {
                 "success": False,
                 "error": "No data for specified period",
                 "status_code": 404
             }
         
-        # Розрахувати середнє()
-        temperatures = [r.temperature for r in readings if r.temperature is not None]
-        humidities = [r.humidity for r in readings if r.humidity is not None]
-        
-        avg_temperature = statistics.mean(temperatures) if temperatures else None
-        avg_humidity = statistics.mean(humidities) if humidities else None
-        
-        # Знайти мін/макс()
-        min_temperature = min(temperatures) if temperatures else None
-        max_temperature = max(temperatures) if temperatures else None
-        min_humidity = min(humidities) if humidities else None
-        max_humidity = max(humidities) if humidities else None
-        
         # Виявити тренди()
-        trends = AnalyticsService._detect_trends(readings)
+        period_seconds = (now - cutoff_date).total_seconds()
+        trends = AnalyticsService._detect_trends(
+            stats.total_readings,
+            period_seconds,
+            (stats.temperature_slope, stats.temperature_stdev),
+            (stats.humidity_slope, stats.humidity_stdev)
+        )
         
         # Сформувати результат аналітики
         analytics_result = {
             "period_days": period_days,
             "room_id": room_id,
-            "total_readings": len(readings),
-            "temperature": {
-                "average": round(avg_temperature, 2) if avg_temperature else None,
-                "min": round(min_temperature, 2) if min_temperature else None,
-                "max": round(max_temperature, 2) if max_temperature else None,
-                "median": round(statistics.median(temperatures), 2) if temperatures else None
-            },
-            "humidity": {
-                "average": round(avg_humidity, 2) if avg_humidity else None,
-                "min": round(min_humidity, 2) if min_humidity else None,
-                "max": round(max_humidity, 2) if max_humidity else None,
-                "median": round(statistics.median(humidities), 2) if humidities else None
-            },
+            "total_readings": stats.total_readings,
+            "temperature": AnalyticsService._summary(stats[2:6]),
+            "humidity": AnalyticsService._summary(stats[8:12]),
             "trends": trends,
-            "anomalies_count": sum(1 for r in readings if r.is_anomaly),
-            "generated_at": datetime.utcnow().isoformat()
+            "anomalies_count": stats.anomalies_count,
+            "median_approximate": stats.median_approximate,
+            "generated_at": now.isoformat()
         }
         
         # Зберегти в кеш (ключ, дані, ttl=1год)
@@ -438,6 +857,235 @@ class AnalyticsService:
             "status_code": 200
         }
     
+    @staticmethod
+    def _raw_statistics(
+        db: Session,
+        room_id: Optional[int],
+        cutoff_date: datetime
+    ) -> Optional[PeriodStatistics]:
+        """
+        Показники за період із сирих показників
+        
+        Середнє, мін/макс, медіана, кількість аномалій та нахил лінійної регресії
+        для трендів рахуються в БД одним запитом, без завантаження рядків у Python.
+        """
+        reading = models.SensorReading
+        filters = [reading.timestamp >= cutoff_date]
+        
+        if room_id:
+            filters.append(_room_readings_filter(db, room_id))
+        
+        epoch = func.extract("epoch", reading.timestamp)
+        
+        stats = db.query(
+            func.count(reading.id),
+            func.avg(reading.temperature),
+            func.min(reading.temperature),
+            func.max(reading.temperature),
+            func.avg(reading.humidity),
+            func.min(reading.humidity),
+            func.max(reading.humidity),
+            func.count(reading.id).filter(reading.is_anomaly == True),
+            func.percentile_cont(0.5).within_group(reading.temperature),
+            func.percentile_cont(0.5).within_group(reading.humidity),
+            func.regr_slope(reading.temperature, epoch),
+            func.stddev_samp(reading.temperature),
+            func.regr_slope(reading.humidity, epoch),
+            func.stddev_samp(reading.humidity)
+        ).select_from(reading).filter(*filters).one()
+        
+        (
+            total_readings,
+            avg_temperature, min_temperature, max_temperature,
+            avg_humidity, min_humidity, max_humidity,
+            anomalies_count,
+            median_temperature, median_humidity,
+            temp_slope, temp_stdev, humid_slope, humid_stdev
+        ) = stats
+        
+        if not total_readings:
+            return None
+        
+        return PeriodStatistics(
+            total_readings, int(anomalies_count or 0),
+            avg_temperature, min_temperature, max_temperature, median_temperature,
+            temp_slope, temp_stdev,
+            avg_humidity, min_humidity, max_humidity, median_humidity,
+            humid_slope, humid_stdev,
+            False
+        )
+    
+    @staticmethod
+    def _rollup_statistics(
+        db: Session,
+        room_id: Optional[int],
+        cutoff_date: datetime
+    ) -> Optional[PeriodStatistics]:
+        """
+        Показники за період з погодинних агрегатів (sensor_reading_hourly)
+        
+        Період вирівнюється до початку години. Показники, збережені після
+        останнього оновлення агрегатів (id більший за last_reading_id), додаються
+        до годин із сирих даних, тому агрегати за період повні.
+        Середнє, стандартне відхилення та мін/макс об'єднуються точно; медіана
+        та нахил тренду - наближені, за середніми значеннями годин (зважені
+        кількістю показників).
+        
+        Returns:
+            None якщо агрегатів ще немає (таблиця не створена або не заповнена)
+            або за період немає показників
+        """
+        reading = models.SensorReading
+        hourly = models.SensorReadingHourly
+        
+        if not _rollup_table_exists(db):
+            return None
+        
+        last_reading_id = db.query(func.max(hourly.last_reading_id)).scalar()
+        if last_reading_id is None:
+            return None
+        
+        cutoff_hour = cutoff_date.replace(minute=0, second=0, microsecond=0)
+        
+        rolled_up = select(
+            hourly.hour_bucket,
+            hourly.reading_count,
+            hourly.anomaly_count,
+            hourly.temperature_count,
+            hourly.temperature_sum,
+            hourly.temperature_sum_squares,
+            hourly.min_temperature,
+            hourly.max_temperature,
+            hourly.humidity_count,
+            hourly.humidity_sum,
+            hourly.humidity_sum_squares,
+            hourly.min_humidity,
+            hourly.max_humidity
+        ).where(hourly.hour_bucket >= cutoff_hour)
+        
+        # Ще не зведені показники - по рядку на показник у тому ж форматі
+        recent = select(
+            func.date_trunc("hour", reading.timestamp),
+            literal(1),
+            case((reading.is_anomaly == True, 1), else_=0),
+            case((reading.temperature.isnot(None), 1), else_=0),
+            reading.temperature,
+            reading.temperature * reading.temperature,
+            reading.temperature,
+            reading.temperature,
+            case((reading.humidity.isnot(None), 1), else_=0),
+            reading.humidity,
+            reading.humidity * reading.humidity,
+            reading.humidity,
+            reading.humidity
+        ).where(reading.id > last_reading_id, reading.timestamp >= cutoff_hour)
+        
+        if room_id:
+            rolled_up = rolled_up.where(hourly.room_id == room_id)
+            recent = recent.where(_room_readings_filter(db, room_id))
+        
+        columns = list(union_all(rolled_up, recent).subquery().c)
+        
+        # По рядку на годину (суми по приміщеннях та ще не зведених показниках)
+        buckets = db.execute(
+            select(
+                columns[0],
+                *(func.sum(column) for column in columns[1:6]),
+                func.min(columns[6]),
+                func.max(columns[7]),
+                *(func.sum(column) for column in columns[8:11]),
+                func.min(columns[11]),
+                func.max(columns[12])
+            ).group_by(columns[0]).order_by(columns[0])
+        ).all()
+        
+        if not buckets:
+            return None
+        
+        return PeriodStatistics(
+            sum(bucket[1] for bucket in buckets),
+            sum(bucket[2] for bucket in buckets),
+            *AnalyticsService._combine_buckets(buckets, 3),
+            *AnalyticsService._combine_buckets(buckets, 8),
+            True
+        )
+    
+    @staticmethod
+    def _combine_buckets(buckets: List[Row], offset: int) -> Tuple[Optional[float], ...]:
+        """
+        Об'єднати погодинні агрегати однієї величини
+        
+        Args:
+            buckets: рядки (година, ..., кількість, сума, сума квадратів, мін, макс, ...)
+            offset: позиція кількості в рядку
+        
+        Returns:
+            (середнє, мін, макс, медіана, нахил в од./с, стандартне відхилення)
+        """
+        count = total = squares = 0
+        minimum = maximum = start = None
+        
+        # Середні значення годин: (секунди від першої години, середнє, вага)
+        points = []
+        
+        # Один прохід по годинах: суми, мін/макс та точки для медіани і тренду
+        for bucket in buckets:
+            hour_count = bucket[offset]
+            if not hour_count:
+                continue
+            
+            hour_sum, hour_squares, hour_min, hour_max = bucket[offset + 1:offset + 5]
+            
+            if start is None:
+                start = bucket[0]
+                minimum, maximum = hour_min, hour_max
+            else:
+                minimum = min(minimum, hour_min)
+                maximum = max(maximum, hour_max)
+            
+            count += hour_count
+            total += hour_sum
+            squares += hour_squares
+            points.append(((bucket[0] - start).total_seconds(), hour_sum / hour_count, hour_count))
+        
+        if not points:
+            return (None,) * 6
+        
+        average = total / count
+        stdev = math.sqrt(max(squares - total * average, 0.0) / (count - 1)) if count > 1 else None
+        
+        # Зважена медіана середніх значень годин
+        median = None
+        accumulated = 0
+        for _, value, weight in sorted(points, key=lambda point: point[1]):
+            accumulated += weight
+            if accumulated * 2 >= count:
+                median = value
+                break
+        
+        # Зважений метод найменших квадратів за середніми значеннями годин
+        slope = None
+        if len(points) >= 2:
+            mean_x = sum(x * weight for x, _, weight in points) / count
+            mean_y = sum(y * weight for _, y, weight in points) / count
+            variance_x = sum(weight * (x - mean_x) ** 2 for x, _, weight in points)
+            if variance_x:
+                slope = sum(
+                    weight * (x - mean_x) * (y - mean_y) for x, y, weight in points
+                ) / variance_x
+        
+        return average, minimum, maximum, median, slope, stdev
+    
+    @staticmethod
+    def _summary(values: Tuple[Optional[float], ...]) -> Dict[str, Optional[float]]:
+        """Сформувати блок показника: (середнє, мін, макс, медіана), округлені до 0.01"""
+        return dict(zip(_SUMMARY_KEYS, map(AnalyticsService._round, values)))
+    
+    @staticmethod
+    def _round(value: Optional[float]) -> Optional[float]:
+        """Округлити агрегат з БД (AVG повертає Decimal для NUMERIC, тому float())"""
+        return round(float(value), 2) if value is not None else None
+    
     @staticmethod
     def _generate_cache_key(room_id: Optional[int], period_days: int) -> str:
         """Згенерувати ключ для кешу"""
@@ -451,78 +1099,263 @@ class AnalyticsService:
     @staticmethod
     def _check_cache(cache_key: str) -> Optional[Dict]:
         """Перевірити кеш(ключ)"""
-        if cache_key in AnalyticsService._cache:
-            cached_item = AnalyticsService._cache[cache_key]
-            
-            # Перевірити чи не застарів кеш
-            if datetime.utcnow().timestamp() - cached_item["timestamp"] < AnalyticsService._cache_ttl:
-                return cached_item["data"]
-            else:
-                # Видалити застарілий запис
-                del AnalyticsService._cache[cache_key]
-        
-        return None
+        # Застарілі записи видаляє сам Redis після закінчення TTL
+        return cache_get(cache_key)
     
     @staticmethod
     def _save_to_cache(cache_key: str, data: Dict):
         """Зберегти(ключ, дані, ttl=1год)"""
-        AnalyticsService._cache[cache_key] = {
-            "data": data,
-            "timestamp": datetime.utcnow().timestamp()
-        }
+        cache_set(cache_key, data, AnalyticsService._cache_ttl)
     
     @staticmethod
-    def _detect_trends(readings: List[models.SensorReading]) -> Dict:
+    def _detect_trends(
+        total_readings: int,
+        period_seconds: float,
+        temperature: Tuple[Optional[float], Optional[float]],
+        humidity: Tuple[Optional[float], Optional[float]]
+    ) -> Dict:
         """
         Виявити тренди()
-        Простий аналіз: порівняння першої та другої половини періоду
-        """
-        if len(readings) < 10:
-            return {"trend": "insufficient_data"}
-        
-        # Розділити на дві половини
-        mid_point = len(readings) // 2
-        first_half = readings[:mid_point]
-        second_half = readings[mid_point:]
+        За нахилом лінійної регресії (метод найменших квадратів) значень за часом
         
-        # Температура
-        temp_first = [r.temperature for r in first_half if r.temperature is not None]
-        temp_second = [r.temperature for r in second_half if r.temperature is not None]
+        Тренд вважається зростанням/спаданням, якщо зміна за весь період
+        (нахил * тривалість) перевищує стандартне відхилення значень.
         
-        temp_trend = "stable"
-        if temp_first and temp_second:
-            avg_first = statistics.mean(temp_first)
-            avg_second = statistics.mean(temp_second)
-            diff = avg_second - avg_first
-            
-            if diff > 1.0:
-                temp_trend = "increasing"
-            elif diff < -1.0:
-                temp_trend = "decreasing"
-        
-        # Вологість
-        humid_first = [r.humidity for r in first_half if r.humidity is not None]
-        humid_second = [r.humidity for r in second_half if r.humidity is not None]
-        
-        humid_trend = "stable"
-        if humid_first and humid_second:
-            avg_first = statistics.mean(humid_first)
-            avg_second = statistics.mean(humid_second)
-            diff = avg_second - avg_first
-            
-            if diff > 5.0:
-                humid_trend = "increasing"
-            elif diff < -5.0:
-                humid_trend = "decreasing"
+        Args:
+            temperature, humidity: (нахил в од./с, стандартне відхилення)
+        """
+        if total_readings < 10:
+            return {"trend": "insufficient_data"}
         
         return {
-            "temperature_trend": temp_trend,
-            "humidity_trend": humid_trend
+            "temperature_trend": AnalyticsService._classify_trend(*temperature, period_seconds),
+            "humidity_trend": AnalyticsService._classify_trend(*humidity, period_seconds)
         }
+    
+    @staticmethod
+    def _classify_trend(
+        slope: Optional[float],
+        stdev: Optional[float],
+        period_seconds: float
+    ) -> str:
+        """Визначити напрям тренду за нахилом та поріг stdev / тривалість періоду"""
+        if slope is None or not stdev:
+            return "stable"
+        
+        threshold = float(stdev) / period_seconds
+        
+        if slope > threshold:
+            return "increasing"
+        if slope < -threshold:
+            return "decreasing"
+        return "stable"
+
 
 
 # ============================================
-# АВТОКЕРУВАННЯ (Flowchart 1)
+# ПОГОДИННІ АГРЕГАТИ ДЛЯ АНАЛІТИКИ
+# ============================================
+
+# Як часто фонове завдання оновлює sensor_reading_hourly
+ROLLUP_REFRESH_INTERVAL = 300  # секунд
+
+# Останні години, що перераховуються при кожному оновленні: показники з транзакцій,
+# завершених після попереднього оновлення, можуть мати id, менший за last_reading_id
+ROLLUP_OVERLAP_HOURS = 3
+
+
+# Таблиця агрегатів існує (позитивний результат перевірки запам'ятовується на процес)
+_rollup_table_ready = False
+
+
+def _rollup_table_exists(db: Session) -> bool:
+    """
+    Чи створено таблицю sensor_reading_hourly
+    
+    В існуючій БД таблиця з'являється лише після виконання DDL з
+    models.SensorReadingHourly; до того агрегати не оновлюються, а аналітика
+    рахується по сирих показниках.
+    """
+    global _rollup_table_ready
+    if not _rollup_table_ready:
+        _rollup_table_ready = inspect(db.connection()).has_table(
+            models.SensorReadingHourly.__tablename__
+        )
+    return _rollup_table_ready
+
+
+class AnalyticsRollup:
+    """Оновлення погодинних агрегатів показників (sensor_reading_hourly)"""
+    
+    @staticmethod
+    def refresh(db: Session) -> int:
+        """
+        Перерахувати години, в які потрапили показники, збережені після попереднього оновлення
+        
+        Нові показники визначаються за id (більший за last_reading_id агрегатів),
+        а не за часовою міткою, тому пізні показники з власним timestamp
+        (пакети, що надходять із запізненням) також перераховують свою годину.
+        Останні ROLLUP_OVERLAP_HOURS годин перераховуються завжди: транзакція,
+        що завершилась після попереднього оновлення, могла отримати id, менший
+        за його межу, і без перерахунку її показники не потрапили б в агрегати.
+        При першому запуску агрегати будуються за всю історію.
+        
+        Одночасно оновлює лише один воркер: транзакційний advisory lock
+        PostgreSQL знімається з commit/rollback, тому не залежить ні від
+        тривалості оновлення, ні від доступності Redis.
+        
+        Returns:
+            Кількість записаних рядків (година, приміщення)
+        """
+        reading = models.SensorReading
+        hourly = models.SensorReadingHourly
+        
+        if not _rollup_table_exists(db):
+            return 0
+        
+        locked = db.execute(
+            select(func.pg_try_advisory_xact_lock(func.hashtext(hourly.__tablename__)))
+        ).scalar()
+        
+        last_reading_id = db.query(func.max(hourly.last_reading_id)).scalar()
+        
+        # Межа фіксується на початку: показники, збережені під час оновлення,
+        # потраплять у наступне
+        upper_id = db.query(func.max(reading.id)).scalar()
+        
+        if not locked or upper_id is None:
+            db.rollback()
+            return 0
+        
+        criteria = []
+        if last_reading_id is not None:
+            bucket = func.date_trunc("hour", reading.timestamp)
+            overlap_start = (
+                datetime.now(timezone.utc) - timedelta(hours=ROLLUP_OVERLAP_HOURS)
+            ).replace(minute=0, second=0, microsecond=0)
+            
+            # Години, в які потрапили нові показники, та останні години
+            # перераховуються повністю
+            hours = [
+                hour for (hour,) in db.query(bucket).filter(
+                    reading.id > last_reading_id, reading.id <= upper_id
+                ).distinct()
+            ]
+            
+            db.query(hourly).filter(
+                or_(hourly.hour_bucket.in_(hours), hourly.hour_bucket >= overlap_start)
+            ).delete(synchronize_session=False)
+            criteria = [
+                reading.timestamp >= min(hours + [overlap_start]),
+                or_(bucket.in_(hours), reading.timestamp >= overlap_start)
+            ]
+        
+        rowcount = AnalyticsRollup._aggregate(db, upper_id, *criteria)
+        db.commit()
+        
+        return rowcount
+    
+    @staticmethod
+    def recompute(
+        db: Session,
+        room_id: Optional[int],
+        start_date: Optional[datetime],
+        end_date: datetime
+    ) -> None:
+        """
+        Перерахувати агрегати годин після видалення показників
+        
+        Години з start_date (None - з початку) до end_date включно видаляються
+        та будуються заново з сирих показників, що залишились. Виконується в
+        транзакції виклику (без commit) і чекає на advisory lock оновлення,
+        тому не перетинається з refresh.
+        
+        Args:
+            room_id: приміщення (None - всі)
+            start_date: початок першої години
+            end_date: будь-який момент останньої години
+        """
+        reading = models.SensorReading
+        hourly = models.SensorReadingHourly
+        
+        if not _rollup_table_exists(db):
+            return
+        
+        db.execute(select(func.pg_advisory_xact_lock(func.hashtext(hourly.__tablename__))))
+        
+        # Межа агрегатів не змінюється: новіші показники додасть refresh
+        last_reading_id = db.query(func.max(hourly.last_reading_id)).scalar()
+        if last_reading_id is None:
+            return
+        
+        end_hour = end_date.replace(minute=0, second=0, microsecond=0)
+        stale = [hourly.hour_bucket <= end_hour]
+        criteria = [reading.timestamp < end_hour + timedelta(hours=1)]
+        
+        if start_date is not None:
+            start_hour = start_date.replace(minute=0, second=0, microsecond=0)
+            stale.append(hourly.hour_bucket >= start_hour)
+            criteria.append(reading.timestamp >= start_hour)
+        
+        if room_id is not None:
+            stale.append(hourly.room_id == room_id)
+            criteria.append(models.Sensor.room_id == room_id)
+        
+        db.query(hourly).filter(*stale).delete(synchronize_session=False)
+        AnalyticsRollup._aggregate(db, last_reading_id, *criteria)
+    
+    @staticmethod
+    def _aggregate(db: Session, upper_id: int, *criteria) -> int:
+        """
+        Записати агрегати (година, приміщення) показників з id <= upper_id,
+        що відповідають criteria
+        
+        Returns:
+            Кількість записаних рядків
+        """
+        reading = models.SensorReading
+        hourly = models.SensorReadingHourly
+        
+        bucket = func.date_trunc("hour", reading.timestamp)
+        temperature_squared = reading.temperature * reading.temperature
+        humidity_squared = reading.humidity * reading.humidity
+        
+        # Обмеження за upper_id узгоджене з _rollup_statistics: показники з
+        # більшим id додаються туди з сирих даних
+        source = db.query(
+            models.Sensor.room_id,
+            bucket,
+            func.count(reading.id),
+            func.count(reading.id).filter(reading.is_anomaly == True),
+            func.count(reading.temperature),
+            func.sum(reading.temperature),
+            func.sum(temperature_squared),
+            func.min(reading.temperature),
+            func.max(reading.temperature),
+            func.count(reading.humidity),
+            func.sum(reading.humidity),
+            func.sum(humidity_squared),
+            func.min(reading.humidity),
+            func.max(reading.humidity),
+            literal(upper_id)
+        ).select_from(reading).join(models.Sensor)\
+            .filter(reading.id <= upper_id, *criteria)\
+            .group_by(models.Sensor.room_id, bucket)
+        
+        result = db.execute(
+            insert(hourly).from_select(
+                [
+                    "room_id", "hour_bucket", "reading_count", "anomaly_count",
+                    "temperature_count", "temperature_sum", "temperature_sum_squares",
+                    "min_temperature", "max_temperature",
+                    "humidity_count", "humidity_sum", "humidity_sum_squares",
+                    "min_humidity", "max_humidity", "last_reading_id"
+                ],
+                source.statement
+            )
+        )
+        
+        return result.rowcount
 # ============================================
 
 class AutoControlFlow:
@@ -552,21 +1385,28 @@ class AutoControlFlow:
         9. Кінець
         """
         
-        # Крок 2: Отримати дані сенсора
-        reading = db.query(models.SensorReading).filter(
+        # Крок 2: Отримати дані сенсора (разом з приміщенням сенсора)
+        row = db.query(models.SensorReading, models.Sensor.room_id).join(
+            models.Sensor, models.SensorReading.sensor_id == models.Sensor.id
+        ).filter(
             models.SensorReading.id == sensor_reading_id
         ).first()
         
-        if not reading:
+        if not row:
             return {"success": False, "error": "Reading not found"}
         
-        sensor = reading.sensor
-        room_id = sensor.room_id
+        reading, room_id = row
         
         # Крок 3: Автокерування?
-        threshold = db.query(models.ClimateThreshold).filter(
+        # Пороги та всі пристрої приміщення завантажуються одним запитом
+        rows = db.query(models.ClimateThreshold, models.ClimateDevice).outerjoin(
+            models.ClimateDevice,
+            models.ClimateDevice.room_id == models.ClimateThreshold.room_id
+        ).filter(
             models.ClimateThreshold.room_id == room_id
-        ).first()
+        ).order_by(models.ClimateDevice.id).all()
+        
+        threshold = rows[0][0] if rows else None
         
         if not threshold or not threshold.auto_control_enabled:
             # Ні -> Кінець
@@ -576,35 +1416,41 @@ class AutoControlFlow:
                 "actions": []
             }
         
+        # Перший пристрій кожного типу (як раніше .first() по типу)
+        devices: Dict[str, models.ClimateDevice] = {}
+        for _, device in rows:
+            if device is not None:
+                devices.setdefault(device.device_type, device)
+        
         actions = []
         
         # Крок 4: Так -> Температура OK?
         temp_ok = True
         if reading.temperature is not None:
-            if threshold.min_temperature and reading.temperature < threshold.min_temperature:
+            if threshold.min_temperature is not None and reading.temperature < threshold.min_temperature:
                 temp_ok = False
-            if threshold.max_temperature and reading.temperature > threshold.max_temperature:
+            if threshold.max_temperature is not None and reading.temperature > threshold.max_temperature:
                 temp_ok = False
         
         # Крок 5: Ні -> Регулювати температуру
         if not temp_ok:
             temp_action = AutoControlFlow._regulate_temperature(
-                db, room_id, reading.temperature, threshold
+                devices, reading.temperature, threshold
             )
             actions.append(temp_action)
         
         # Крок 6: Вологість OK?
         humid_ok = True
         if reading.humidity is not None:
-            if threshold.min_humidity and reading.humidity < threshold.min_humidity:
+            if threshold.min_humidity is not None and reading.humidity < threshold.min_humidity:
                 humid_ok = False
-            if threshold.max_humidity and reading.humidity > threshold.max_humidity:
+            if threshold.max_humidity is not None and reading.humidity > threshold.max_humidity:
                 humid_ok = False
         
         # Крок 7: Ні -> Регулювати вологість
         if not humid_ok:
             humid_action = AutoControlFlow._regulate_humidity(
-                db, room_id, reading.humidity, threshold
+                devices, reading.humidity, threshold
             )
             actions.append(humid_action)
         
@@ -621,33 +1467,22 @@ class AutoControlFlow:
     
     @staticmethod
     def _regulate_temperature(
-        db: Session,
-        room_id: int,
+        devices: Dict[str, models.ClimateDevice],
         temperature: float,
         threshold: models.ClimateThreshold
     ) -> Dict:
-        """Регулювати температуру"""
-        if temperature > threshold.max_temperature:
+        """Регулювати температуру (devices - пристрої приміщення за типом)"""
+        if threshold.max_temperature is not None and temperature > threshold.max_temperature:
             # Охолодження
-            device = db.query(models.ClimateDevice).filter(
-                and_(
-                    models.ClimateDevice.room_id == room_id,
-                    models.ClimateDevice.device_type == "air_conditioner"
-                )
-            ).first()
+            device = devices.get("air_conditioner")
             
             if device:
                 device.status = "on"
-                return {"action": "cooling", "device": device.name, "status": "on"}
-        
-        elif temperature < threshold.min_temperature:
-            # Обігрів
-            device = db.query(models.ClimateDevice).filter(
-                and_(
-                    models.ClimateDevice.room_id == room_id,
-                    models.ClimateDevice.device_type == "heater"
-                )
-            ).first()
+                return {"action": "cooling", "device": device.name, "status": "on"}
+        
+        elif threshold.min_temperature is not None and temperature < threshold.min_temperature:
+            # Обігрів
+            device = devices.get("heater")
             
             if device:
                 device.status = "on"
@@ -657,33 +1492,22 @@ class AutoControlFlow:
     
     @staticmethod
     def _regulate_humidity(
-        db: Session,
-        room_id: int,
+        devices: Dict[str, models.ClimateDevice],
         humidity: float,
         threshold: models.ClimateThreshold
     ) -> Dict:
-        """Регулювати вологість"""
-        if humidity > threshold.max_humidity:
+        """Регулювати вологість (devices - пристрої приміщення за типом)"""
+        if threshold.max_humidity is not None and humidity > threshold.max_humidity:
             # Осушення
-            device = db.query(models.ClimateDevice).filter(
-                and_(
-                    models.ClimateDevice.room_id == room_id,
-                    models.ClimateDevice.device_type == "dehumidifier"
-                )
-            ).first()
+            device = devices.get("dehumidifier")
             
             if device:
                 device.status = "on"
                 return {"action": "dehumidifying", "device": device.name, "status": "on"}
         
-        elif humidity < threshold.min_humidity:
+        elif threshold.min_humidity is not None and humidity < threshold.min_humidity:
             # Зволоження
-            device = db.query(models.ClimateDevice).filter(
-                and_(
-                    models.ClimateDevice.room_id == room_id,
-                    models.ClimateDevice.device_type == "humidifier"
-                )
-            ).first()
+            device = devices.get("humidifier")
             
             if device:
                 device.status = "on"
@@ -696,6 +1520,12 @@ class AutoControlFlow:
 # ВАЛІДАЦІЯ ТА ВИЯВЛЕННЯ АНОМАЛІЙ (Flowchart 2)
 # ============================================
 
+# Результат успішної валідації (спільний незмінний об'єкт - лише для читання)
+_VALID_DATA: Dict[str, Any] = {"valid": True, "errors": ()}
+_TEMPERATURE_RANGE_ERROR = "Temperature out of valid range (-50 to 100)"
+_HUMIDITY_RANGE_ERROR = "Humidity out of valid range (0 to 100)"
+
+
 class DataValidationFlow:
     """
     Процес валідації даних згідно Flowchart 2:
@@ -735,9 +1565,12 @@ class DataValidationFlow:
                 "status": "validation_failed"
             }
         
+        # Один час на весь запит: межа 24-годинної статистики та мітка показника
+        now = datetime.utcnow()
+        
         # Крок 4: Так -> Розрахувати статистику
         stats = DataValidationFlow._calculate_statistics(
-            db, sensor_id, temperature, humidity
+            db, sensor_id, temperature, humidity, now
         )
         
         # Крок 5: Аномалія?
@@ -747,14 +1580,12 @@ class DataValidationFlow:
         
         alert_created = None
         if is_anomaly:
-            # Так -> Створити сповіщення
-            sensor = db.query(models.Sensor).filter(
-                models.Sensor.id == sensor_id
-            ).first()
+            # Так -> Створити сповіщення (приміщення сенсора - з кешу контексту)
+            context = _load_sensor_context(db, sensor_id)
             
-            if sensor:
+            if context is not None:
                 alert = models.Alert(
-                    room_id=sensor.room_id,
+                    room_id=context[0],
                     alert_type="anomaly_detected",
                     message=f"Виявлено аномальні показники: T={temperature}°C, H={humidity}%",
                     severity="warning"
@@ -768,22 +1599,36 @@ class DataValidationFlow:
             temperature=temperature,
             humidity=humidity,
             is_anomaly=is_anomaly,
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         db.add(reading)
+        db.flush()
+        reading_id = reading.id
         db.commit()
-        db.refresh(reading)
         
         # Крок 7: Кінець
         return {
             "success": True,
-            "reading_id": reading.id,
+            "reading_id": reading_id,
             "is_anomaly": is_anomaly,
             "alert_created": alert_created,
             "statistics": stats,
             "status": "saved"
         }
     
+    @staticmethod
+    def is_valid_reading(
+        temperature: Optional[float],
+        humidity: Optional[float]
+    ) -> bool:
+        """
+        Показник можна зберегти: є хоча б одне значення, і всі значення
+        в допустимих діапазонах (крок "Валідні?" без формування помилок)
+        """
+        if temperature is None and humidity is None:
+            return False
+        return DataValidationFlow._validate_data(temperature, humidity)["valid"]
+    
     @staticmethod
     def _validate_data(
         temperature: Optional[float],
@@ -795,19 +1640,23 @@ class DataValidationFlow:
         Перевірки:
         - Температура: -50°C до +100°C
         - Вологість: 0% до 100%
+        
+        Список помилок будується лише для невалідних даних.
         """
-        errors = []
+        temperature_invalid = temperature is not None and not -50 <= temperature <= 100
+        humidity_invalid = humidity is not None and not 0 <= humidity <= 100
         
-        if temperature is not None:
-            if temperature < -50 or temperature > 100:
-                errors.append("Temperature out of valid range (-50 to 100)")
+        if not (temperature_invalid or humidity_invalid):
+            return _VALID_DATA
         
-        if humidity is not None:
-            if humidity < 0 or humidity > 100:
-                errors.append("Humidity out of valid range (0 to 100)")
+        errors = []
+        if temperature_invalid:
+            errors.append(_TEMPERATURE_RANGE_ERROR)
+        if humidity_invalid:
+            errors.append(_HUMIDITY_RANGE_ERROR)
         
         return {
-            "valid": len(errors) == 0,
+            "valid": False,
             "errors": errors
         }
     
@@ -816,37 +1665,49 @@ class DataValidationFlow:
         db: Session,
         sensor_id: int,
         temperature: Optional[float],
-        humidity: Optional[float]
+        humidity: Optional[float],
+        now: datetime
     ) -> Dict[str, Any]:
-        """Розрахувати статистику для сенсора"""
+        """
+        Розрахувати статистику для сенсора
+        
+        Кількість та середні за 24 години рахуються в БД одним запитом,
+        без завантаження показників у Python.
+        """
         # Отримати останні 24 години даних
-        cutoff = datetime.utcnow() - timedelta(hours=24)
+        cutoff = now - timedelta(hours=24)
         
-        recent_readings = db.query(models.SensorReading).filter(
+        count, avg_temp, avg_humid = db.query(
+            func.count(models.SensorReading.id),
+            func.avg(models.SensorReading.temperature),
+            func.avg(models.SensorReading.humidity)
+        ).filter(
             and_(
                 models.SensorReading.sensor_id == sensor_id,
                 models.SensorReading.timestamp >= cutoff
             )
-        ).all()
+        ).one()
         
-        if not recent_readings:
+        if not count:
             return {"message": "Insufficient data for statistics"}
         
-        temps = [r.temperature for r in recent_readings if r.temperature is not None]
-        humids = [r.humidity for r in recent_readings if r.humidity is not None]
+        return {
+            "last_24h_readings": count,
+            "temperature": DataValidationFlow._metric_statistics(temperature, avg_temp),
+            "humidity": DataValidationFlow._metric_statistics(humidity, avg_humid)
+        }
+    
+    @staticmethod
+    def _metric_statistics(current: Optional[float], average: Optional[float]) -> Dict[str, Any]:
+        """Поточне значення, середнє за 24 години та відхилення від нього (округлені до 0.01)"""
+        deviation = None
+        if current is not None and average is not None:
+            deviation = abs(current - float(average))
         
         return {
-            "last_24h_readings": len(recent_readings),
-            "temperature": {
-                "current": temperature,
-                "avg_24h": round(statistics.mean(temps), 2) if temps else None,
-                "deviation": round(abs(temperature - statistics.mean(temps)), 2) if temps and temperature else None
-            },
-            "humidity": {
-                "current": humidity,
-                "avg_24h": round(statistics.mean(humids), 2) if humids else None,
-                "deviation": round(abs(humidity - statistics.mean(humids)), 2) if humids and humidity else None
-            }
+            "current": current,
+            "avg_24h": AnalyticsService._round(average),
+            "deviation": AnalyticsService._round(deviation)
         }
 
 
@@ -884,12 +1745,15 @@ class UserManagementFlow:
         6. Успіх -> Кінець
         """
         
-        # Крок 2: Адміністратор?
-        admin = db.query(models.User).filter(
-            models.User.id == admin_user_id
-        ).first()
+        # Крок 2: Адміністратор? (EXISTS без завантаження рядка користувача)
+        is_admin = db.query(
+            exists().where(
+                models.User.id == admin_user_id,
+                models.User.is_admin.is_(True)
+            )
+        ).scalar()
         
-        if not admin or not admin.is_admin:
+        if not is_admin:
             # Ні -> Відмова в доступі -> Кінець
             return {
                 "success": False,
@@ -928,13 +1792,15 @@ class UserManagementFlow:
                 is_admin=user_data.get("is_admin", False)
             )
             db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
             
-            # Крок 5: Записати зміни (у логи)
+            # Крок 5: Записати зміни (у логи) - тим самим commit, що й користувача
             UserManagementFlow._log_change(
                 db, admin_user_id, "create", f"Created user {new_user.username}"
             )
+            UserManagementFlow._flush_logs(db)
+            db.flush()
+            db.expunge(new_user)
+            db.commit()
             
             # Крок 6: Успіх -> Кінець
             return {
@@ -971,13 +1837,16 @@ class UserManagementFlow:
                     if hasattr(target_user, key) and key != "password":
                         setattr(target_user, key, value)
                 
-                db.commit()
-                db.refresh(target_user)
-                
                 # Крок 5: Записати зміни
                 UserManagementFlow._log_change(
                     db, admin_user_id, "update", f"Updated user {target_user.username}"
                 )
+                UserManagementFlow._flush_logs(db)
+                db.commit()
+                db.refresh(target_user)
+                
+                from auth import invalidate_user_cache
+                invalidate_user_cache(target_user_id)
                 
                 # Крок 6: Успіх -> Кінець
                 return {
@@ -1022,12 +1891,17 @@ class UserManagementFlow:
             
             username = target_user.username
             db.delete(target_user)
-            db.commit()
             
             # Крок 5: Записати зміни
             UserManagementFlow._log_change(
                 db, admin_user_id, "delete", f"Deleted user {username}"
             )
+            UserManagementFlow._flush_logs(db)
+            db.commit()
+            
+            from auth import invalidate_user_cache
+            invalidate_user_cache(target_user_id)
+            invalidate_system_config()
             
             # Крок 6: Успіх -> Кінець
             return {
@@ -1045,11 +1919,239 @@ class UserManagementFlow:
             }
     
     @staticmethod
-    def _validate_user_data(db: Session, user_data: Dict) -> Dict[str, Any]:
-        """Валідувати дані користувача"""
+    def manage_users_batch(
+        db: Session,
+        admin_user_id: int,
+        operations: List[Dict]
+    ) -> Dict[str, Any]:
+        """
+        Пакетне управління користувачами (адміністративна функція)
+        
+        Ті самі кроки Flowchart 3, що й manage_user, але для всього пакета:
+        одна перевірка прав, один SELECT для валідації, по одному
+        INSERT/UPDATE/DELETE на тип операції та один commit.
+        Пакет виконується повністю або не виконується зовсім: за будь-якої
+        помилки валідації зміни не записуються, а details містить індекси
+        операцій з помилками.
+        """
+        
+        # Крок 2: Адміністратор?
+        is_admin = db.query(
+            exists().where(
+                models.User.id == admin_user_id,
+                models.User.is_admin.is_(True)
+            )
+        ).scalar()
+        
+        if not is_admin:
+            return {
+                "success": False,
+                "error": "Access denied",
+                "message": "Only administrators can manage users",
+                "status": "unauthorized"
+            }
+        
+        # Крок 3-4: Валідація всього пакета
+        errors: Dict[int, List[str]] = {}
+        creates: List[Tuple[int, Dict]] = []
+        updates: List[Tuple[int, int, Dict]] = []
+        deletes: List[Tuple[int, int]] = []
+        target_ids: set = set()
+        
+        for index, op in enumerate(operations):
+            operation = op.get("operation")
+            user_data = op.get("user_data") or {}
+            target_user_id = op.get("target_user_id")
+            op_errors = errors.setdefault(index, [])
+            
+            if operation == "create":
+                op_errors.extend(UserManagementFlow._validate_user_fields(user_data))
+                creates.append((index, user_data))
+                continue
+            
+            if operation not in ("update", "delete"):
+                op_errors.append("Operation must be 'create', 'update', or 'delete'")
+                continue
+            
+            if not target_user_id:
+                op_errors.append(f"Target user ID required for {operation}")
+                continue
+            if target_user_id in target_ids:
+                op_errors.append("Duplicate target user ID in batch")
+                continue
+            target_ids.add(target_user_id)
+            
+            if operation == "update":
+                values = {
+                    key: value for key, value in user_data.items()
+                    if key in UserManagementFlow._UPDATABLE_FIELDS
+                }
+                if not values:
+                    op_errors.append("User data required for update")
+                    continue
+                updates.append((index, target_user_id, values))
+            else:
+                if not user_data.get("confirm_delete", False):
+                    op_errors.append("Deletion not confirmed")
+                    continue
+                deletes.append((index, target_user_id))
+        
+        # Існування цільових користувачів - один SELECT
+        usernames: Dict[int, str] = {}
+        if target_ids:
+            usernames = dict(db.execute(
+                select(models.User.id, models.User.username)
+                .where(models.User.id.in_(target_ids))
+            ).all())
+            for index, target_user_id, *_ in updates + deletes:
+                if target_user_id not in usernames:
+                    errors[index].append("User not found")
+        
+        # Унікальність username/email нових користувачів та оновлень - один SELECT.
+        # Власник значення: id користувача або ("new", індекс) для створення,
+        # тому значення, яке вже належить цільовому користувачу, не конфлікт
+        claims = [(index, ("new", index), data) for index, data in creates]
+        claims += [(index, target_user_id, values) for index, target_user_id, values in updates]
+        claimed_usernames = [data["username"] for _, _, data in claims if data.get("username")]
+        claimed_emails = [data["email"] for _, _, data in claims if data.get("email")]
+        
+        if claimed_usernames or claimed_emails:
+            username_owners: Dict[str, Any] = {}
+            email_owners: Dict[str, Any] = {}
+            for user_id, username, email in db.execute(
+                select(models.User.id, models.User.username, models.User.email).where(or_(
+                    models.User.username.in_(claimed_usernames),
+                    models.User.email.in_(claimed_emails)
+                ))
+            ):
+                username_owners[username] = user_id
+                email_owners[email] = user_id
+            
+            for index, owner, data in claims:
+                username = data.get("username")
+                email = data.get("email")
+                if username and username_owners.setdefault(username, owner) != owner:
+                    errors[index].append("Username already exists")
+                if email and email_owners.setdefault(email, owner) != owner:
+                    errors[index].append("Email already exists")
+        
+        details = [
+            {"index": index, "errors": op_errors}
+            for index, op_errors in errors.items() if op_errors
+        ]
+        if details:
+            return {
+                "success": False,
+                "error": "Validation failed",
+                "details": details
+            }
+        
+        # Крок 4: Виконання - по одному запиту на тип операції
+        from auth import get_password_hash, invalidate_user_cache
+        results: Dict[int, Dict[str, Any]] = {}
+        
+        # Унікальний індекс може порушити вже INSERT/UPDATE (значення зайняли
+        # паралельно після валідації), тому під захистом і запити, і commit
+        try:
+            if creates:
+                rows = [
+                    {
+                        "username": data["username"],
+                        "email": data["email"],
+                        "password_hash": get_password_hash(data["password"]),
+                        "first_name": data.get("first_name"),
+                        "last_name": data.get("last_name"),
+                        "is_admin": data.get("is_admin", False)
+                    }
+                    for _, data in creates
+                ]
+                created_ids = dict(
+                    (username, user_id) for user_id, username in db.execute(
+                        insert(models.User).returning(models.User.id, models.User.username),
+                        rows
+                    )
+                )
+                for index, data in creates:
+                    results[index] = {
+                        "operation": "create",
+                        "user_id": created_ids[data["username"]],
+                        "username": data["username"],
+                        "status": "created"
+                    }
+                    UserManagementFlow._log_change(
+                        db, admin_user_id, "create", f"Created user {data['username']}"
+                    )
+            
+            if updates:
+                # ORM bulk UPDATE за первинним ключем: один executemany
+                db.execute(
+                    update(models.User),
+                    [{"id": target_user_id, **values} for _, target_user_id, values in updates]
+                )
+                for index, target_user_id, _ in updates:
+                    results[index] = {
+                        "operation": "update",
+                        "user_id": target_user_id,
+                        "username": usernames[target_user_id],
+                        "status": "updated"
+                    }
+                    UserManagementFlow._log_change(
+                        db, admin_user_id, "update", f"Updated user {usernames[target_user_id]}"
+                    )
+            
+            if deletes:
+                # Дочірні рядки видаляє ON DELETE CASCADE у БД
+                db.execute(
+                    delete(models.User)
+                    .where(models.User.id.in_([target_user_id for _, target_user_id in deletes]))
+                    .execution_options(synchronize_session=False)
+                )
+                for index, target_user_id in deletes:
+                    results[index] = {
+                        "operation": "delete",
+                        "username": usernames[target_user_id],
+                        "status": "deleted"
+                    }
+                    UserManagementFlow._log_change(
+                        db, admin_user_id, "delete", f"Deleted user {usernames[target_user_id]}"
+                    )
+            
+            # Крок 5: Записати зміни - одним commit
+            UserManagementFlow._flush_logs(db)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            db.info.pop("_pending_logs", None)
+            return {
+                "success": False,
+                "error": "Username or email already exists"
+            }
+        
+        for _, target_user_id, _ in updates:
+            invalidate_user_cache(target_user_id)
+        for _, target_user_id in deletes:
+            invalidate_user_cache(target_user_id)
+        if deletes:
+            invalidate_system_config()
+        
+        # Крок 6: Успіх -> Кінець
+        return {
+            "success": True,
+            "processed": len(results),
+            "results": [results[index] for index in range(len(operations))]
+        }
+    
+    # Колонки, які можна змінити пакетним оновленням
+    _UPDATABLE_FIELDS = frozenset({
+        "username", "email", "first_name", "last_name",
+        "phone_number", "is_active", "is_admin"
+    })
+    
+    @staticmethod
+    def _validate_user_fields(user_data: Dict) -> List[str]:
+        """Перевірити обов'язкові поля нового користувача (без запитів до БД)"""
         errors = []
         
-        # Перевірка обов'язкових полів
         if "username" not in user_data or not user_data["username"]:
             errors.append("Username is required")
         elif len(user_data["username"]) < 3:
@@ -1065,19 +2167,28 @@ class UserManagementFlow:
         elif len(user_data["password"]) < 8:
             errors.append("Password must be at least 8 characters")
         
-        # Перевірка унікальності
-        if "username" in user_data:
-            existing = db.query(models.User).filter(
-                models.User.username == user_data["username"]
-            ).first()
-            if existing:
-                errors.append("Username already exists")
+        return errors
+    
+    @staticmethod
+    def _validate_user_data(db: Session, user_data: Dict) -> Dict[str, Any]:
+        """Валідувати дані користувача"""
+        # Перевірка обов'язкових полів
+        errors = UserManagementFlow._validate_user_fields(user_data)
         
+        # Перевірка унікальності: username та email одним запитом
+        conditions = []
+        if "username" in user_data:
+            conditions.append(models.User.username == user_data["username"])
         if "email" in user_data:
-            existing = db.query(models.User).filter(
-                models.User.email == user_data["email"]
-            ).first()
-            if existing:
+            conditions.append(models.User.email == user_data["email"])
+        
+        if conditions:
+            existing = db.query(models.User.username, models.User.email)\
+                .filter(or_(*conditions)).all()
+            
+            if any(username == user_data.get("username") for username, _ in existing):
+                errors.append("Username already exists")
+            if any(email == user_data.get("email") for _, email in existing):
                 errors.append("Email already exists")
         
         return {
@@ -1092,21 +2203,84 @@ class UserManagementFlow:
         action: str,
         description: str
     ):
-        """Записати зміни в лог"""
-        log = models.DeviceLog(
-            device_id=admin_id,
-            device_type="admin_action",
-            log_level="info",
-            message=f"[{action.upper()}] {description}",
-            timestamp=datetime.utcnow()
-        )
-        db.add(log)
+        """
+        Записати зміни в лог
+        
+        Запис додається в буфер сесії (db.info) і потрапляє в БД разом з
+        іншими записами буфера одним INSERT у _flush_logs перед commit.
+        """
+        db.info.setdefault("_pending_logs", []).append({
+            "device_id": admin_id,
+            "device_type": "admin_action",
+            "log_level": "info",
+            "message": f"[{action.upper()}] {description}",
+            "timestamp": datetime.utcnow()
+        })
+    
+    @staticmethod
+    def _flush_logs(db: Session):
+        """Записати буфер логів сесії одним пакетним INSERT (без commit)"""
+        pending_logs = db.info.pop("_pending_logs", None)
+        if pending_logs:
+            db.execute(insert(models.DeviceLog), pending_logs)
 
 
 # ============================================
 # ГЕНЕРАЦІЯ АНАЛІТИЧНОГО ЗВІТУ (Flowchart 4)
 # ============================================
 
+def _report_summary_statement(by_room: bool) -> Select:
+    """
+    Побудувати запит зведення звіту з параметрами :start, :end та :sensor_ids
+    
+    Суми квадратів - для стандартного відхилення, аналіз аномалій та медіани -
+    у тому ж проході через агрегати з FILTER (WHERE is_anomaly) та PERCENTILE_CONT.
+    """
+    reading = models.SensorReading
+    anomalous = reading.is_anomaly == True
+    
+    aggregates = [
+        func.count(reading.id),
+        func.count(reading.temperature),
+        func.sum(reading.temperature),
+        func.sum(reading.temperature * reading.temperature),
+        func.min(reading.temperature),
+        func.max(reading.temperature),
+        func.count(reading.humidity),
+        func.sum(reading.humidity),
+        func.sum(reading.humidity * reading.humidity),
+        func.min(reading.humidity),
+        func.max(reading.humidity),
+        func.count(reading.id).filter(anomalous),
+        func.count(reading.temperature).filter(anomalous),
+        func.count(reading.humidity).filter(anomalous),
+        func.min(reading.timestamp).filter(anomalous),
+        func.max(reading.timestamp).filter(anomalous),
+        func.percentile_cont(0.5).within_group(reading.temperature),
+        func.percentile_cont(0.5).within_group(reading.humidity),
+    ]
+    
+    statement = select(*aggregates).select_from(reading).where(
+        reading.timestamp >= bindparam("start"),
+        reading.timestamp <= bindparam("end")
+    )
+    
+    if by_room:
+        statement = statement.where(
+            reading.sensor_id.in_(bindparam("sensor_ids", expanding=True))
+        )
+    
+    return statement
+
+
+# Запити зведення будуються один раз при імпорті: на кожен звіт лише
+# підставляються параметри, без побудови дерева виразів і ключа кешу компіляції
+_REPORT_SUMMARY_STATEMENTS: Dict[bool, Select] = {
+    by_room: _report_summary_statement(by_room)
+    for by_room in (False, True)
+}
+
+
 class AnalyticsReportFlow:
     """
     Процес генерації аналітики згідно Flowchart 4:
@@ -1116,6 +2290,9 @@ class AnalyticsReportFlow:
     Сформувати звіт -> Кешувати результат -> Повернути дані -> Кінець
     """
     
+    # Звіт за ковзний період застаріває швидше за аналітику, тому TTL коротший
+    _cache_ttl = 300  # 5 хвилин у секундах
+    
     @staticmethod
     def generate_report(
         db: Session,
@@ -1149,96 +2326,93 @@ class AnalyticsReportFlow:
             "period_hours": period_hours
         }
         
-        # Крок 3: Вибрати часовий період
+        # Звіт з тими самими параметрами вже згенеровано - повернути з кешу
+        cache_key = AnalyticsReportFlow._generate_cache_key(params)
+        cached_report = cache_get(cache_key)
+        
+        if cached_report is not None:
+            return {
+                "success": True,
+                "report": cached_report,
+                "status": "cached"
+            }
+        
+        # Крок 3: Вибрати часовий період (один час на весь звіт).
+        # Межі періоду - aware UTC, як і часові мітки з БД (timestamptz),
+        # з якими вони порівнюються; дати без часового поясу вважаються UTC
+        now = datetime.now(timezone.utc)
+        start_date = AnalyticsReportFlow._as_utc(start_date)
+        end_date = AnalyticsReportFlow._as_utc(end_date)
+        
         if period_hours:
-            end_date = datetime.utcnow()
+            end_date = now
             start_date = end_date - timedelta(hours=period_hours)
         elif not start_date:
-            start_date = datetime.utcnow() - timedelta(days=7)
+            start_date = now - timedelta(days=7)
         
         if not end_date:
-            end_date = datetime.utcnow()
+            end_date = now
         
         # Крок 4: Завантажити дані з БД
-        query = db.query(models.SensorReading).join(models.Sensor)
+        # Агрегати рахуються в БД: сирі показники за період не передаються в Python
+        reading = models.SensorReading
+        filters = [reading.timestamp >= start_date, reading.timestamp <= end_date]
+        summary_params = {"start": start_date, "end": end_date}
         
         if room_id:
-            query = query.filter(models.Sensor.room_id == room_id)
+            sensor_ids = _room_sensor_ids(db, room_id)
+            filters.append(_room_readings_filter(db, room_id, sensor_ids))
+            summary_params["sensor_ids"] = sensor_ids
         
-        query = query.filter(
-            and_(
-                models.SensorReading.timestamp >= start_date,
-                models.SensorReading.timestamp <= end_date
-            )
-        )
+        # Усі запити звіту виконуються послідовно на з'єднанні запиту: окремі
+        # сесії в потоках брали б з пулу додаткові з'єднання, поки запит тримає своє
+        statement = _REPORT_SUMMARY_STATEMENTS[bool(room_id)]
+        stats = db.execute(statement, summary_params).one()
         
-        readings = query.order_by(models.SensorReading.timestamp).all()
+        total_readings = stats[0]
         
-        if not readings:
+        if not total_readings:
             return {
                 "success": False,
                 "error": "No data available for specified period",
                 "params": params
             }
         
-        # Крок 5: Розрахувати середні значення
-        temperatures = [r.temperature for r in readings if r.temperature is not None]
-        humidities = [r.humidity for r in readings if r.humidity is not None]
+        median_temp, median_humid = stats[16:]
         
-        avg_temp = statistics.mean(temperatures) if temperatures else None
-        avg_humid = statistics.mean(humidities) if humidities else None
+        periods = AnalyticsReportFlow._period_rows(db, filters)
         
-        # Крок 6: Знайти мін/макс значення
-        min_temp = min(temperatures) if temperatures else None
-        max_temp = max(temperatures) if temperatures else None
-        min_humid = min(humidities) if humidities else None
-        max_humid = max(humidities) if humidities else None
-        
-        # Знайти часові мітки екстремумів
-        min_temp_time = None
-        max_temp_time = None
-        if temperatures:
-            min_temp_reading = min(readings, key=lambda r: r.temperature if r.temperature else float('inf'))
-            max_temp_reading = max(readings, key=lambda r: r.temperature if r.temperature else float('-inf'))
-            min_temp_time = min_temp_reading.timestamp.isoformat()
-            max_temp_time = max_temp_reading.timestamp.isoformat()
+        # Крок 5-6: Середні, мін/макс значення (з часовими мітками екстремумів температури)
+        temperature = AnalyticsReportFlow._field_summary(
+            *stats[1:6], median_temp,
+            timestamps=AnalyticsReportFlow._extreme_timestamps(periods)
+        )
+        humidity = AnalyticsReportFlow._field_summary(*stats[6:11], median_humid)
         
         # Крок 7: Визначити тренди
-        trends = AnalyticsReportFlow._determine_trends(readings)
+        trends = AnalyticsReportFlow._determine_trends(periods, total_readings)
         
         # Додаткова аналітика
-        hourly_stats = AnalyticsReportFlow._calculate_hourly_stats(readings)
-        anomaly_analysis = AnalyticsReportFlow._analyze_anomalies(readings)
+        hourly_stats = AnalyticsReportFlow._calculate_hourly_stats(
+            db, room_id, filters, start_date, end_date
+        )
+        anomaly_analysis = AnalyticsReportFlow._analyze_anomalies(total_readings, *stats[11:16])
         
         # Крок 8: Сформувати звіт
         report = {
             "report_metadata": {
-                "generated_at": datetime.utcnow().isoformat(),
+                "generated_at": now.isoformat(),
                 "period": {
                     "start": start_date.isoformat(),
                     "end": end_date.isoformat(),
                     "duration_hours": (end_date - start_date).total_seconds() / 3600
                 },
                 "room_id": room_id,
-                "total_readings": len(readings)
+                "total_readings": total_readings
             },
             "summary": {
-                "temperature": {
-                    "average": round(avg_temp, 2) if avg_temp else None,
-                    "min": round(min_temp, 2) if min_temp else None,
-                    "max": round(max_temp, 2) if max_temp else None,
-                    "min_timestamp": min_temp_time,
-                    "max_timestamp": max_temp_time,
-                    "median": round(statistics.median(temperatures), 2) if temperatures else None,
-                    "stdev": round(statistics.stdev(temperatures), 2) if len(temperatures) > 1 else None
-                },
-                "humidity": {
-                    "average": round(avg_humid, 2) if avg_humid else None,
-                    "min": round(min_humid, 2) if min_humid else None,
-                    "max": round(max_humid, 2) if max_humid else None,
-                    "median": round(statistics.median(humidities), 2) if humidities else None,
-                    "stdev": round(statistics.stdev(humidities), 2) if len(humidities) > 1 else None
-                }
+                "temperature": temperature,
+                "humidity": humidity
             },
             "trends": trends,
             "hourly_analysis": hourly_stats,
@@ -1246,7 +2420,6 @@ class AnalyticsReportFlow:
         }
         
         # Крок 9: Кешувати результат
-        cache_key = AnalyticsReportFlow._generate_cache_key(params)
         AnalyticsReportFlow._cache_report(cache_key, report)
         
         # Крок 10: Повернути дані
@@ -1259,7 +2432,105 @@ class AnalyticsReportFlow:
         # Крок 11: Кінець
     
     @staticmethod
-    def _determine_trends(readings: List[models.SensorReading]) -> Dict[str, Any]:
+    def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+        """Привести дату до aware UTC (дата без часового поясу вважається UTC)"""
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    
+    @staticmethod
+    def _field_summary(
+        count: int,
+        total: Optional[float],
+        total_squares: Optional[float],
+        minimum: Optional[float],
+        maximum: Optional[float],
+        median: Optional[float],
+        timestamps: Optional[Tuple[Optional[str], Optional[str]]] = None
+    ) -> Dict[str, Any]:
+        """Блок показника у звіті з агрегатів БД (кількість, сума, сума квадратів)"""
+        average = total / count if count else None
+        
+        # Вибіркове відхилення: Σ(x - x̄)² = Σx² - (Σx)² / n
+        stdev = None
+        if count > 1:
+            stdev = math.sqrt(max(total_squares - total * total / count, 0.0) / (count - 1))
+        
+        summary = {
+            "average": AnalyticsService._round(average),
+            "min": AnalyticsService._round(minimum),
+            "max": AnalyticsService._round(maximum),
+        }
+        if timestamps is not None:
+            summary["min_timestamp"], summary["max_timestamp"] = timestamps
+        summary["median"] = AnalyticsService._round(median)
+        summary["stdev"] = AnalyticsService._round(stdev)
+        return summary
+    
+    @staticmethod
+    def _period_rows(db: Session, filters: List) -> List[Row]:
+        """
+        Показники звіту по трьох послідовних періодах одним проходом по даних
+        
+        Кожен показник нумерується за часом (період = позиція / третина кількості,
+        останній забирає залишок) та за температурою в обох напрямках, тому з одного
+        сканування виходять і середні для трендів, і часові мітки екстремумів.
+        Кількість рахується віконною функцією, тому запит не чекає на зведення звіту.
+        
+        Returns:
+            Рядки (період, середня температура, середня вологість,
+            час мінімальної температури, час максимальної температури)
+        """
+        reading = models.SensorReading
+        
+        # Показники без температури - в кінці обох порядків (NULLS LAST на всіх БД)
+        no_temperature = case((reading.temperature.is_(None), 1), else_=0)
+        
+        ranked = db.query(
+            reading.temperature,
+            reading.humidity,
+            reading.timestamp,
+            func.row_number().over(order_by=reading.timestamp).label("position"),
+            (func.count().over() // 3).label("third"),
+            # При однакових значеннях - перше входження за часом
+            func.row_number().over(
+                order_by=(no_temperature, reading.temperature, reading.timestamp)
+            ).label("coldest"),
+            func.row_number().over(
+                order_by=(no_temperature, reading.temperature.desc(), reading.timestamp)
+            ).label("warmest")
+        ).select_from(reading).filter(*filters).subquery()
+        
+        period = case(
+            (ranked.c.position <= ranked.c.third, 0),
+            (ranked.c.position <= 2 * ranked.c.third, 1),
+            else_=2
+        ).label("period")
+        measured = ranked.c.temperature.isnot(None)
+        
+        return db.query(
+            period,
+            func.avg(ranked.c.temperature),
+            func.avg(ranked.c.humidity),
+            func.min(ranked.c.timestamp).filter(ranked.c.coldest == 1, measured),
+            func.min(ranked.c.timestamp).filter(ranked.c.warmest == 1, measured)
+        ).group_by(period).order_by(period).all()
+    
+    @staticmethod
+    def _extreme_timestamps(periods: List[Row]) -> Tuple[Optional[str], Optional[str]]:
+        """Часові мітки мінімальної та максимальної температури (кожна - в одному з періодів)"""
+        minimum = next((row[3] for row in periods if row[3] is not None), None)
+        maximum = next((row[4] for row in periods if row[4] is not None), None)
+        
+        return (
+            minimum.isoformat() if minimum else None,
+            maximum.isoformat() if maximum else None
+        )
+    
+    @staticmethod
+    def _determine_trends(periods: List[Row], total: int) -> Dict[str, Any]:
         """
         Визначити тренди у даних
         
@@ -1268,142 +2539,250 @@ class AnalyticsReportFlow:
         - Волатильність
         - Циклічність
         """
-        if len(readings) < 10:
+        if total < 10:
             return {"status": "insufficient_data"}
         
-        # Розділити на періоди для порівняння
-        third = len(readings) // 3
-        first_period = readings[:third]
-        second_period = readings[third:2*third]
-        third_period = readings[2*third:]
-        
-        # Температурні тренди
-        temp_first = [r.temperature for r in first_period if r.temperature is not None]
-        temp_second = [r.temperature for r in second_period if r.temperature is not None]
-        temp_third = [r.temperature for r in third_period if r.temperature is not None]
-        
-        temp_trend = "unknown"
-        if temp_first and temp_second and temp_third:
-            avg1 = statistics.mean(temp_first)
-            avg2 = statistics.mean(temp_second)
-            avg3 = statistics.mean(temp_third)
-            
-            if avg3 > avg2 > avg1:
-                temp_trend = "increasing"
-            elif avg3 < avg2 < avg1:
-                temp_trend = "decreasing"
-            elif abs(avg3 - avg1) < 1.0:
-                temp_trend = "stable"
-            else:
-                temp_trend = "fluctuating"
-        
-        # Тренди вологості
-        humid_first = [r.humidity for r in first_period if r.humidity is not None]
-        humid_second = [r.humidity for r in second_period if r.humidity is not None]
-        humid_third = [r.humidity for r in third_period if r.humidity is not None]
-        
-        humid_trend = "unknown"
-        if humid_first and humid_second and humid_third:
-            avg1 = statistics.mean(humid_first)
-            avg2 = statistics.mean(humid_second)
-            avg3 = statistics.mean(humid_third)
-            
-            if avg3 > avg2 > avg1:
-                humid_trend = "increasing"
-            elif avg3 < avg2 < avg1:
-                humid_trend = "decreasing"
-            elif abs(avg3 - avg1) < 3.0:
-                humid_trend = "stable"
-            else:
-                humid_trend = "fluctuating"
+        # Температурні тренди (стабільність - різниця менше 1°C)
+        temp_trend = AnalyticsReportFlow._classify_periods([row[1] for row in periods], 1.0)
+        
+        # Тренди вологості (стабільність - різниця менше 3%)
+        humid_trend = AnalyticsReportFlow._classify_periods([row[2] for row in periods], 3.0)
         
         return {
             "temperature_trend": temp_trend,
             "humidity_trend": humid_trend,
             "analysis_periods": 3,
-            "readings_per_period": third
+            "readings_per_period": total // 3
         }
     
     @staticmethod
-    def _calculate_hourly_stats(readings: List[models.SensorReading]) -> List[Dict]:
-        """Розрахувати статистику по годинах"""
-        hourly_data = {}
+    def _classify_periods(means: List[Optional[float]], stable_delta: float) -> str:
+        """
+        Тренд за середніми значеннями трьох послідовних періодів
         
-        for reading in readings:
-            hour_key = reading.timestamp.strftime("%Y-%m-%d %H:00")
+        Args:
+            means: середні по періодах з БД (AVG повертає NULL, якщо в періоді немає значень)
+            stable_delta: максимальна різниця першого та останнього періоду для "stable"
+        """
+        if len(means) != 3 or None in means:
+            return "unknown"
+        
+        avg1, avg2, avg3 = map(float, means)
+        
+        if avg3 > avg2 > avg1:
+            return "increasing"
+        if avg3 < avg2 < avg1:
+            return "decreasing"
+        if abs(avg3 - avg1) < stable_delta:
+            return "stable"
+        return "fluctuating"
+    
+    @staticmethod
+    def _calculate_hourly_stats(
+        db: Session,
+        room_id: Optional[int],
+        filters: List,
+        start_date: datetime,
+        end_date: datetime
+    ) -> List[Dict]:
+        """
+        Розрахувати статистику по годинах
+        
+        Повні години періоду беруться з sensor_reading_hourly (рядок на годину
+        та приміщення). Неповні години на краях періоду та показники, ще не
+        зведені в агрегати (id більший за last_reading_id), групуються по сирих
+        показниках (GROUP BY години в БД) і додаються до сум тих самих годин.
+        
+        Args:
+            filters: фільтри сирих показників звіту (період та сенсори приміщення)
+            start_date, end_date: межі періоду (aware UTC)
+        """
+        reading = models.SensorReading
+        hourly = models.SensorReadingHourly
+        
+        # Перша година, що повністю входить у період
+        rollup_start = start_date.replace(minute=0, second=0, microsecond=0)
+        if rollup_start < start_date:
+            rollup_start += timedelta(hours=1)
+        
+        # Година з кінцем періоду неповна
+        rollup_end = end_date.replace(minute=0, second=0, microsecond=0)
+        
+        last_reading_id = None
+        if rollup_end > rollup_start and _rollup_table_exists(db):
+            last_reading_id = db.query(func.max(hourly.last_reading_id)).scalar()
+        
+        # година -> [сума температур, кількість, сума вологості, кількість]
+        buckets = {}
+        
+        if last_reading_id is not None:
+            query = db.query(
+                hourly.hour_bucket,
+                func.sum(hourly.temperature_count),
+                func.sum(hourly.temperature_sum),
+                func.sum(hourly.humidity_count),
+                func.sum(hourly.humidity_sum)
+            ).filter(hourly.hour_bucket >= rollup_start, hourly.hour_bucket < rollup_end)
             
-            if hour_key not in hourly_data:
-                hourly_data[hour_key] = {
-                    "temperatures": [],
-                    "humidities": []
-                }
+            if room_id:
+                query = query.filter(hourly.room_id == room_id)
             
-            if reading.temperature is not None:
-                hourly_data[hour_key]["temperatures"].append(reading.temperature)
-            if reading.humidity is not None:
-                hourly_data[hour_key]["humidities"].append(reading.humidity)
-        
-        # Обчислити середні по годинах
-        hourly_stats = []
-        for hour, data in sorted(hourly_data.items()):
-            stat = {
-                "hour": hour,
-                "temperature_avg": round(statistics.mean(data["temperatures"]), 2) if data["temperatures"] else None,
-                "humidity_avg": round(statistics.mean(data["humidities"]), 2) if data["humidities"] else None,
-                "readings_count": len(data["temperatures"]) + len(data["humidities"])
+            for bucket, temp_count, temp_sum, humid_count, humid_sum in query.group_by(hourly.hour_bucket):
+                buckets[bucket] = [temp_sum or 0.0, temp_count, humid_sum or 0.0, humid_count]
+            
+            filters = filters + [or_(
+                reading.timestamp < rollup_start,
+                reading.timestamp >= rollup_end,
+                reading.id > last_reading_id
+            )]
+        
+        hour = func.date_trunc("hour", reading.timestamp).label("hour")
+        
+        rows = db.query(
+            hour,
+            func.sum(reading.temperature),
+            func.count(reading.temperature),
+            func.sum(reading.humidity),
+            func.count(reading.humidity)
+        ).select_from(reading).filter(*filters).group_by(hour)
+        
+        for bucket, temp_sum, temp_count, humid_sum, humid_count in rows:
+            sums = buckets.setdefault(bucket, [0.0, 0, 0.0, 0])
+            sums[0] += temp_sum or 0.0
+            sums[1] += temp_count
+            sums[2] += humid_sum or 0.0
+            sums[3] += humid_count
+        
+        return [
+            {
+                "hour": bucket.strftime("%Y-%m-%d %H:00"),
+                "temperature_avg": AnalyticsService._round(temp_sum / temp_count if temp_count else None),
+                "humidity_avg": AnalyticsService._round(humid_sum / humid_count if humid_count else None),
+                "readings_count": temp_count + humid_count
             }
-            hourly_stats.append(stat)
-        
-        return hourly_stats
+            for bucket, (temp_sum, temp_count, humid_sum, humid_count) in sorted(buckets.items())
+        ]
     
     @staticmethod
-    def _analyze_anomalies(readings: List[models.SensorReading]) -> Dict[str, Any]:
-        """Аналізувати аномалії"""
-        anomalies = [r for r in readings if r.is_anomaly]
-        
-        if not anomalies:
+    def _analyze_anomalies(
+        total_readings: int,
+        total_anomalies: int,
+        temp_anomalies: int,
+        humid_anomalies: int,
+        first_anomaly: Optional[datetime],
+        last_anomaly: Optional[datetime]
+    ) -> Dict[str, Any]:
+        """Аналізувати аномалії (лічильники та часові межі з агрегатного запиту звіту)"""
+        if not total_anomalies:
             return {
                 "total_anomalies": 0,
                 "anomaly_rate": 0,
                 "status": "no_anomalies"
             }
         
-        # Групувати аномалії по типу (температура/вологість)
-        temp_anomalies = []
-        humid_anomalies = []
-        
-        for anomaly in anomalies:
-            if anomaly.temperature is not None:
-                temp_anomalies.append(anomaly.temperature)
-            if anomaly.humidity is not None:
-                humid_anomalies.append(anomaly.humidity)
-        
         return {
-            "total_anomalies": len(anomalies),
-            "anomaly_rate": round(len(anomalies) / len(readings) * 100, 2),
-            "temperature_anomalies": len(temp_anomalies),
-            "humidity_anomalies": len(humid_anomalies),
-            "first_anomaly": anomalies[0].timestamp.isoformat(),
-            "last_anomaly": anomalies[-1].timestamp.isoformat()
+            "total_anomalies": total_anomalies,
+            "anomaly_rate": round(total_anomalies / total_readings * 100, 2),
+            "temperature_anomalies": temp_anomalies,
+            "humidity_anomalies": humid_anomalies,
+            "first_anomaly": first_anomaly.isoformat(),
+            "last_anomaly": last_anomaly.isoformat()
         }
     
     @staticmethod
     def _generate_cache_key(params: Dict) -> str:
         """Згенерувати ключ для кешування"""
-        key_string = json.dumps(params, sort_keys=True, default=str)
-        return f"report_{hashlib.md5(key_string.encode()).hexdigest()}"
+        # orjson серіалізує datetime напряму, blake2b-128 швидший за md5 на коротких ключах
+        key_bytes = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        return f"report_{hashlib.blake2b(key_bytes, digest_size=16).hexdigest()}"
     
     @staticmethod
     def _cache_report(cache_key: str, report: Dict):
-        """Кешувати результат (заглушка - можна використати Redis)"""
-        # В реальному застосунку тут буде Redis
-        pass
+        """Кешувати результат у Redis (SETEX, ttl=5хв)"""
+        cache_set(cache_key, report, AnalyticsReportFlow._cache_ttl)
 
 
 # ============================================
 # ВИЯВЛЕННЯ АНОМАЛІЙ (існуюча логіка)
 # ============================================
 
+class RollingStats:
+    """
+    Середнє та дисперсія по останніх N значеннях (ковзний алгоритм Велфорда)
+    
+    Додавання значення (та витіснення найстарішого) - O(1), без перерахунку вікна.
+    Похибка округлення від віднімання витіснених значень накопичується,
+    тому раз на повну заміну вікна середнє та M2 перераховуються точно
+    (амортизовано O(1) на значення).
+    """
+    __slots__ = ("values", "mean", "m2", "evictions")
+    
+    def __init__(self, window: int):
+        self.values = deque(maxlen=window)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.evictions = 0
+    
+    def push(self, value: float) -> None:
+        """Додати значення у вікно"""
+        if len(self.values) == self.values.maxlen:
+            old = self.values.popleft()
+            n = len(self.values)
+            if n:
+                delta = old - self.mean
+                self.mean -= delta / n
+                self.m2 -= delta * (old - self.mean)
+            else:
+                self.mean = 0.0
+                self.m2 = 0.0
+            self.evictions += 1
+        
+        self.values.append(value)
+        
+        if self.evictions >= self.values.maxlen:
+            self._recompute()
+            return
+        
+        delta = value - self.mean
+        self.mean += delta / len(self.values)
+        self.m2 = max(self.m2 + delta * (value - self.mean), 0.0)
+    
+    def copy(self) -> "RollingStats":
+        """Незалежна копія вікна та накопичених значень"""
+        clone = RollingStats(self.values.maxlen)
+        clone.values.extend(self.values)
+        clone.mean = self.mean
+        clone.m2 = self.m2
+        clone.evictions = self.evictions
+        return clone
+    
+    def _recompute(self) -> None:
+        """Точно перерахувати середнє та M2 по всьому вікну (два проходи)"""
+        n = len(self.values)
+        self.mean = sum(self.values) / n
+        self.m2 = sum((value - self.mean) ** 2 for value in self.values)
+        self.evictions = 0
+    
+    def is_outlier(self, value: float, sigmas: float = 3.0) -> bool:
+        """Чи відхиляється значення від середнього більше ніж на sigmas стандартних відхилень"""
+        n = len(self.values)
+        if n < 2:
+            return False
+        stdev = math.sqrt(self.m2 / (n - 1))
+        return abs(value - self.mean) > sigmas * stdev
+
+
+# Стан детектора аномалій (LRU): sensor_id -> (час заповнення з БД, температура, вологість)
+# Після ANOMALY_STATE_TTL вікно перечитується з БД, щоб врахувати показники,
+# збережені в обхід детектора (звичайний POST /readings, очищення старих даних)
+ANOMALY_WINDOW = 100
+ANOMALY_MIN_SAMPLES = 10
+ANOMALY_STATE_TTL = 600  # секунд
+ANOMALY_STATE_MAX_SIZE = 10000
+_anomaly_state: "OrderedDict[int, Tuple[float, RollingStats, RollingStats]]" = OrderedDict()
+_anomaly_state_lock = threading.Lock()
+
+
 class AnomalyDetector:
     """Детектор аномалій у даних сенсорів"""
     
@@ -1419,41 +2798,168 @@ class AnomalyDetector:
         
         Використовує метод стандартного відхилення:
         - Значення вважається аномальним, якщо воно відхиляється більш ніж на 3 sigma
+        
+        Статистика останніх 100 показників зберігається в пам'яті та оновлюється
+        інкрементально, тому БД читається лише при першому зверненні до сенсора.
+        Перевірений показник додається у вікно (усі виклики його зберігають).
         """
-        # Отримати останні 100 показників для статистичного аналізу
-        recent_readings = db.query(models.SensorReading).filter(
-            models.SensorReading.sensor_id == sensor_id
-        ).order_by(desc(models.SensorReading.timestamp)).limit(100).all()
+        temp_stats, humid_stats = AnomalyDetector._get_state(db, sensor_id)
         
-        if len(recent_readings) < 10:
-            # Недостатньо даних для виявлення аномалій
-            return False
+        with _anomaly_state_lock:
+            return AnomalyDetector._check_and_push(temp_stats, humid_stats, temperature, humidity)
+    
+    @staticmethod
+    def detect_anomalies(
+        db: Session,
+        readings: List[Tuple[int, Optional[float], Optional[float]]]
+    ) -> List[bool]:
+        """
+        Виявити аномалії у пакеті показників (sensor_id, температура, вологість)
         
+        Показники перевіряються на копіях ковзної статистики, тому кожен враховує
+        попередні показники свого сенсора в пакеті, а збережена статистика не
+        змінюється. Після commit показники додаються до неї через record_readings.
+        """
+        AnomalyDetector.prime_states(db, [sensor_id for sensor_id, _, _ in readings])
+        
+        states: Dict[int, Tuple[RollingStats, RollingStats]] = {}
+        flags = []
+        
+        for sensor_id, temperature, humidity in readings:
+            state = states.get(sensor_id)
+            if state is None:
+                temp_stats, humid_stats = AnomalyDetector._get_state(db, sensor_id)
+                with _anomaly_state_lock:
+                    state = states[sensor_id] = (temp_stats.copy(), humid_stats.copy())
+            flags.append(AnomalyDetector._check_and_push(*state, temperature, humidity))
+        
+        return flags
+    
+    @staticmethod
+    def record_readings(readings: List[Tuple[int, Optional[float], Optional[float]]]) -> None:
+        """
+        Додати збережені показники до ковзної статистики сенсорів
+        
+        Сенсори без стану пропускаються: їхнє вікно буде прочитане з БД
+        разом із цими показниками.
+        """
+        with _anomaly_state_lock:
+            for sensor_id, temperature, humidity in readings:
+                state = _anomaly_state.get(sensor_id)
+                if state is None:
+                    continue
+                if temperature is not None:
+                    state[1].push(temperature)
+                if humidity is not None:
+                    state[2].push(humidity)
+    
+    @staticmethod
+    def _check_and_push(
+        temp_stats: RollingStats,
+        humid_stats: RollingStats,
+        temperature: Optional[float],
+        humidity: Optional[float]
+    ) -> bool:
+        """Перевірити показник на 3 sigma та додати його у вікно"""
         is_anomaly = False
         
         # Перевірка температури
         if temperature is not None:
-            temps = [r.temperature for r in recent_readings if r.temperature is not None]
-            if len(temps) >= 10:
-                is_anomaly = is_anomaly or AnomalyDetector._is_outlier(temperature, temps)
+            if len(temp_stats.values) >= ANOMALY_MIN_SAMPLES:
+                is_anomaly = temp_stats.is_outlier(temperature)
+            temp_stats.push(temperature)
         
         # Перевірка вологості
         if humidity is not None:
-            humids = [r.humidity for r in recent_readings if r.humidity is not None]
-            if len(humids) >= 10:
-                is_anomaly = is_anomaly or AnomalyDetector._is_outlier(humidity, humids)
+            if len(humid_stats.values) >= ANOMALY_MIN_SAMPLES:
+                is_anomaly = humid_stats.is_outlier(humidity) or is_anomaly
+            humid_stats.push(humidity)
         
         return is_anomaly
     
     @staticmethod
-    def _is_outlier(value: float, historical_values: List[float]) -> bool:
-        """Перевірити чи є значення аномальним (3-sigma правило)"""
-        if len(historical_values) < 2:
-            return False
+    def _get_state(db: Session, sensor_id: int) -> Tuple[RollingStats, RollingStats]:
+        """Повернути ковзну статистику сенсора, заповнивши її з БД за потреби"""
+        now = time.monotonic()
+        
+        with _anomaly_state_lock:
+            state = _anomaly_state.get(sensor_id)
+            if state is not None and now - state[0] < ANOMALY_STATE_TTL:
+                _anomaly_state.move_to_end(sensor_id)
+                return state[1], state[2]
+        
+        # Отримати останні 100 показників для статистичного аналізу
+        recent_readings = db.query(
+            models.SensorReading.temperature,
+            models.SensorReading.humidity
+        ).filter(
+            models.SensorReading.sensor_id == sensor_id
+        ).order_by(desc(models.SensorReading.timestamp)).limit(ANOMALY_WINDOW).all()
+        
+        # Від найстаріших до найновіших
+        return AnomalyDetector._store_state(sensor_id, now, reversed(recent_readings))
+    
+    @staticmethod
+    def prime_states(db: Session, sensor_ids: List[int]):
+        """
+        Заповнити ковзну статистику кількох сенсорів одним запитом
+        
+        Для пакетної обробки: останні 100 показників кожного сенсора без
+        актуального стану вибираються через ROW_NUMBER() OVER (PARTITION BY sensor_id),
+        тому detect_anomaly в межах пакета вже не звертається до БД.
+        """
+        now = time.monotonic()
+        
+        with _anomaly_state_lock:
+            missing = [
+                sensor_id for sensor_id in set(sensor_ids)
+                if sensor_id not in _anomaly_state
+                or now - _anomaly_state[sensor_id][0] >= ANOMALY_STATE_TTL
+            ]
+        if not missing:
+            return
+        
+        reading = models.SensorReading
+        ranked = db.query(
+            reading.sensor_id,
+            reading.temperature,
+            reading.humidity,
+            func.row_number().over(
+                partition_by=reading.sensor_id,
+                order_by=desc(reading.timestamp)
+            ).label("position")
+        ).filter(reading.sensor_id.in_(missing)).subquery()
+        
+        # Від найстаріших до найновіших у межах кожного сенсора
+        rows = db.query(ranked.c.sensor_id, ranked.c.temperature, ranked.c.humidity)\
+            .filter(ranked.c.position <= ANOMALY_WINDOW)\
+            .order_by(ranked.c.sensor_id, desc(ranked.c.position)).all()
+        
+        readings_by_sensor: Dict[int, List[Tuple[Optional[float], Optional[float]]]] = {
+            sensor_id: [] for sensor_id in missing
+        }
+        for sensor_id, temperature, humidity in rows:
+            readings_by_sensor[sensor_id].append((temperature, humidity))
+        
+        for sensor_id, readings in readings_by_sensor.items():
+            AnomalyDetector._store_state(sensor_id, now, readings)
+    
+    @staticmethod
+    def _store_state(sensor_id: int, now: float, readings) -> Tuple[RollingStats, RollingStats]:
+        """Побудувати статистику з пар (температура, вологість) та зберегти її в кеш"""
+        temp_stats = RollingStats(ANOMALY_WINDOW)
+        humid_stats = RollingStats(ANOMALY_WINDOW)
+        
+        for temperature, humidity in readings:
+            if temperature is not None:
+                temp_stats.push(temperature)
+            if humidity is not None:
+                humid_stats.push(humidity)
         
-        mean = statistics.mean(historical_values)
-        stdev = statistics.stdev(historical_values)
+        with _anomaly_state_lock:
+            _anomaly_state[sensor_id] = (now, temp_stats, humid_stats)
+            _anomaly_state.move_to_end(sensor_id)
+            if len(_anomaly_state) > ANOMALY_STATE_MAX_SIZE:
+                _anomaly_state.popitem(last=False)
         
-        # Значення є аномальним якщо воно більше ніж 3 стандартних відхилення від середнього
-        threshold = 3 * stdev
-        return abs(value - mean) > threshold
\ No newline at end of file
+        return temp_stats, humid_stats
\ No newline at end of file
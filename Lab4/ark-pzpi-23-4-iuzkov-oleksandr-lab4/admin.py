@@ -3,21 +3,29 @@
 Включає управління даними, резервне копіювання, експорт/імпорт, логування
 """
 
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy import func, and_, or_, case, update, delete, insert, select, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import json
-import csv
-import io
+from typing import Iterator, List, Dict, Optional, Tuple
+import orjson
+import time
 
 import models
+from auth import invalidate_user_cache
+from business_logic import AnalyticsRollup, invalidate_system_config
+from database import CLEANUP_STATEMENT_TIMEOUT_MS, statement_timeout
 
 
 # ============================================
 # УПРАВЛІННЯ КОРИСТУВАЧАМИ
 # ============================================
 
+# Кеш кількості користувачів для списку: (час, всього, активних)
+USER_COUNT_CACHE_TTL = 30  # секунд
+_user_count_cache: Optional[Tuple[float, int, int]] = None
+
+
 class UserManagement:
     """Адміністративні функції для управління користувачами"""
     
@@ -26,29 +34,39 @@ class UserManagement:
         db: Session,
         skip: int = 0,
         limit: int = 100,
-        is_active: Optional[bool] = None
+        is_active: Optional[bool] = None,
+        include_relations: bool = False
     ) -> List[models.User]:
-        """Отримати список всіх користувачів системи"""
+        """
+        Отримати список всіх користувачів системи
+        
+        include_relations=True одразу підвантажує кімнати та команди пристроїв
+        (по одному додатковому SELECT ... IN на зв'язок замість запиту на кожного користувача)
+        """
         query = db.query(models.User)
         
         if is_active is not None:
             query = query.filter(models.User.is_active == is_active)
         
+        if include_relations:
+            query = query.options(
+                selectinload(models.User.rooms),
+                selectinload(models.User.device_commands)
+            )
+        
         return query.offset(skip).limit(limit).all()
     
     @staticmethod
     def get_user_statistics(db: Session) -> Dict:
-        """Отримати статистику по користувачам"""
-        total_users = db.query(func.count(models.User.id)).scalar()
-        active_users = db.query(func.count(models.User.id)).filter(
-            models.User.is_active == True
-        ).scalar()
-        
+        """Отримати статистику по користувачам (один запит з умовною агрегацією)"""
         # Користувачі зареєстровані за останні 30 днів
         cutoff_date = datetime.utcnow() - timedelta(days=30)
-        new_users = db.query(func.count(models.User.id)).filter(
-            models.User.created_at >= cutoff_date
-        ).scalar()
+        
+        total_users, active_users, new_users = db.query(
+            func.count(models.User.id),
+            func.count(case((models.User.is_active == True, 1))),
+            func.count(case((models.User.created_at >= cutoff_date, 1)))
+        ).one()
         
         return {
             "total_users": total_users,
@@ -57,45 +75,87 @@ class UserManagement:
             "new_users_last_30_days": new_users
         }
     
+    @staticmethod
+    def count_users(db: Session, is_active: Optional[bool] = None) -> int:
+        """
+        Кількість користувачів (всього або з фільтром is_active)
+        
+        Обидва лічильники рахуються одним запитом з умовною агрегацією
+        та кешуються на USER_COUNT_CACHE_TTL секунд, тому сторінки списку
+        не виконують COUNT по всій таблиці на кожен запит.
+        """
+        global _user_count_cache
+        
+        cached = _user_count_cache
+        if cached is None or time.monotonic() - cached[0] >= USER_COUNT_CACHE_TTL:
+            total, active = db.query(
+                func.count(models.User.id),
+                func.count(case((models.User.is_active == True, 1)))
+            ).one()
+            cached = _user_count_cache = (time.monotonic(), total, active)
+        
+        _, total, active = cached
+        
+        if is_active is None:
+            return total
+        return active if is_active else total - active
+    
     @staticmethod
     def deactivate_user(db: Session, user_id: int) -> Dict:
         """Деактивувати користувача"""
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        username = UserManagement._set_user_active(db, user_id, False)
         
-        if not user:
+        if username is None:
             return {"success": False, "message": "User not found"}
         
-        user.is_active = False
-        db.commit()
-        
         return {
             "success": True,
-            "message": f"User {user.username} deactivated"
+            "message": f"User {username} deactivated"
         }
     
     @staticmethod
     def activate_user(db: Session, user_id: int) -> Dict:
         """Активувати користувача"""
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        username = UserManagement._set_user_active(db, user_id, True)
         
-        if not user:
+        if username is None:
             return {"success": False, "message": "User not found"}
         
-        user.is_active = True
-        db.commit()
-        
         return {
             "success": True,
-            "message": f"User {user.username} activated"
+            "message": f"User {username} activated"
         }
     
+    @staticmethod
+    def _set_user_active(db: Session, user_id: int, is_active: bool) -> Optional[str]:
+        """
+        Змінити is_active одним UPDATE ... RETURNING без завантаження користувача
+        
+        Returns:
+            username або None, якщо користувача не знайдено
+        """
+        row = db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(is_active=is_active)
+            .returning(models.User.username)
+        ).first()
+        
+        if row is None:
+            return None
+        
+        db.commit()
+        invalidate_user_cache(user_id)
+        
+        return row.username
+    
     @staticmethod
     def delete_user_data(db: Session, user_id: int) -> Dict:
         """
         Видалити всі дані користувача (GDPR compliance)
         CASCADE видалить всі повʼязані записи
         """
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        user = db.get(models.User, user_id)
         
         if not user:
             return {"success": False, "message": "User not found"}
@@ -104,6 +164,8 @@ class UserManagement:
         
         db.delete(user)
         db.commit()
+        invalidate_user_cache(user_id)
+        invalidate_system_config()
         
         return {
             "success": True,
@@ -120,35 +182,71 @@ class DataManagement:
     
     @staticmethod
     def get_system_statistics(db: Session) -> Dict:
-        """Отримати загальну статистику системи"""
-        return {
+        """
+        Отримати загальну статистику системи
+        
+        Один SELECT: кожна таблиця агрегується в підзапиті з умовними лічильниками
+        (один прохід по таблиці), а однорядкові підзапити з'єднуються між собою.
+        Не кешується: кеш статистики дашборду - у /api/admin/statistics.
+        """
+        users = select(
+            func.count(models.User.id).label("total"),
+            func.count(case((models.User.is_active == True, 1))).label("active")
+        ).subquery()
+        rooms = select(func.count(models.Room.id).label("total")).subquery()
+        sensors = select(
+            func.count(models.Sensor.id).label("total"),
+            func.count(case((models.Sensor.status == "active", 1))).label("active")
+        ).subquery()
+        devices = select(
+            func.count(models.ClimateDevice.id).label("total"),
+            func.count(case((models.ClimateDevice.status == "on", 1))).label("on")
+        ).subquery()
+        readings = select(func.count(models.SensorReading.id).label("total")).subquery()
+        alerts = select(
+            func.count(models.Alert.id).label("total"),
+            func.count(case((models.Alert.is_read == False, 1))).label("unread")
+        ).subquery()
+        
+        row = db.execute(
+            select(
+                users.c.total, users.c.active,
+                rooms.c.total,
+                sensors.c.total, sensors.c.active,
+                devices.c.total, devices.c.on,
+                readings.c.total,
+                alerts.c.total, alerts.c.unread
+            ).select_from(
+                users.join(rooms, true())
+                .join(sensors, true())
+                .join(devices, true())
+                .join(readings, true())
+                .join(alerts, true())
+            )
+        ).one()
+        
+        stats = {
             "users": {
-                "total": db.query(func.count(models.User.id)).scalar(),
-                "active": db.query(func.count(models.User.id)).filter(
-                    models.User.is_active == True
-                ).scalar()
+                "total": row[0],
+                "active": row[1]
             },
-            "rooms": db.query(func.count(models.Room.id)).scalar(),
+            "rooms": row[2],
             "sensors": {
-                "total": db.query(func.count(models.Sensor.id)).scalar(),
-                "active": db.query(func.count(models.Sensor.id)).filter(
-                    models.Sensor.status == "active"
-                ).scalar()
+                "total": row[3],
+                "active": row[4]
             },
             "climate_devices": {
-                "total": db.query(func.count(models.ClimateDevice.id)).scalar(),
-                "on": db.query(func.count(models.ClimateDevice.id)).filter(
-                    models.ClimateDevice.status == "on"
-                ).scalar()
+                "total": row[5],
+                "on": row[6]
             },
-            "sensor_readings": db.query(func.count(models.SensorReading.id)).scalar(),
+            "sensor_readings": row[7],
             "alerts": {
-                "total": db.query(func.count(models.Alert.id)).scalar(),
-                "unread": db.query(func.count(models.Alert.id)).filter(
-                    models.Alert.is_read == False
-                ).scalar()
+                "total": row[8],
+                "unread": row[9]
             }
         }
+        
+        return stats
     
     @staticmethod
     def cleanup_old_data(
@@ -159,28 +257,35 @@ class DataManagement:
         Очистити старі дані для оптимізації БД
         Видаляє показники сенсорів та логи старші за вказану кількість днів
         """
-        cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
+        now = datetime.utcnow()
+        cutoff_date = now - timedelta(days=days_to_keep)
         
         # Видалити старі показники сенсорів
-        deleted_readings = db.query(models.SensorReading).filter(
+        deleted_readings = DataManagement._delete_in_chunks(
+            db, models.SensorReading,
             models.SensorReading.timestamp < cutoff_date
-        ).delete()
+        )
+        
+        # Агрегати видалених годин (остання - частково) перерахувати
+        if deleted_readings:
+            AnalyticsRollup.recompute(db, None, None, cutoff_date)
+            db.commit()
         
         # Видалити старі логи пристроїв
-        deleted_logs = db.query(models.DeviceLog).filter(
+        deleted_logs = DataManagement._delete_in_chunks(
+            db, models.DeviceLog,
             models.DeviceLog.timestamp < cutoff_date
-        ).delete()
+        )
         
         # Видалити прочитані alerts старші 30 днів
-        alert_cutoff = datetime.utcnow() - timedelta(days=30)
-        deleted_alerts = db.query(models.Alert).filter(
+        alert_cutoff = now - timedelta(days=30)
+        deleted_alerts = DataManagement._delete_in_chunks(
+            db, models.Alert,
             and_(
                 models.Alert.created_at < alert_cutoff,
                 models.Alert.is_read == True
             )
-        ).delete()
-        
-        db.commit()
+        )
         
         return {
             "success": True,
@@ -190,6 +295,33 @@ class DataManagement:
             "cutoff_date": cutoff_date.isoformat()
         }
     
+    @staticmethod
+    def _delete_in_chunks(db: Session, model, criterion, chunk_size: int = 10000) -> int:
+        """
+        Видалити рядки порціями по chunk_size з commit після кожної порції
+        
+        Короткі транзакції не тримають блокування на всю таблицю та дають
+        autovacuum встигати. synchronize_session=False - без перебору сесії.
+        Кожна порція обмежена CLEANUP_STATEMENT_TIMEOUT_MS.
+        
+        Returns:
+            Загальна кількість видалених рядків
+        """
+        total_deleted = 0
+        
+        while True:
+            chunk_ids = select(model.id).where(criterion).limit(chunk_size)
+            with statement_timeout(db, CLEANUP_STATEMENT_TIMEOUT_MS):
+                deleted = db.execute(
+                    delete(model).where(model.id.in_(chunk_ids)),
+                    execution_options={"synchronize_session": False}
+                ).rowcount
+            db.commit()
+            
+            total_deleted += deleted
+            if deleted < chunk_size:
+                return total_deleted
+    
     @staticmethod
     def get_database_size_info(db: Session) -> Dict:
         """Отримати інформацію про розмір даних у БД"""
@@ -205,73 +337,264 @@ class DataManagement:
 # ЕКСПОРТ ДАНИХ
 # ============================================
 
+# Заголовок CSV (з BOM для правильного відображення UTF-8 в Excel)
+# та формат рядка створюються один раз при імпорті модуля
+_CSV_HEADER = (
+    '\ufeffreading_id,sensor_id,sensor_name,room_id,'
+    'temperature,humidity,timestamp,is_anomaly\r\n'
+)
+_CSV_ROW_FORMAT = "%d,%d,%s,%d,%s,%s,%s,%s\r\n"
+
+
+def _csv_text(value: str) -> str:
+    """Екранувати текстове поле CSV (як csv.QUOTE_MINIMAL)"""
+    if ',' in value or '"' in value or '\n' in value or '\r' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _csv_number(value: Optional[float]) -> str:
+    """Числове поле CSV (порожнє для NULL, як у csv.writer)"""
+    return '' if value is None else repr(value)
+
+
+def _csv_datetime(value: Optional[datetime]) -> str:
+    """Поле дати CSV у форматі ISO 8601 (порожнє для NULL)"""
+    return '' if value is None else value.isoformat()
+
+
+def _csv_flag(value: Optional[bool]) -> str:
+    """Логічне поле CSV (True/False, порожнє для NULL)"""
+    return '' if value is None else str(value)
+
+
+class _StreamSink:
+    """
+    Файлоподібний буфер для потокового запису (ParquetWriter)
+    
+    Записані байти забираються через drain(), а tell() повертає загальну
+    кількість записаних байтів - від неї залежать зміщення у футері Parquet.
+    """
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+    
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
 class DataExport:
     """Функції для експорту даних системи"""
     
+    @staticmethod
+    def _sensor_data_query(
+        room_id: Optional[int],
+        sensor_id: Optional[int],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        user_id: Optional[int] = None
+    ):
+        """
+        SELECT показників сенсорів для експорту (кортежі колонок, без ORM)
+        
+        user_id обмежує вибірку сенсорами приміщень цього користувача
+        (None - усі показники, для адміністратора).
+        """
+        query = select(
+            models.SensorReading.id,
+            models.SensorReading.sensor_id,
+            models.Sensor.name,
+            models.Sensor.room_id,
+            models.SensorReading.temperature,
+            models.SensorReading.humidity,
+            models.SensorReading.timestamp,
+            models.SensorReading.is_anomaly
+        ).join(models.Sensor, models.SensorReading.sensor_id == models.Sensor.id)
+        
+        if user_id is not None:
+            query = query.join(models.Room, models.Sensor.room_id == models.Room.id)\
+                .where(models.Room.user_id == user_id)
+        
+        if room_id:
+            query = query.where(models.Sensor.room_id == room_id)
+        
+        if sensor_id:
+            query = query.where(models.SensorReading.sensor_id == sensor_id)
+        
+        if start_date:
+            query = query.where(models.SensorReading.timestamp >= start_date)
+        
+        if end_date:
+            query = query.where(models.SensorReading.timestamp <= end_date)
+        
+        return query
+    
     @staticmethod
     def export_sensor_data_to_csv(
         db: Session,
         room_id: Optional[int] = None,
         sensor_id: Optional[int] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> str:
+        end_date: Optional[datetime] = None,
+        chunk_size: int = 5000,
+        user_id: Optional[int] = None
+    ) -> Iterator[str]:
         """
         Експортувати дані сенсорів у CSV формат
         
+        CSV формується частинами по chunk_size рядків, тому весь файл
+        ніколи не зберігається в пам'яті (для StreamingResponse).
+        Рядки читаються як кортежі колонок (без ORM об'єктів), а кожна частина
+        форматується по колонках одним join замість csv.writer на кожен рядок.
+        
+        Args:
+            user_id: лише показники сенсорів приміщень цього користувача (None - усі)
+        
         Returns:
-            CSV string
+            Генератор частин CSV (перша частина - BOM та заголовок)
         """
-        query = db.query(models.SensorReading).join(models.Sensor)
+        query = DataExport._sensor_data_query(room_id, sensor_id, start_date, end_date, user_id)
         
-        if room_id:
-            query = query.filter(models.Sensor.room_id == room_id)
+        # Рядки читаються порціями через серверний (іменований) курсор psycopg2,
+        # тому в пам'яті одночасно не більше chunk_size рядків
+        result = db.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
         
-        if sensor_id:
-            query = query.filter(models.SensorReading.sensor_id == sensor_id)
+        yield _CSV_HEADER
         
-        if start_date:
-            query = query.filter(models.SensorReading.timestamp >= start_date)
+        row_format = _CSV_ROW_FORMAT.__mod__
         
-        if end_date:
-            query = query.filter(models.SensorReading.timestamp <= end_date)
+        for rows in result.partitions():
+            ids, sensor_ids, names, room_ids, temperatures, humidities, timestamps, anomalies = zip(*rows)
+            yield "".join(map(row_format, zip(
+                ids,
+                sensor_ids,
+                map(_csv_text, names),
+                room_ids,
+                map(_csv_number, temperatures),
+                map(_csv_number, humidities),
+                map(_csv_datetime, timestamps),
+                map(_csv_flag, anomalies)
+            )))
+    
+    @staticmethod
+    def export_sensor_data_to_parquet(
+        db: Session,
+        room_id: Optional[int] = None,
+        sensor_id: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        chunk_size: int = 50000,
+        user_id: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """
+        Експортувати дані сенсорів у формат Parquet (zstd)
         
-        readings = query.all()
+        Кожна порція з chunk_size рядків записується окремою row group,
+        а готові байти віддаються одразу (для StreamingResponse).
+        Колонки типізовані, тому файл значно менший за CSV і не потребує
+        розбору чисел та дат при читанні.
         
-        # Створити CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
+        Args:
+            user_id: лише показники сенсорів приміщень цього користувача (None - усі)
         
-        # Header
-        writer.writerow([
-            'reading_id', 'sensor_id', 'sensor_name', 'room_id',
-            'temperature', 'humidity', 'timestamp', 'is_anomaly'
+        Returns:
+            Генератор частин файлу Parquet
+        """
+        # pyarrow імпортується лише тут, щоб не завантажувати його при старті сервера
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        schema = pa.schema([
+            ("reading_id", pa.int64()),
+            ("sensor_id", pa.int64()),
+            ("sensor_name", pa.string()),
+            ("room_id", pa.int64()),
+            ("temperature", pa.float64()),
+            ("humidity", pa.float64()),
+            ("timestamp", pa.timestamp("us", tz="UTC")),
+            ("is_anomaly", pa.bool_()),
         ])
         
-        # Data
-        for reading in readings:
-            writer.writerow([
-                reading.id,
-                reading.sensor_id,
-                reading.sensor.name,
-                reading.sensor.room_id,
-                reading.temperature,
-                reading.humidity,
-                reading.timestamp.isoformat(),
-                reading.is_anomaly
-            ])
-        
-        # Додати BOM для правильного відображення UTF-8 в Excel
-        csv_content = '\ufeff' + output.getvalue()
-        return csv_content
+        query = DataExport._sensor_data_query(room_id, sensor_id, start_date, end_date, user_id)
+        result = db.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
         
+        sink = _StreamSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        
+        try:
+            for rows in result.partitions():
+                columns = zip(*rows)
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        
+        # Футер файлу записується при закритті
+        yield sink.drain()
+    
     @staticmethod
     def export_system_configuration(db: Session) -> Dict:
         """
         Експортувати конфігурацію системи у JSON
         Включає налаштування приміщень, порогових значень, пристроїв
+        
+        Зв'язки завантажуються наперед: колекції через selectinload (по одному
+        SELECT ... IN), порогові значення (один-до-одного) через JOIN.
+        Для кожної таблиці вибираються лише колонки, що потрапляють в експорт.
         """
-        rooms = db.query(models.Room).all()
+        rooms = db.query(models.Room).options(
+            load_only(
+                models.Room.id,
+                models.Room.name,
+                models.Room.description,
+                models.Room.floor,
+                models.Room.area
+            ),
+            selectinload(models.Room.sensors).load_only(
+                models.Sensor.id,
+                models.Sensor.room_id,
+                models.Sensor.name,
+                models.Sensor.device_id,
+                models.Sensor.sensor_type
+            ),
+            selectinload(models.Room.climate_devices).load_only(
+                models.ClimateDevice.id,
+                models.ClimateDevice.room_id,
+                models.ClimateDevice.name,
+                models.ClimateDevice.device_id,
+                models.ClimateDevice.device_type,
+                models.ClimateDevice.power_consumption
+            ),
+            joinedload(models.Room.climate_threshold).load_only(
+                models.ClimateThreshold.min_temperature,
+                models.ClimateThreshold.max_temperature,
+                models.ClimateThreshold.min_humidity,
+                models.ClimateThreshold.max_humidity,
+                models.ClimateThreshold.auto_control_enabled
+            )
+        ).all()
         
         config = {
             "export_date": datetime.utcnow().isoformat(),
@@ -324,6 +647,92 @@ class DataExport:
         
         return config
     
+    @staticmethod
+    def export_system_configuration_ndjson(db: Session, chunk_size: int = 500) -> Iterator[bytes]:
+        """
+        Експортувати конфігурацію системи у NDJSON (один об'єкт на рядок)
+        
+        Замість одного вкладеного дерева віддаються плоскі записи з полем "type":
+        "export", потім "room" (з порогами), "sensor" та "climate_device"
+        (з room_id для відновлення структури на клієнті). Кожна таблиця
+        читається порціями по chunk_size рядків, тому в пам'яті не зберігається
+        ні все дерево, ні весь серіалізований JSON (для StreamingResponse).
+        
+        Returns:
+            Генератор частин NDJSON
+        """
+        room = models.Room
+        threshold = models.ClimateThreshold
+        sensor = models.Sensor
+        device = models.ClimateDevice
+        
+        yield orjson.dumps({"type": "export", "export_date": datetime.utcnow().isoformat()}) + b"\n"
+        
+        rooms = db.execute(
+            select(
+                room.id,
+                room.name,
+                room.description,
+                room.floor,
+                room.area,
+                threshold.id.label("threshold_id"),
+                threshold.min_temperature,
+                threshold.max_temperature,
+                threshold.min_humidity,
+                threshold.max_humidity,
+                threshold.auto_control_enabled
+            ).outerjoin(threshold, threshold.room_id == room.id)
+            .order_by(room.id)
+            .execution_options(stream_results=True, yield_per=chunk_size)
+        )
+        
+        for rows in rooms.partitions():
+            yield b"".join(
+                orjson.dumps({
+                    "type": "room",
+                    "id": row.id,
+                    "name": row.name,
+                    "description": row.description,
+                    "floor": row.floor,
+                    "area": row.area,
+                    "threshold": {
+                        "min_temperature": row.min_temperature,
+                        "max_temperature": row.max_temperature,
+                        "min_humidity": row.min_humidity,
+                        "max_humidity": row.max_humidity,
+                        "auto_control_enabled": row.auto_control_enabled
+                    } if row.threshold_id is not None else None
+                }) + b"\n"
+                for row in rows
+            )
+        
+        children = (
+            ("sensor", select(
+                sensor.id,
+                sensor.room_id,
+                sensor.name,
+                sensor.device_id,
+                sensor.sensor_type
+            ).order_by(sensor.id)),
+            ("climate_device", select(
+                device.id,
+                device.room_id,
+                device.name,
+                device.device_id,
+                device.device_type,
+                device.power_consumption
+            ).order_by(device.id)),
+        )
+        
+        for record_type, query in children:
+            result = db.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+            
+            for rows in result.partitions():
+                yield b"".join(
+                    orjson.dumps({"type": record_type, **row._asdict()}) + b"\n"
+                    for row in rows
+                )
+    
     @staticmethod
     def export_alerts(
         db: Session,
@@ -332,22 +741,43 @@ class DataExport:
         end_date: Optional[datetime] = None,
         severity: Optional[str] = None
     ) -> List[Dict]:
-        """Експортувати історію alerts"""
-        query = db.query(models.Alert)
+        """
+        Експортувати історію alerts
+        
+        На PostgreSQL JSON збирається на стороні БД (json_agg), без створення
+        ORM об'єктів та форматування дат у Python.
+        """
+        alert = models.Alert
+        filters = []
         
         if room_id:
-            query = query.filter(models.Alert.room_id == room_id)
+            filters.append(alert.room_id == room_id)
         
         if start_date:
-            query = query.filter(models.Alert.created_at >= start_date)
+            filters.append(alert.created_at >= start_date)
         
         if end_date:
-            query = query.filter(models.Alert.created_at <= end_date)
+            filters.append(alert.created_at <= end_date)
         
         if severity:
-            query = query.filter(models.Alert.severity == severity)
+            filters.append(alert.severity == severity)
         
-        alerts = query.order_by(models.Alert.created_at.desc()).all()
+        if db.get_bind().dialect.name == "postgresql":
+            row = func.json_build_object(
+                "id", alert.id,
+                "room_id", alert.room_id,
+                "alert_type", alert.alert_type.type.label_expression(alert.alert_type),
+                "message", alert.message,
+                "severity", alert.severity.type.label_expression(alert.severity),
+                "is_read", alert.is_read,
+                "created_at", alert.created_at
+            )
+            stmt = select(
+                func.json_agg(aggregate_order_by(row, alert.created_at.desc()))
+            ).where(*filters)
+            return db.execute(stmt).scalar() or []
+        
+        alerts = db.query(alert).filter(*filters).order_by(alert.created_at.desc()).all()
         
         return [
             {
@@ -381,63 +811,80 @@ class DataImport:
         
         УВАГА: Створює нові записи, не оновлює існуючі
         """
-        created_rooms = 0
-        created_sensors = 0
-        created_devices = 0
-        created_thresholds = 0
+        rooms_data = config_data.get("rooms", [])
+        
+        # Один суфікс на весь імпорт + порядковий номер об'єкта
+        import_suffix = time.time_ns()
         
         try:
-            for room_data in config_data.get("rooms", []):
-                # Створити приміщення
-                room = models.Room(
-                    name=room_data["name"],
-                    description=room_data.get("description"),
-                    floor=room_data.get("floor"),
-                    area=room_data.get("area"),
-                    user_id=user_id
-                )
-                db.add(room)
-                db.flush()  # Отримати ID нового приміщення
-                created_rooms += 1
-                
-                # Створити сенсори
+            # Створити приміщення одним INSERT ... RETURNING id
+            room_ids = []
+            if rooms_data:
+                room_ids = db.scalars(
+                    insert(models.Room).returning(models.Room.id, sort_by_parameter_order=True),
+                    [
+                        {
+                            "name": room_data["name"],
+                            "description": room_data.get("description"),
+                            "floor": room_data.get("floor"),
+                            "area": room_data.get("area"),
+                            "user_id": user_id
+                        }
+                        for room_data in rooms_data
+                    ]
+                ).all()
+            
+            sensors = []
+            devices = []
+            thresholds = []
+            
+            for room_id, room_data in zip(room_ids, rooms_data):
+                # Сенсори
                 for sensor_data in room_data.get("sensors", []):
-                    sensor = models.Sensor(
-                        name=sensor_data["name"],
-                        device_id=f"{sensor_data['device_id']}_imported_{datetime.utcnow().timestamp()}",
-                        room_id=room.id,
-                        sensor_type=sensor_data["sensor_type"]
-                    )
-                    db.add(sensor)
-                    created_sensors += 1
+                    sensors.append({
+                        "name": sensor_data["name"],
+                        "device_id": f"{sensor_data['device_id']}_imported_{import_suffix}_{len(sensors)}",
+                        "room_id": room_id,
+                        "sensor_type": sensor_data["sensor_type"]
+                    })
                 
-                # Створити кліматичні пристрої
+                # Кліматичні пристрої
                 for device_data in room_data.get("climate_devices", []):
-                    device = models.ClimateDevice(
-                        name=device_data["name"],
-                        device_id=f"{device_data['device_id']}_imported_{datetime.utcnow().timestamp()}",
-                        room_id=room.id,
-                        device_type=device_data["device_type"],
-                        power_consumption=device_data.get("power_consumption")
-                    )
-                    db.add(device)
-                    created_devices += 1
+                    devices.append({
+                        "name": device_data["name"],
+                        "device_id": f"{device_data['device_id']}_imported_{import_suffix}_{len(devices)}",
+                        "room_id": room_id,
+                        "device_type": device_data["device_type"],
+                        "power_consumption": device_data.get("power_consumption")
+                    })
                 
-                # Створити порогові значення
+                # Порогові значення
                 threshold_data = room_data.get("threshold")
                 if threshold_data:
-                    threshold = models.ClimateThreshold(
-                        room_id=room.id,
-                        min_temperature=threshold_data.get("min_temperature"),
-                        max_temperature=threshold_data.get("max_temperature"),
-                        min_humidity=threshold_data.get("min_humidity"),
-                        max_humidity=threshold_data.get("max_humidity"),
-                        auto_control_enabled=threshold_data.get("auto_control_enabled", False)
-                    )
-                    db.add(threshold)
-                    created_thresholds += 1
+                    thresholds.append({
+                        "room_id": room_id,
+                        "min_temperature": threshold_data.get("min_temperature"),
+                        "max_temperature": threshold_data.get("max_temperature"),
+                        "min_humidity": threshold_data.get("min_humidity"),
+                        "max_humidity": threshold_data.get("max_humidity"),
+                        "auto_control_enabled": threshold_data.get("auto_control_enabled", False)
+                    })
+            
+            # Пакетні INSERT замість db.add на кожен об'єкт
+            if sensors:
+                db.execute(insert(models.Sensor), sensors)
+            if devices:
+                db.execute(insert(models.ClimateDevice), devices)
+            if thresholds:
+                db.execute(insert(models.ClimateThreshold), thresholds)
+            
+            created_rooms = len(room_ids)
+            created_sensors = len(sensors)
+            created_devices = len(devices)
+            created_thresholds = len(thresholds)
             
             db.commit()
+            invalidate_system_config()
             
             return {
                 "success": True,
@@ -459,6 +906,10 @@ class DataImport:
 # ЛОГУВАННЯ ТА МОНІТОРИНГ
 # ============================================
 
+# Скільки подій накопичується в буфері сесії до автоматичного запису
+DEVICE_LOG_BATCH_SIZE = 500
+
+
 class SystemLogging:
     """Функції для логування подій системи"""
     
@@ -470,21 +921,72 @@ class SystemLogging:
         log_level: str,
         message: str,
         metadata: Optional[Dict] = None
-    ) -> models.DeviceLog:
-        """Записати подію пристрою в лог"""
-        log = models.DeviceLog(
-            device_id=device_id,
-            device_type=device_type,
-            log_level=log_level,
-            message=message,
-            log_metadata=metadata
+    ) -> None:
+        """
+        Записати подію пристрою в лог
+        
+        Подія додається в буфер сесії (db.info) з часом виклику і записується
+        разом з іншими подіями через log_device_events: при flush_device_events
+        або автоматично, коли в буфері DEVICE_LOG_BATCH_SIZE подій.
+        """
+        pending = db.info.setdefault("_pending_device_events", [])
+        pending.append({
+            "device_id": device_id,
+            "device_type": device_type,
+            "log_level": log_level,
+            "message": message,
+            "metadata": metadata,
+            "timestamp": datetime.utcnow()
+        })
+        
+        if len(pending) >= DEVICE_LOG_BATCH_SIZE:
+            SystemLogging.flush_device_events(db)
+    
+    @staticmethod
+    def flush_device_events(db: Session) -> int:
+        """
+        Записати буфер подій сесії (log_device_event)
+        
+        Returns:
+            Кількість записаних подій
+        """
+        return SystemLogging.log_device_events(
+            db, db.info.pop("_pending_device_events", None) or []
         )
+    
+    @staticmethod
+    def log_device_events(db: Session, events: List[Dict]) -> int:
+        """
+        Записати пакет подій пристроїв одним INSERT та одним commit
+        
+        Args:
+            events: список словників з ключами device_id, device_type,
+                log_level, message та необов'язковими metadata і timestamp
         
-        db.add(log)
+        Returns:
+            Кількість записаних подій
+        """
+        if not events:
+            return 0
+        
+        now = datetime.utcnow()
+        db.execute(
+            insert(models.DeviceLog),
+            [
+                {
+                    "device_id": event["device_id"],
+                    "device_type": event["device_type"],
+                    "log_level": event["log_level"],
+                    "message": event["message"],
+                    "log_metadata": event.get("metadata"),
+                    "timestamp": event.get("timestamp") or now
+                }
+                for event in events
+            ]
+        )
         db.commit()
-        db.refresh(log)
         
-        return log
+        return len(events)
     
     @staticmethod
     def get_system_logs(
@@ -513,27 +1015,34 @@ class SystemLogging:
         db: Session,
         hours: int = 24
     ) -> Dict:
-        """Отримати статистику помилок за вказаний період"""
+        """
+        Отримати статистику помилок за вказаний період
+        
+        Підрахунок виконується в БД (GROUP BY), а з самих записів
+        завантажуються лише 10 останніх.
+        """
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
         
-        errors = db.query(models.DeviceLog).filter(
-            and_(
-                models.DeviceLog.log_level == "error",
-                models.DeviceLog.timestamp >= cutoff_time
-            )
-        ).all()
+        error_filter = and_(
+            models.DeviceLog.log_level == "error",
+            models.DeviceLog.timestamp >= cutoff_time
+        )
         
         # Групувати за типом пристрою
-        by_device_type = {}
-        for error in errors:
-            dtype = error.device_type
-            if dtype not in by_device_type:
-                by_device_type[dtype] = 0
-            by_device_type[dtype] += 1
+        by_device_type = dict(
+            db.query(models.DeviceLog.device_type, func.count(models.DeviceLog.id))
+            .filter(error_filter)
+            .group_by(models.DeviceLog.device_type)
+            .all()
+        )
+        
+        errors = db.query(models.DeviceLog).filter(error_filter).order_by(
+            models.DeviceLog.timestamp.desc()
+        ).limit(10).all()
         
         return {
             "period_hours": hours,
-            "total_errors": len(errors),
+            "total_errors": sum(by_device_type.values()),
             "errors_by_device_type": by_device_type,
             "recent_errors": [
                 {
@@ -542,6 +1051,6 @@ class SystemLogging:
                     "message": e.message,
                     "timestamp": e.timestamp.isoformat()
                 }
-                for e in errors[:10]  # Останні 10 помилок
+                for e in errors  # Останні 10 помилок
             ]
         }
\ No newline at end of file
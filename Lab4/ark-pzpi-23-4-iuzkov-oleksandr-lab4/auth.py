@@ -3,31 +3,97 @@ Authentication and security utilities
 JWT tokens, password hashing, current user dependency
 """
 
-from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Tuple
+import jwt
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only, make_transient_to_detached
+import asyncio
+import bcrypt
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
-from database import get_db
+from cache import cache_delete, cache_get, cache_set
+from database import WEB_CONCURRENCY, get_db
 import models
 
 load_dotenv()
 
 # Конфігурація
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+_PLACEHOLDER_SECRET = "your-secret-key-change-in-production"
+_secret = os.getenv("SECRET_KEY")
+if not _secret or _secret == _PLACEHOLDER_SECRET:
+    raise RuntimeError("SECRET_KEY is not set: define it in the environment or .env file")
+
+# Ключ зберігається як bytes, щоб не кодувати його на кожен виклик encode/decode
+SECRET_KEY = _secret.encode()
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+_DEFAULT_TTL = ACCESS_TOKEN_EXPIRE_MINUTES * 60  # секунд
+_ALGOS = (ALGORITHM,)
+
+# Вартість bcrypt (12 - як за замовчуванням у passlib, старі хеші залишаються валідними)
+BCRYPT_ROUNDS = 12
+
+# bcrypt звільняє GIL під час хешування, тому виконується в пулі потоків.
+# Семафор обмежує одночасні хешування часткою ядер на воркер: решта запитів
+# чекає в event loop, не займаючи потоки пулу, потрібні sync endpoint'ам
+BCRYPT_CONCURRENCY = max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+_bcrypt_semaphore = asyncio.Semaphore(BCRYPT_CONCURRENCY)
+
+# Хеш для фіктивної перевірки, коли користувача не знайдено:
+# вхід з неіснуючим email займає стільки ж часу, скільки й з існуючим
+_DUMMY_HASH = bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+class _BearerScheme(OAuth2PasswordBearer):
+    """
+    OAuth2PasswordBearer з простим розбором заголовка Authorization
+    
+    Схема залишається зареєстрованою в OpenAPI (кнопка Authorize у /docs),
+    а токен витягується однією перевіркою префікса та зрізом рядка.
+    """
+    
+    async def __call__(self, request: Request) -> str:
+        authorization = request.headers.get("authorization")
+        if not authorization or authorization[:7].lower() != "bearer ":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return authorization[7:]
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # OAuth2 scheme для JWT
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login/form")
+oauth2_scheme = _BearerScheme(tokenUrl="/api/auth/login/form")
+
+# LRU кеш перевірених токенів: blake2b(token) -> (user_id, exp)
+# Ключ - короткий дайджест, тому сирі токени не зберігаються в пам'яті
+TOKEN_CACHE_MAX_SIZE = 8192
+_token_cache: "OrderedDict[bytes, Tuple[int, int]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Короткоживучий кеш активних користувачів у Redis: auth_user:{id} -> колонки
+# _AUTH_COLUMNS. Кеш спільний для всіх воркерів, тому invalidate_user_cache
+# одразу забирає права (is_active/is_admin) в усіх процесах
+USER_CACHE_TTL = 30  # секунд
+
+# Колонки, які потрібні для аутентифікації та перевірки прав
+_AUTH_COLUMNS = (
+    models.User.id,
+    models.User.username,
+    models.User.is_active,
+    models.User.is_admin,
+)
+_AUTH_COLUMN_NAMES = [column.key for column in _AUTH_COLUMNS]
+_USER_COLUMN_NAMES = [column.key for column in models.User.__mapper__.column_attrs]
 
 
 # ============================================
@@ -36,12 +102,28 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login/form")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Перевірити чи співпадає пароль з хешем"""
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        # Некоректний формат хешу
+        return False
 
 
 def get_password_hash(password: str) -> str:
     """Створити bcrypt хеш паролю"""
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Перевірити пароль у пулі потоків (для async endpoint'ів)"""
+    async with _bcrypt_semaphore:
+        return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Створити bcrypt хеш паролю у пулі потоків (для async endpoint'ів)"""
+    async with _bcrypt_semaphore:
+        return await run_in_threadpool(get_password_hash, password)
 
 
 # ============================================
@@ -61,45 +143,125 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     to_encode = data.copy()
     
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
+    # exp як ціле число секунд (Unix time), без проміжних datetime об'єктів
+    ttl = int(expires_delta.total_seconds()) if expires_delta else _DEFAULT_TTL
+    to_encode["exp"] = int(time.time()) + ttl
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     
     return encoded_jwt
 
 
+def _decode_token(token: str) -> Optional[Tuple[int, int]]:
+    """Декодувати JWT token та повернути (user_id, exp) або None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=_ALGOS)
+    except jwt.PyJWTError:
+        return None
+    
+    user_id = payload.get("sub")
+    exp = payload.get("exp")
+    
+    if user_id is None or exp is None:
+        return None
+    
+    return int(user_id), int(exp)
+
+
 def verify_token(token: str) -> Optional[int]:
     """
     Перевірити JWT token та витягнути user_id
     
+    Результат декодування кешується (LRU), тому повторні запити з тим самим
+    токеном не виконують HMAC перевірку та JSON парсинг. Термін дії (exp)
+    перевіряється при кожному зверненні до кешу.
+    
     Args:
         token: JWT token string
     
     Returns:
         user_id якщо токен валідний, None інакше
     """
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        
-        if user_id is None:
-            return None
-        
-        return int(user_id)
+    now = time.time()
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            user_id, exp = cached
+            if exp > now:
+                _token_cache.move_to_end(key)
+                return user_id
+            # Токен прострочений - видалити з кешу
+            del _token_cache[key]
+    
+    decoded = _decode_token(token)
+    
+    if decoded is None:
+        return None
+    
+    with _token_cache_lock:
+        _token_cache[key] = decoded
+        _token_cache.move_to_end(key)
+        if len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+    
+    return decoded[0]
+
+
+# ============================================
+# USER CACHE
+# ============================================
+
+def _user_cache_key(user_id: int) -> str:
+    return f"auth_user:{user_id}"
+
+
+def _get_cached_user(db: Session, user_id: int) -> Optional[models.User]:
+    """
+    Повернути користувача з кешу, приєднаного до сесії без SELECT
     
-    except JWTError:
+    Якщо Redis недоступний, повертає None і користувач читається з БД.
+    """
+    columns = cache_get(_user_cache_key(user_id))
+    if columns is None:
         return None
+    
+    snapshot = models.User(**columns)
+    make_transient_to_detached(snapshot)
+    return db.merge(snapshot, load=False)
+
+
+def _cache_user(user: models.User):
+    """Зберегти колонки аутентифікації користувача в кеш"""
+    cache_set(
+        _user_cache_key(user.id),
+        {key: getattr(user, key) for key in _AUTH_COLUMN_NAMES},
+        USER_CACHE_TTL
+    )
+
+
+def load_user_profile(db: Session, user: models.User) -> models.User:
+    """
+    Довантажити всі колонки користувача одним SELECT
+    
+    get_current_user завантажує лише колонки для аутентифікації,
+    тому endpoint'и, що повертають повний профіль, викликають цю функцію.
+    """
+    db.refresh(user, attribute_names=_USER_COLUMN_NAMES)
+    return user
+
+
+def invalidate_user_cache(user_id: int):
+    """Видалити користувача з кешу (викликати після зміни або видалення)"""
+    cache_delete(_user_cache_key(user_id))
 
 
 # ============================================
 # AUTHENTICATION DEPENDENCY
 # ============================================
 
-async def get_current_user(
+def get_current_user(
+    request: Request,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> models.User:
@@ -107,7 +269,13 @@ async def get_current_user(
     Dependency для отримання поточного аутентифікованого користувача
     Використовується у всіх захищених endpoint'ах
     
+    Користувач зберігається в request.state на час запиту, а також
+    у короткоживучому кеші Redis, щоб не виконувати SELECT на кожен запит.
+    Синхронна залежність: FastAPI виконує її в пулі потоків, тому SELECT
+    при промаху кешу не блокує event loop.
+    
     Args:
+        request: Поточний HTTP запит
         token: JWT token з Authorization header
         db: Database session
     
@@ -123,35 +291,54 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    # Користувач вже визначений у межах цього запиту
+    current_user = getattr(request.state, "current_user", None)
+    if current_user is not None:
+        return current_user
+    
     # Перевірити токен та витягнути user_id
     user_id = verify_token(token)
     
     if user_id is None:
         raise credentials_exception
     
-    # Знайти користувача в БД
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = _get_cached_user(db, user_id)
     
     if user is None:
-        raise credentials_exception
-    
-    if not user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="User account is inactive"
-        )
+        # Знайти користувача в БД (пошук за первинним ключем через identity map)
+        user = db.get(models.User, user_id, options=[load_only(*_AUTH_COLUMNS)])
+        
+        if user is None:
+            raise credentials_exception
+        
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="User account is inactive"
+            )
+        
+        _cache_user(user)
     
+    request.state.current_user = user
     return user
 
 
-async def get_current_active_user(
-    current_user: models.User = Depends(get_current_user)
-) -> models.User:
-    """Dependency для перевірки що користувач активний"""
-    if not current_user.is_active:
+# get_current_user вже відхиляє неактивних користувачів (403),
+# тому окрема залежність з повторною перевіркою не потрібна
+get_current_active_user = get_current_user
+
+
+async def require_admin(current_user: models.User = Depends(get_current_user)) -> models.User:
+    """
+    Dependency для endpoint'ів адміністратора
+    
+    Відхиляє запит (403) ще під час розв'язання залежностей,
+    до виклику обробника.
+    """
+    if not current_user.is_admin:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Inactive user"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can access this endpoint"
         )
     return current_user
 
@@ -160,10 +347,18 @@ async def get_current_active_user(
 # USER AUTHENTICATION
 # ============================================
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
+def _find_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    """Знайти користувача за email (синхронний запит, для пулу потоків)"""
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
     """
     Аутентифікувати користувача за email та паролем
     
+    Пошук користувача та перевірка bcrypt хешу виконуються в пулі потоків,
+    щоб не блокувати event loop
+    
     Args:
         db: Database session
         email: User email
@@ -172,12 +367,14 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[models
     Returns:
         User model якщо credentials правильні, None інакше
     """
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await run_in_threadpool(_find_user_by_email, db, email)
     
     if not user:
+        # Фіктивна перевірка, щоб не розкривати існування email через час відповіді
+        await verify_password_async(password, _DUMMY_HASH)
         return None
     
-    if not verify_password(password, user.password_hash):
+    if not await verify_password_async(password, user.password_hash):
         return None
     
     return user
\ No newline at end of file
@@ -3,35 +3,83 @@ FastAPI Main Application
 Система моніторингу температури та вологості в приміщенні
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import BackgroundTasks, Body, FastAPI, Depends, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import and_, delete, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from typing import Iterator, List, Literal, Optional, Dict, Union
 from datetime import timedelta, datetime
+import anyio.to_thread
+import asyncio
 import uvicorn
 import io
-from database import get_db, create_tables
+import os
+import gzip
+import hashlib
+import threading
+import time
+import uuid
+import zlib
+import orjson
+from database import (
+    ADMIN_STATEMENT_TIMEOUT_MS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    SessionLocal,
+    WEB_CONCURRENCY,
+    get_db,
+    create_tables,
+    is_statement_timeout,
+    statement_timeout,
+    warm_up_pool
+)
 import models
 import schemas
-from schemas import SensorProcessingResponse, SensorReadingInput
+from admin import DataExport, DataManagement, UserManagement
+from schemas import (
+    SensorBatchProcessingResponse,
+    SensorBatchReadingInput,
+    SensorProcessingResponse,
+    SensorReadingInput,
+    UserManagementData,
+    UserManagementOperation
+)
 from auth import (
-    get_password_hash,
+    get_password_hash_async,
     authenticate_user,
     create_access_token,
     get_current_user,
-    verify_password,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    invalidate_user_cache,
+    load_user_profile,
+    require_admin,
+    verify_password_async,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_CONCURRENCY
 )
 from business_logic import (
     SensorReadingProcessor,
     AnalyticsService,
+    AnalyticsRollup,
     AutoControlFlow,
     DataValidationFlow,
     UserManagementFlow,
-    AnalyticsReportFlow
+    AnalyticsReportFlow,
+    invalidate_room_cache,
+    invalidate_sensor_cache,
+    invalidate_system_config,
+    flush_sensor_last_online,
+    load_room_threshold,
+    touch_sensors,
+    ROLLUP_REFRESH_INTERVAL,
+    SENSOR_ONLINE_FLUSH_INTERVAL,
+    SYSTEM_CONFIG_CACHE_KEY,
+    SYSTEM_CONFIG_CACHE_TTL
 )
+from cache import cache_get, cache_get_raw, cache_lock, cache_set, cache_set_raw, cache_unlock
 
 # Створення FastAPI застосунку
 app = FastAPI(
@@ -39,7 +87,8 @@ app = FastAPI(
     description="API для системи моніторингу температури та вологості в приміщенні",
     version="1.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse  # orjson серіалізує відповіді швидше за json
 )
 
 # CORS middleware
@@ -59,16 +108,74 @@ app.add_middleware(
 )
 
 
+def _refresh_analytics_rollup():
+    """Оновити погодинні агрегати (лише один воркер одночасно - advisory lock у refresh)"""
+    db = SessionLocal()
+    try:
+        AnalyticsRollup.refresh(db)
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Analytics rollup refresh failed: {e}")
+    finally:
+        db.close()
+
+
+async def _analytics_rollup_loop():
+    """Фонове завдання: оновлювати агрегати кожні ROLLUP_REFRESH_INTERVAL секунд"""
+    while True:
+        await asyncio.to_thread(_refresh_analytics_rollup)
+        await asyncio.sleep(ROLLUP_REFRESH_INTERVAL)
+
+
+def _flush_sensor_last_online():
+    """Записати last_online сенсорів з Redis в БД (лише один воркер одночасно)"""
+    if not cache_lock("sensor_online_flush"):
+        return
+    
+    db = SessionLocal()
+    try:
+        flush_sensor_last_online(db)
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Sensor last_online flush failed: {e}")
+    finally:
+        db.close()
+        cache_unlock("sensor_online_flush")
+
+
+async def _sensor_online_flush_loop():
+    """Фонове завдання: записувати last_online кожні SENSOR_ONLINE_FLUSH_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(SENSOR_ONLINE_FLUSH_INTERVAL)
+        await asyncio.to_thread(_flush_sensor_last_online)
+
+
+# Endpoint'и з синхронною сесією БД оголошені як def: FastAPI виконує їх у пулі
+# потоків, і запит до БД не блокує event loop. async def залишено лише для
+# endpoint'ів без БД та тих, що чекають на bcrypt (auth.BCRYPT_CONCURRENCY).
+# Розмір пулу потоків - за кількістю з'єднань, які може видати пул engine,
+# плюс потоки для bcrypt, щоб хешування не займало потоки запитів до БД
+THREADPOOL_SIZE = DB_POOL_SIZE + DB_MAX_OVERFLOW + BCRYPT_CONCURRENCY
+
+
 @app.on_event("startup")
 async def startup_event():
     print("Starting Climate Monitoring System API...")
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
     create_tables()
+    await asyncio.to_thread(warm_up_pool)
     print("Connected to PostgreSQL database")
+    app.state.rollup_task = asyncio.create_task(_analytics_rollup_loop())
+    app.state.sensor_online_task = asyncio.create_task(_sensor_online_flush_loop())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down Climate Monitoring System API...")
+    app.state.rollup_task.cancel()
+    app.state.sensor_online_task.cancel()
+    # Не втратити last_online, накопичені після останнього запису
+    await asyncio.to_thread(_flush_sensor_last_online)
 
 
 # ============================================
@@ -105,24 +212,16 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
     - **password**: Пароль (мінімум 8 символів)
     """
     
-    # Перевірка email
-    existing_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if existing_user:
+    # Перевірка email та username (запити до БД - у пулі потоків)
+    conflict = await run_in_threadpool(_registration_conflict, db, user.email, user.username)
+    if conflict:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User with this email already exists"
-        )
-    
-    # Перевірка username
-    existing_username = db.query(models.User).filter(models.User.username == user.username).first()
-    if existing_username:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already taken"
+            detail=conflict
         )
     
     # Хешування паролю через bcrypt
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     
     db_user = models.User(
         username=user.username,
@@ -133,13 +232,30 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
         phone_number=user.phone_number
     )
     
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await run_in_threadpool(_insert_user, db, db_user)
     
     return db_user
 
 
+def _registration_conflict(db: Session, email: str, username: str) -> Optional[str]:
+    """Повідомлення про зайнятий email або username, None якщо обидва вільні"""
+    if db.query(exists().where(models.User.email == email)).scalar():
+        return "User with this email already exists"
+    if db.query(exists().where(models.User.username == username)).scalar():
+        return "Username already taken"
+    return None
+
+
+def _insert_user(db: Session, db_user: models.User):
+    """Зберегти нового користувача (синхронно, для пулу потоків)"""
+    # id та created_at повертає INSERT (RETURNING), від'єднаний об'єкт
+    # не прострочується commit'ом, тому повторний SELECT не потрібен
+    db.add(db_user)
+    db.flush()
+    db.expunge(db_user)
+    db.commit()
+
+
 @app.post("/api/auth/login", response_model=schemas.Token, tags=["Authentication"])
 async def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
     """
@@ -150,7 +266,7 @@ async def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db))
     """
     
     # Аутентифікація з перевіркою хешу паролю
-    user = authenticate_user(db, login_data.email, login_data.password)
+    user = await authenticate_user(db, login_data.email, login_data.password)
     
     if not user:
         raise HTTPException(
@@ -180,7 +296,7 @@ async def login_form(form_data: OAuth2PasswordRequestForm = Depends(), db: Sessi
     В username треба вказати email!
     """
     
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     
     if not user:
         raise HTTPException(
@@ -219,17 +335,20 @@ async def logout(current_user: models.User = Depends(get_current_user)):
 # ============================================
 
 @app.get("/api/users/me", response_model=schemas.UserResponse, tags=["Users"])
-async def get_current_user_profile(current_user: models.User = Depends(get_current_user)):
+def get_current_user_profile(
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
     Отримати профіль поточного користувача
     
     Requires: JWT token в Authorization header
     """
-    return current_user
+    return load_user_profile(db, current_user)
 
 
 @app.put("/api/users/me", response_model=schemas.UserResponse, tags=["Users"])
-async def update_current_user(
+def update_current_user(
     user_update: schemas.UserUpdate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -244,13 +363,14 @@ async def update_current_user(
         setattr(current_user, key, value)
     
     db.commit()
-    db.refresh(current_user)
+    load_user_profile(db, current_user)
+    invalidate_user_cache(current_user.id)
     
     return current_user
 
 
 @app.delete("/api/users/me", status_code=status.HTTP_204_NO_CONTENT, tags=["Users"])
-async def delete_current_user(
+def delete_current_user(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -260,12 +380,32 @@ async def delete_current_user(
     Requires: JWT token в Authorization header
     """
     
+    user_id = current_user.id
     db.delete(current_user)
     db.commit()
+    invalidate_user_cache(user_id)
     
     return None
 
 
+def _load_password_hash(db: Session, user_id: int) -> str:
+    """Прочитати хеш паролю користувача (колонка не входить у кеш аутентифікації)"""
+    return db.execute(
+        select(models.User.password_hash).where(models.User.id == user_id)
+    ).scalar_one()
+
+
+def _save_password_hash(db: Session, user_id: int, password_hash: str) -> None:
+    """Записати новий хеш паролю одним UPDATE"""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(password_hash=password_hash)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
 @app.put("/api/users/me/password", tags=["Users"])
 async def change_password(
     password_data: schemas.PasswordChange,
@@ -278,16 +418,20 @@ async def change_password(
     Requires: JWT token в Authorization header
     """
     
+    # Запити до БД - у пулі потоків, щоб не блокувати event loop
+    password_hash = await run_in_threadpool(_load_password_hash, db, current_user.id)
+    
     # Перевірка старого паролю через bcrypt
-    if not verify_password(password_data.old_password, current_user.password_hash):
+    if not await verify_password_async(password_data.old_password, password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password"
         )
     
     # Хешування нового паролю
-    current_user.password_hash = get_password_hash(password_data.new_password)
-    db.commit()
+    new_hash = await get_password_hash_async(password_data.new_password)
+    await run_in_threadpool(_save_password_hash, db, current_user.id, new_hash)
+    invalidate_user_cache(current_user.id)
     
     return {"message": "Password changed successfully"}
 
@@ -297,7 +441,7 @@ async def change_password(
 # ============================================
 
 @app.get("/api/rooms", response_model=List[schemas.RoomResponse], tags=["Rooms"])
-async def get_rooms(
+def get_rooms(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -306,8 +450,10 @@ async def get_rooms(
     
     Requires: JWT token в Authorization header
     """
-    # Фільтрація за поточним користувачем
-    rooms = db.query(models.Room).filter(
+    # Фільтрація за поточним користувачем.
+    # raiseload у списках: випадкове звернення до зв'язку при серіалізації
+    # дає помилку замість окремого SELECT на кожен рядок (N+1)
+    rooms = db.query(models.Room).options(raiseload("*")).filter(
         models.Room.user_id == current_user.id
     ).all()
     
@@ -315,7 +461,7 @@ async def get_rooms(
 
 
 @app.post("/api/rooms", response_model=schemas.RoomResponse, status_code=status.HTTP_201_CREATED, tags=["Rooms"])
-async def create_room(
+def create_room(
     room: schemas.RoomCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -335,14 +481,16 @@ async def create_room(
     )
     
     db.add(db_room)
+    db.flush()
+    db.expunge(db_room)
     db.commit()
-    db.refresh(db_room)
+    invalidate_system_config()
     
     return db_room
 
 
 @app.get("/api/rooms/{room_id}", response_model=schemas.RoomResponse, tags=["Rooms"])
-async def get_room(
+def get_room(
     room_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -368,7 +516,7 @@ async def get_room(
 
 
 @app.put("/api/rooms/{room_id}", response_model=schemas.RoomResponse, tags=["Rooms"])
-async def update_room(
+def update_room(
     room_id: int,
     room_update: schemas.RoomUpdate,
     current_user: models.User = Depends(get_current_user),
@@ -379,29 +527,27 @@ async def update_room(
     
     Requires: JWT token в Authorization header
     """
-    # Перевірка власника
-    room = db.query(models.Room).filter(
+    # Перевірка власника та оновлення одним UPDATE ... RETURNING
+    room = _update_returning(
+        db, models.Room, room_update.model_dump(exclude_unset=True),
         models.Room.id == room_id,
         models.Room.user_id == current_user.id
-    ).first()
+    )
     
-    if not room:
+    if room is None:
         raise HTTPException(
             status_code=404,
             detail="Room not found or you don't have access"
         )
     
-    for key, value in room_update.dict(exclude_unset=True).items():
-        setattr(room, key, value)
-    
     db.commit()
-    db.refresh(room)
+    invalidate_system_config()
     
     return room
 
 
 @app.delete("/api/rooms/{room_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Rooms"])
-async def delete_room(
+def delete_room(
     room_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -425,6 +571,7 @@ async def delete_room(
     
     db.delete(room)
     db.commit()
+    invalidate_room_cache(room_id)
     
     return None
 
@@ -433,8 +580,73 @@ async def delete_room(
 # SENSOR ENDPOINTS (З АВТОРИЗАЦІЄЮ)
 # ============================================
 
+def _user_room_ids(user_id: int):
+    """
+    Підзапит id приміщень користувача
+    
+    Для UPDATE/DELETE з перевіркою власника в одному запиті:
+    WHERE room_id IN (SELECT id FROM room WHERE user_id = :user_id)
+    """
+    return select(models.Room.id).where(models.Room.user_id == user_id)
+
+
+def _insert_into_user_room(db: Session, model, values: Dict, user_id: int):
+    """
+    Створити запис у приміщенні користувача одним INSERT ... SELECT ... RETURNING
+    
+    Рядок вставляється лише якщо приміщення values["room_id"] належить
+    користувачу, тому окремий SELECT для перевірки власника не потрібен.
+    Порушення унікальності піднімає IntegrityError одразу при INSERT.
+    
+    Returns:
+        Від'єднаний (не застаріває після commit) об'єкт або None, якщо
+        приміщення не знайдено чи воно належить іншому користувачу
+    """
+    columns = model.__table__.columns
+    owned_room = exists().where(
+        models.Room.id == values["room_id"],
+        models.Room.user_id == user_id
+    )
+    
+    created = db.scalars(
+        insert(model).from_select(
+            list(values),
+            select(*[literal(value, columns[key].type) for key, value in values.items()]).where(owned_room)
+        ).returning(model)
+    ).one_or_none()
+    
+    if created is not None:
+        db.expunge(created)
+    
+    return created
+
+
+def _update_returning(db: Session, model, values: Dict, *filters):
+    """
+    Оновити рядок одним UPDATE ... WHERE filters RETURNING
+    
+    filters містять і перевірку власника, тому рядок не завантажується
+    перед оновленням і не перечитується після commit.
+    
+    Returns:
+        Від'єднаний оновлений об'єкт або None, якщо рядок не знайдено
+    """
+    if values:
+        statement = update(model).where(*filters).values(**values).returning(model)
+    else:
+        # Порожнє оновлення - лише повернути поточний стан
+        statement = select(model).where(*filters)
+    
+    updated = db.scalars(statement).one_or_none()
+    
+    if updated is not None:
+        db.expunge(updated)
+    
+    return updated
+
+
 @app.get("/api/sensors", response_model=List[schemas.SensorResponse], tags=["Sensors"])
-async def get_sensors(
+def get_sensors(
     room_id: int = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -445,31 +657,36 @@ async def get_sensors(
     Requires: JWT token в Authorization header
     """
     # JOIN з Room для перевірки власника
-    query = db.query(models.Sensor).join(models.Room).filter(
+    query = db.query(models.Sensor).options(raiseload("*")).join(models.Room).filter(
         models.Room.user_id == current_user.id
     )
     
     if room_id:
-        # Додаткова перевірка що room належить користувачу
-        room = db.query(models.Room).filter(
-            models.Room.id == room_id,
-            models.Room.user_id == current_user.id
-        ).first()
+        query = query.filter(models.Sensor.room_id == room_id)
+    
+    sensors = query.all()
+    
+    if room_id and not sensors:
+        # Лише для порожнього результату: відрізнити чуже/неіснуюче
+        # приміщення (404) від приміщення без сенсорів
+        owned = db.query(
+            exists().where(
+                models.Room.id == room_id,
+                models.Room.user_id == current_user.id
+            )
+        ).scalar()
         
-        if not room:
+        if not owned:
             raise HTTPException(
                 status_code=404,
                 detail="Room not found or you don't have access"
             )
-        
-        query = query.filter(models.Sensor.room_id == room_id)
     
-    sensors = query.all()
     return sensors
 
 
 @app.post("/api/sensors", response_model=schemas.SensorResponse, status_code=status.HTTP_201_CREATED, tags=["Sensors"])
-async def create_sensor(
+def create_sensor(
     sensor: schemas.SensorCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -480,45 +697,35 @@ async def create_sensor(
     Requires: JWT token в Authorization header
     """
     
-    # Перевірка що приміщення належить користувачу
-    room = db.query(models.Room).filter(
-        models.Room.id == sensor.room_id,
-        models.Room.user_id == current_user.id
-    ).first()
-    
-    if not room:
-        raise HTTPException(
-            status_code=404,
-            detail="Room not found or you don't have access"
-        )
-    
-    # Перевірка унікальності device_id
-    existing_sensor = db.query(models.Sensor).filter(
-        models.Sensor.device_id == sensor.device_id
-    ).first()
-    
-    if existing_sensor:
+    # Перевірка власника приміщення та унікальності device_id - в самому INSERT
+    try:
+        db_sensor = _insert_into_user_room(db, models.Sensor, {
+            "name": sensor.name,
+            "device_id": sensor.device_id,
+            "room_id": sensor.room_id,
+            "sensor_type": sensor.sensor_type
+        }, current_user.id)
+    except IntegrityError:
+        db.rollback()
         raise HTTPException(
             status_code=400,
             detail="Sensor with this device_id already exists"
         )
     
-    db_sensor = models.Sensor(
-        name=sensor.name,
-        device_id=sensor.device_id,
-        room_id=sensor.room_id,
-        sensor_type=sensor.sensor_type
-    )
+    if db_sensor is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Room not found or you don't have access"
+        )
     
-    db.add(db_sensor)
     db.commit()
-    db.refresh(db_sensor)
+    invalidate_system_config()
     
     return db_sensor
 
 
 @app.get("/api/sensors/{sensor_id}", response_model=schemas.SensorResponse, tags=["Sensors"])
-async def get_sensor(
+def get_sensor(
     sensor_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -544,7 +751,7 @@ async def get_sensor(
 
 
 @app.put("/api/sensors/{sensor_id}", response_model=schemas.SensorResponse, tags=["Sensors"])
-async def update_sensor(
+def update_sensor(
     sensor_id: int,
     sensor_update: schemas.SensorUpdate,
     current_user: models.User = Depends(get_current_user),
@@ -555,29 +762,27 @@ async def update_sensor(
     
     Requires: JWT token в Authorization header
     """
-    # Перевірка власника
-    sensor = db.query(models.Sensor).join(models.Room).filter(
+    # Перевірка власника та оновлення одним UPDATE ... RETURNING
+    sensor = _update_returning(
+        db, models.Sensor, sensor_update.model_dump(exclude_unset=True),
         models.Sensor.id == sensor_id,
-        models.Room.user_id == current_user.id
-    ).first()
+        models.Sensor.room_id.in_(_user_room_ids(current_user.id))
+    )
     
-    if not sensor:
+    if sensor is None:
         raise HTTPException(
             status_code=404,
             detail="Sensor not found or you don't have access"
         )
     
-    for key, value in sensor_update.dict(exclude_unset=True).items():
-        setattr(sensor, key, value)
-    
     db.commit()
-    db.refresh(sensor)
+    invalidate_system_config()
     
     return sensor
 
 
 @app.delete("/api/sensors/{sensor_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Sensors"])
-async def delete_sensor(
+def delete_sensor(
     sensor_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -587,26 +792,38 @@ async def delete_sensor(
     
     Requires: JWT token в Authorization header
     """
-    # Перевірка власника
-    sensor = db.query(models.Sensor).join(models.Room).filter(
-        models.Sensor.id == sensor_id,
-        models.Room.user_id == current_user.id
-    ).first()
-    
-    if not sensor:
+    # Години показників сенсора - до видалення (показники видаляються каскадно)
+    first_reading, last_reading = db.execute(
+        select(func.min(models.SensorReading.timestamp), func.max(models.SensorReading.timestamp))
+        .where(models.SensorReading.sensor_id == sensor_id)
+    ).one()
+    
+    # Перевірка власника та видалення одним DELETE ... RETURNING
+    room_id = db.execute(
+        delete(models.Sensor).where(
+            models.Sensor.id == sensor_id,
+            models.Sensor.room_id.in_(_user_room_ids(current_user.id))
+        ).returning(models.Sensor.room_id)
+    ).scalar_one_or_none()
+    
+    if room_id is None:
         raise HTTPException(
             status_code=404,
             detail="Sensor not found or you don't have access"
         )
     
-    db.delete(sensor)
+    if first_reading is not None:
+        AnalyticsRollup.recompute(db, room_id, first_reading, last_reading)
+    
     db.commit()
+    invalidate_sensor_cache(sensor_id)
+    invalidate_system_config()
     
     return None
 
 
 @app.post("/api/sensors/{sensor_id}/readings", response_model=schemas.SensorReadingResponse, status_code=status.HTTP_201_CREATED, tags=["Sensors"])
-async def create_sensor_reading(
+def create_sensor_reading(
     sensor_id: int,
     reading: schemas.SensorReadingCreate,
     db: Session = Depends(get_db)
@@ -618,40 +835,75 @@ async def create_sensor_reading(
     бо викликається IoT-пристроєм через MQTT або HTTP
     
     У продакшені додати перевірку API key або device credentials
-    """
-    sensor = db.query(models.Sensor).filter(
-        models.Sensor.id == sensor_id
-    ).first()
     
-    if not sensor:
-        raise HTTPException(status_code=404, detail="Sensor not found")
-    
-    # Оновлення last_online
-    sensor.last_online = datetime.utcnow()
+    Перевірка сенсора та запис показника - один INSERT ... SELECT ... RETURNING:
+    для неіснуючого сенсора SELECT не повертає рядків і нічого не вставляється.
+    """
+    now = datetime.utcnow()
+    reading_table = models.SensorReading
+    
+    db_reading = db.execute(
+        insert(reading_table).from_select(
+            ["sensor_id", "temperature", "humidity", "timestamp"],
+            select(
+                models.Sensor.id,
+                literal(reading.temperature, reading_table.temperature.type),
+                literal(reading.humidity, reading_table.humidity.type),
+                literal(reading.timestamp or now, reading_table.timestamp.type)
+            ).where(models.Sensor.id == sensor_id)
+        ).returning(
+            reading_table.id,
+            reading_table.sensor_id,
+            reading_table.temperature,
+            reading_table.humidity,
+            reading_table.timestamp,
+            reading_table.is_anomaly
+        )
+    ).one_or_none()
     
-    db_reading = models.SensorReading(
-        sensor_id=sensor_id,
-        temperature=reading.temperature,
-        humidity=reading.humidity,
-        timestamp=reading.timestamp or datetime.utcnow()
-    )
+    if db_reading is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
     
-    db.add(db_reading)
+    # Оновлення last_online (через Redis, у БД - фоновим завданням)
+    touch_sensors(db, (sensor_id,), now)
     db.commit()
-    db.refresh(db_reading)
     
     return db_reading
 
 
+# Максимальна кількість показників в одній відповіді історії сенсора
+READINGS_HISTORY_MAX_LIMIT = 1000
+
+
+def _rows_response(rows) -> Response:
+    """
+    JSON відповідь зі списку рядків-кортежів без валідації response_model
+    
+    Колонки запиту збігаються з полями схеми відповіді, тому модель Pydantic
+    на кожен рядок не створюється (response_model залишається для OpenAPI).
+    OPT_UTC_Z - той самий формат UTC часу ("Z"), що й у Pydantic.
+    """
+    return Response(
+        content=orjson.dumps([row._asdict() for row in rows], option=orjson.OPT_UTC_Z),
+        media_type="application/json"
+    )
+
+
 @app.get("/api/sensors/{sensor_id}/readings", response_model=List[schemas.SensorReadingResponse], tags=["Sensors"])
-async def get_sensor_readings(
+def get_sensor_readings(
     sensor_id: int,
     limit: int = 100,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Отримати історію показників сенсора
+    Отримати історію показників сенсора (від нових до старих)
+    
+    Пагінація за ключем: для наступної сторінки передати before=timestamp
+    та before_id=id останнього показника. Запит продовжує діапазон по індексу
+    (sensor_id, timestamp) з потрібного місця, без OFFSET.
     
     Requires: JWT token в Authorization header
     """
@@ -668,13 +920,35 @@ async def get_sensor_readings(
             detail="Sensor not found or you don't have access"
         )
     
-    readings = db.query(models.SensorReading)\
-        .filter(models.SensorReading.sensor_id == sensor_id)\
-        .order_by(models.SensorReading.timestamp.desc())\
-        .limit(limit)\
+    reading = models.SensorReading
+    filters = [reading.sensor_id == sensor_id]
+    
+    if before is not None:
+        # id розрізняє показники з однаковим timestamp (пакетний запис)
+        if before_id is not None:
+            filters.append(or_(
+                reading.timestamp < before,
+                and_(reading.timestamp == before, reading.id < before_id)
+            ))
+        else:
+            filters.append(reading.timestamp < before)
+    
+    # Лише колонки відповіді в порядку полів схеми (рядки-кортежі замість ORM об'єктів,
+    # серіалізовані напряму в JSON), а limit обмежено,
+    # щоб один запит не завантажував у пам'ять усю історію сенсора
+    readings = db.query(
+        reading.temperature,
+        reading.humidity,
+        reading.id,
+        reading.sensor_id,
+        reading.timestamp,
+        reading.is_anomaly
+    ).filter(*filters)\
+        .order_by(reading.timestamp.desc(), reading.id.desc())\
+        .limit(min(max(limit, 0), READINGS_HISTORY_MAX_LIMIT))\
         .all()
     
-    return readings
+    return _rows_response(readings)
 
 
 # ============================================
@@ -682,13 +956,13 @@ async def get_sensor_readings(
 # ============================================
 
 @app.get("/api/climate-devices", response_model=List[schemas.ClimateDeviceResponse], tags=["Climate Devices"])
-async def get_climate_devices(
+def get_climate_devices(
     room_id: int = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Отримати всі кліматичні пристрої користувача"""
-    query = db.query(models.ClimateDevice).join(models.Room).filter(
+    query = db.query(models.ClimateDevice).options(raiseload("*")).join(models.Room).filter(
         models.Room.user_id == current_user.id
     )
     
@@ -700,37 +974,35 @@ async def get_climate_devices(
 
 
 @app.post("/api/climate-devices", response_model=schemas.ClimateDeviceResponse, status_code=status.HTTP_201_CREATED, tags=["Climate Devices"])
-async def create_climate_device(
+def create_climate_device(
     device: schemas.ClimateDeviceCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Зареєструвати новий кліматичний пристрій"""
     
-    room = db.query(models.Room).filter(
-        models.Room.id == device.room_id,
-        models.Room.user_id == current_user.id
-    ).first()
-    
-    if not room:
+    try:
+        db_device = _insert_into_user_room(db, models.ClimateDevice, {
+            "name": device.name,
+            "device_id": device.device_id,
+            "room_id": device.room_id,
+            "device_type": device.device_type,
+            "power_consumption": device.power_consumption
+        }, current_user.id)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Climate device with this device_id already exists")
+    
+    if db_device is None:
         raise HTTPException(status_code=404, detail="Room not found or you don't have access")
     
-    db_device = models.ClimateDevice(
-        name=device.name,
-        device_id=device.device_id,
-        room_id=device.room_id,
-        device_type=device.device_type,
-        power_consumption=device.power_consumption
-    )
-    
-    db.add(db_device)
     db.commit()
-    db.refresh(db_device)
+    invalidate_system_config()
     
     return db_device
 
 @app.get("/api/climate-devices/{device_id}", response_model=schemas.ClimateDeviceResponse, tags=["Climate Devices"])
-async def get_climate_device(
+def get_climate_device(
     device_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -751,7 +1023,7 @@ async def get_climate_device(
     return device
 
 @app.put("/api/climate-devices/{device_id}", response_model=schemas.ClimateDeviceResponse, tags=["Climate Devices"])
-async def update_climate_device(
+def update_climate_device(
     device_id: int,
     device_update: schemas.ClimateDeviceUpdate,
     current_user: models.User = Depends(get_current_user),
@@ -759,51 +1031,50 @@ async def update_climate_device(
 ):
     """Оновити кліматичний пристрій"""
     
-    device = db.query(models.ClimateDevice).join(models.Room).filter(
+    device = _update_returning(
+        db, models.ClimateDevice, device_update.model_dump(exclude_unset=True),
         models.ClimateDevice.id == device_id,
-        models.Room.user_id == current_user.id
-    ).first()
+        models.ClimateDevice.room_id.in_(_user_room_ids(current_user.id))
+    )
     
-    if not device:
+    if device is None:
         raise HTTPException(
             status_code=404,
             detail="Device not found or you don't have access"
         )
     
-    # Оновити поля
-    for key, value in device_update.dict(exclude_unset=True).items():
-        setattr(device, key, value)
-    
     db.commit()
-    db.refresh(device)
+    invalidate_system_config()
     
     return device
 @app.delete("/api/climate-devices/{device_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Climate Devices"])
-async def delete_climate_device(
+def delete_climate_device(
     device_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Видалити кліматичний пристрій"""
     
-    device = db.query(models.ClimateDevice).join(models.Room).filter(
-        models.ClimateDevice.id == device_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    deleted = db.execute(
+        delete(models.ClimateDevice).where(
+            models.ClimateDevice.id == device_id,
+            models.ClimateDevice.room_id.in_(_user_room_ids(current_user.id))
+        ).returning(models.ClimateDevice.id)
+    ).scalar_one_or_none()
     
-    if not device:
+    if deleted is None:
         raise HTTPException(
             status_code=404,
             detail="Device not found or you don't have access"
         )
     
-    db.delete(device)
     db.commit()
+    invalidate_system_config()
     
     return None
 
 @app.post("/api/climate-devices/{device_id}/control", response_model=schemas.DeviceCommandResponse, status_code=status.HTTP_201_CREATED, tags=["Climate Devices"])
-async def control_device(
+def control_device(
     device_id: int,
     command: schemas.DeviceCommandCreate,
     current_user: models.User = Depends(get_current_user),
@@ -827,8 +1098,9 @@ async def control_device(
     )
     
     db.add(db_command)
+    db.flush()
+    db.expunge(db_command)
     db.commit()
-    db.refresh(db_command)
     
     return db_command
 
@@ -838,94 +1110,144 @@ async def control_device(
 # ============================================
 
 @app.get("/api/alerts", response_model=List[schemas.AlertResponse], tags=["Alerts"])
-async def get_alerts(
+def get_alerts(
     room_id: int = None,
     is_read: bool = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Отримати всі сповіщення"""
-    query = db.query(models.Alert).join(models.Room).filter(
+    alert = models.Alert
+    
+    # Лише колонки відповіді, серіалізовані напряму в JSON
+    query = db.query(
+        alert.id,
+        alert.room_id,
+        alert.alert_type,
+        alert.message,
+        alert.severity,
+        alert.is_read,
+        alert.created_at
+    ).join(models.Room).filter(
         models.Room.user_id == current_user.id
     )
     
     if room_id:
-        query = query.filter(models.Alert.room_id == room_id)
+        query = query.filter(alert.room_id == room_id)
     if is_read is not None:
-        query = query.filter(models.Alert.is_read == is_read)
+        query = query.filter(alert.is_read == is_read)
     
-    alerts = query.order_by(models.Alert.created_at.desc()).all()
-    return alerts
+    alerts = query.order_by(alert.created_at.desc()).all()
+    return _rows_response(alerts)
+
+
+@app.get("/api/alerts/summary", response_model=schemas.AlertSummaryResponse, tags=["Alerts"])
+def get_alerts_summary(
+    room_id: int = None,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Кількість сповіщень (всього, непрочитаних та за рівнем важливості)
+    
+    Агрегація виконується в БД одним GROUP BY, тому клієнтам, яким
+    потрібен лише лічильник, не передається весь список сповіщень.
+    """
+    alert = models.Alert
+    
+    query = db.query(
+        alert.severity,
+        alert.is_read,
+        func.count()
+    ).join(models.Room).filter(
+        models.Room.user_id == current_user.id
+    )
+    
+    if room_id:
+        query = query.filter(alert.room_id == room_id)
+    
+    total = 0
+    unread = 0
+    by_severity = {}
+    
+    for severity, is_read, count in query.group_by(alert.severity, alert.is_read):
+        counts = by_severity.setdefault(severity, {"read": 0, "unread": 0})
+        counts["read" if is_read else "unread"] += count
+        total += count
+        if not is_read:
+            unread += count
+    
+    return {"total": total, "unread": unread, "by_severity": by_severity}
 
 @app.post("/api/alerts", response_model=schemas.AlertResponse, status_code=status.HTTP_201_CREATED, tags=["Alerts"])
-async def create_alert(
+def create_alert(
     alert: schemas.AlertCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Створити сповіщення"""
     
-    # Перевірити що приміщення належить користувачу
-    room = db.query(models.Room).filter(
-        models.Room.id == alert.room_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    # Перевірити що приміщення належить користувачу - в самому INSERT
+    db_alert = _insert_into_user_room(db, models.Alert, alert.dict(), current_user.id)
     
-    if not room:
+    if db_alert is None:
         raise HTTPException(
             status_code=404,
             detail="Room not found or you don't have access"
         )
     
-    db_alert = models.Alert(**alert.dict())
-    
-    db.add(db_alert)
     db.commit()
-    db.refresh(db_alert)
     
     return db_alert
 
 @app.put("/api/alerts/{alert_id}/read", response_model=schemas.AlertResponse, tags=["Alerts"])
-async def mark_alert_read(
+def mark_alert_read(
     alert_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Позначити сповіщення як прочитане"""
-    alert = db.query(models.Alert).join(models.Room).filter(
-        models.Alert.id == alert_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    """
+    Позначити сповіщення як прочитане
     
-    if not alert:
+    Перевірка власника, оновлення та читання рядка - один UPDATE ... RETURNING
+    """
+    alert = db.execute(
+        update(models.Alert).where(
+            models.Alert.id == alert_id,
+            models.Alert.room_id.in_(_user_room_ids(current_user.id))
+        ).values(is_read=True).returning(models.Alert)
+    ).scalar_one_or_none()
+    
+    if alert is None:
         raise HTTPException(status_code=404, detail="Alert not found or you don't have access")
     
-    alert.is_read = True
+    # Від'єднаний об'єкт не застаріває після commit, тому серіалізація не робить SELECT
+    db.expunge(alert)
     db.commit()
-    db.refresh(alert)
     
     return alert
 
 @app.delete("/api/alerts/{alert_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Alerts"])
-async def delete_alert(
+def delete_alert(
     alert_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Видалити сповіщення"""
     
-    alert = db.query(models.Alert).join(models.Room).filter(
-        models.Alert.id == alert_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    deleted = db.execute(
+        delete(models.Alert).where(
+            models.Alert.id == alert_id,
+            models.Alert.room_id.in_(_user_room_ids(current_user.id))
+        ).returning(models.Alert.id)
+    ).scalar_one_or_none()
     
-    if not alert:
+    if deleted is None:
         raise HTTPException(
             status_code=404,
             detail="Alert not found or you don't have access"
         )
     
-    db.delete(alert)
     db.commit()
     
     return None
@@ -934,7 +1256,7 @@ async def delete_alert(
 # ============================================
 
 @app.get("/api/climate-thresholds/room/{room_id}", response_model=schemas.ClimateThresholdResponse, tags=["Climate Thresholds"])
-async def get_room_threshold(
+def get_room_threshold(
     room_id: int,
     db: Session = Depends(get_db)
 ):
@@ -950,31 +1272,29 @@ async def get_room_threshold(
     return threshold
 
 @app.post("/api/climate-thresholds", response_model=schemas.ClimateThresholdResponse, status_code=status.HTTP_201_CREATED, tags=["Climate Thresholds"])
-async def create_threshold(
+def create_threshold(
     threshold: schemas.ClimateThresholdCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Створити налаштування порогів для приміщення"""
     
-    room = db.query(models.Room).filter(
-        models.Room.id == threshold.room_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    try:
+        db_threshold = _insert_into_user_room(db, models.ClimateThreshold, threshold.dict(), current_user.id)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Threshold settings already exist for this room")
     
-    if not room:
+    if db_threshold is None:
         raise HTTPException(status_code=404, detail="Room not found or you don't have access")
     
-    db_threshold = models.ClimateThreshold(**threshold.dict())
-    
-    db.add(db_threshold)
     db.commit()
-    db.refresh(db_threshold)
+    invalidate_room_cache(db_threshold.room_id)
     
     return db_threshold
 
 @app.put("/api/climate-thresholds/{threshold_id}", response_model=schemas.ClimateThresholdResponse, tags=["Climate Thresholds"])
-async def update_threshold(
+def update_threshold(
     threshold_id: int,
     threshold_update: schemas.ClimateThresholdUpdate,
     current_user: models.User = Depends(get_current_user),
@@ -982,31 +1302,26 @@ async def update_threshold(
 ):
     """Оновити налаштування порогів за ID"""
     
-    # Знайти threshold і перевірити що він належить користувачу
-    threshold = db.query(models.ClimateThreshold)\
-        .join(models.Room)\
-        .filter(
-            models.ClimateThreshold.id == threshold_id,
-            models.Room.user_id == current_user.id
-        ).first()
+    # Оновити threshold, якщо він належить користувачу
+    threshold = _update_returning(
+        db, models.ClimateThreshold, threshold_update.model_dump(exclude_unset=True),
+        models.ClimateThreshold.id == threshold_id,
+        models.ClimateThreshold.room_id.in_(_user_room_ids(current_user.id))
+    )
     
-    if not threshold:
+    if threshold is None:
         raise HTTPException(
             status_code=404,
             detail="Threshold settings not found or you don't have access"
         )
     
-    # Оновити поля
-    for key, value in threshold_update.dict(exclude_unset=True).items():
-        setattr(threshold, key, value)
-    
     db.commit()
-    db.refresh(threshold)
+    invalidate_room_cache(threshold.room_id)
     
     return threshold
 
 @app.put("/api/climate-thresholds/room/{room_id}", response_model=schemas.ClimateThresholdResponse, tags=["Climate Thresholds"])
-async def update_room_threshold(
+def update_room_threshold(
     room_id: int,
     threshold_update: schemas.ClimateThresholdUpdate,
     current_user: models.User = Depends(get_current_user),
@@ -1014,61 +1329,60 @@ async def update_room_threshold(
 ):
     """Оновити налаштування порогів для приміщення"""
     
-    # Перевірити що приміщення належить користувачу
-    room = db.query(models.Room).filter(
-        models.Room.id == room_id,
-        models.Room.user_id == current_user.id
-    ).first()
-    
-    if not room:
-        raise HTTPException(
-            status_code=404,
-            detail="Room not found or you don't have access"
-        )
-    
-    # Знайти threshold
-    threshold = db.query(models.ClimateThreshold)\
-        .filter(models.ClimateThreshold.room_id == room_id)\
-        .first()
+    threshold = _update_returning(
+        db, models.ClimateThreshold, threshold_update.model_dump(exclude_unset=True),
+        models.ClimateThreshold.room_id == room_id,
+        models.ClimateThreshold.room_id.in_(_user_room_ids(current_user.id))
+    )
     
-    if not threshold:
+    if threshold is None:
+        # Лише на шляху помилки: з'ясувати, чого саме немає
+        owned = db.query(
+            exists().where(
+                models.Room.id == room_id,
+                models.Room.user_id == current_user.id
+            )
+        ).scalar()
+        
+        if not owned:
+            raise HTTPException(
+                status_code=404,
+                detail="Room not found or you don't have access"
+            )
+        
         raise HTTPException(
             status_code=404,
             detail="Threshold settings not found for this room"
         )
     
-    # Оновити поля
-    for key, value in threshold_update.dict(exclude_unset=True).items():
-        setattr(threshold, key, value)
-    
     db.commit()
-    db.refresh(threshold)
+    invalidate_room_cache(room_id)
     
     return threshold
 
 @app.delete("/api/climate-thresholds/{threshold_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Climate Thresholds"])
-async def delete_threshold(
+def delete_threshold(
     threshold_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Видалити налаштування порогів"""
     
-    threshold = db.query(models.ClimateThreshold)\
-        .join(models.Room)\
-        .filter(
+    room_id = db.execute(
+        delete(models.ClimateThreshold).where(
             models.ClimateThreshold.id == threshold_id,
-            models.Room.user_id == current_user.id
-        ).first()
+            models.ClimateThreshold.room_id.in_(_user_room_ids(current_user.id))
+        ).returning(models.ClimateThreshold.room_id)
+    ).scalar_one_or_none()
     
-    if not threshold:
+    if room_id is None:
         raise HTTPException(
             status_code=404,
             detail="Threshold settings not found or you don't have access"
         )
     
-    db.delete(threshold)
     db.commit()
+    invalidate_room_cache(room_id)
     
     return None
 # ============================================
@@ -1076,11 +1390,16 @@ async def delete_threshold(
 # ============================================
 
 if __name__ == "__main__":
+    # Для розробки: UVICORN_RELOAD=true (reload працює лише з одним процесом).
+    # Кількість процесів - WEB_CONCURRENCY (за замовчуванням 1): від неї
+    # залежить розмір пулу з'єднань кожного процесу
+    reload = os.getenv("UVICORN_RELOAD", "false").lower() == "true"
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=reload,
+        workers=1 if reload else WEB_CONCURRENCY
     )
 @app.post(
     "/api/sensors/{sensor_id}/readings/process",
@@ -1088,7 +1407,7 @@ if __name__ == "__main__":
     tags=["Sensors - Advanced"],
     summary="Обробити показник з повною логікою",
 )
-async def process_sensor_reading_advanced(
+def process_sensor_reading_advanced(
     sensor_id: int,
     reading: SensorReadingInput,
     db: Session = Depends(get_db)
@@ -1144,12 +1463,48 @@ async def process_sensor_reading_advanced(
         }
     }
 
+
+# Максимальна кількість показників в одному пакеті (більший пакет - 422)
+READINGS_BATCH_MAX_SIZE = 1000
+
+
+@app.post(
+    "/api/sensors/readings/batch",
+    response_model=SensorBatchProcessingResponse,
+    tags=["Sensors - Advanced"],
+    summary="Обробити пакет показників",
+)
+def process_sensor_readings_batch(
+    readings: List[SensorBatchReadingInput] = Body(..., max_length=READINGS_BATCH_MAX_SIZE),
+    db: Session = Depends(get_db)
+):
+    """
+    Обробити пакет показників (від одного або кількох сенсорів) одним commit
+    
+    Показники невідомих сенсорів, без temperature/humidity або поза
+    допустимими діапазонами пропускаються і враховуються у readings_rejected.
+    Пакет понад READINGS_BATCH_MAX_SIZE показників відхиляється з 422 ще до
+    звернення до БД.
+    """
+    result = SensorReadingProcessor.process_readings_batch(
+        db=db,
+        readings=(reading.model_dump() for reading in readings)
+    )
+    
+    if not result["success"]:
+        raise HTTPException(
+            status_code=result.get("status_code", 400),
+            detail=result.get("error", "Processing failed")
+        )
+    
+    return result
+
 # ============================================
 # АВТОКЕРУВАННЯ
 # ============================================
 
 @app.post("/api/auto-control/execute/{reading_id}", tags=["Auto Control"])
-async def execute_auto_control(
+def execute_auto_control(
     reading_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -1172,26 +1527,28 @@ async def execute_auto_control(
 
 
 @app.get("/api/auto-control/status/{room_id}", tags=["Auto Control"])
-async def get_auto_control_status(
+def get_auto_control_status(
     room_id: int,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Отримати статус автокерування для приміщення
+    
+    Пороги читаються з Redis (скидаються при зміні порогів або приміщення)
     """
     # Перевірка доступу
-    room = db.query(models.Room).filter(
-        models.Room.id == room_id,
-        models.Room.user_id == current_user.id
-    ).first()
+    owned = db.query(
+        exists().where(
+            models.Room.id == room_id,
+            models.Room.user_id == current_user.id
+        )
+    ).scalar()
     
-    if not room:
+    if not owned:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    threshold = db.query(models.ClimateThreshold).filter(
-        models.ClimateThreshold.room_id == room_id
-    ).first()
+    threshold = load_room_threshold(db, room_id)
     
     if not threshold:
         return {
@@ -1220,8 +1577,42 @@ async def get_auto_control_status(
 # АНАЛІТИКА З КЕШУВАННЯМ
 # ============================================
 
+def _etag_response(request: Request, content: bytes, compress: bool = False) -> Response:
+    """
+    JSON відповідь з ETag (BLAKE2b тіла)
+    
+    Якщо клієнт надіслав If-None-Match з тим самим ETag, повертається 304
+    без тіла: дані не змінились, і повторно передавати їх не потрібно.
+    Cache-Control: no-cache - клієнт перевіряє актуальність при кожному запиті.
+    compress=True - тіло стискається gzip (окремий ETag для стиснутого варіанту).
+    """
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    headers = {"Cache-Control": "private, no-cache"}
+    
+    if compress:
+        etag = f'"{digest}-gzip"'
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    else:
+        etag = f'"{digest}"'
+    headers["ETag"] = etag
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Список ETag через кому; слабкі (W/) порівнюються за значенням
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            headers.pop("Content-Encoding", None)
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    if compress:
+        content = gzip.compress(content, compresslevel=EXPORT_GZIP_LEVEL)
+    
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
 @app.get("/api/analytics/cached", tags=["Analytics"])
-async def get_cached_analytics(
+def get_cached_analytics(
+    request: Request,
     room_id: Optional[int] = None,
     period_days: int = 7,
     current_user: models.User = Depends(get_current_user),
@@ -1234,6 +1625,11 @@ async def get_cached_analytics(
     - Перевірка кешу
     - Генерація аналітики (якщо немає в кеші)
     - Збереження в кеш
+    
+    Синхронний endpoint: виконується в пулі потоків, тому очікування на
+    аналітику, яку генерує інший запит, не блокує event loop.
+    Кешована аналітика повертається байтами з Redis без повторної серіалізації,
+    а з ETag - відповіддю 304, якщо у клієнта вже є та сама версія.
     """
     # Якщо вказано room_id, перевірити доступ
     if room_id:
@@ -1245,6 +1641,10 @@ async def get_cached_analytics(
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
     
+    cached = AnalyticsService.get_cached_response(room_id, period_days)
+    if cached is not None:
+        return _etag_response(request, cached)
+    
     result = AnalyticsService.get_analytics(
         db=db,
         room_id=room_id,
@@ -1257,11 +1657,11 @@ async def get_cached_analytics(
             detail=result.get("error", "No data available")
         )
     
-    return result
+    return _etag_response(request, orjson.dumps(result))
 
 
 @app.post("/api/analytics/report", tags=["Analytics"])
-async def generate_analytics_report(
+def generate_analytics_report(
     room_id: Optional[int] = None,
     period_hours: Optional[int] = None,
     start_date: Optional[datetime] = None,
@@ -1280,6 +1680,9 @@ async def generate_analytics_report(
     - Знайти мін/макс
     - Визначити тренди
     - Сформувати звіт
+    
+    Синхронний endpoint: запити звіту виконуються в пулі потоків
+    і не блокують event loop.
     """
     # Перевірка доступу до приміщення
     if room_id:
@@ -1313,9 +1716,9 @@ async def generate_analytics_report(
 # ============================================
 
 @app.post("/api/admin/users/manage", tags=["Admin - Users"])
-async def manage_user_admin(
-    operation: str,  # "create", "update", "delete"
-    user_data: Optional[Dict] = None,
+def manage_user_admin(
+    operation: Literal["create", "update", "delete"],
+    user_data: Optional[UserManagementData] = None,
     target_user_id: Optional[int] = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -1333,12 +1736,15 @@ async def manage_user_admin(
     - "create": Створити нового користувача
     - "update": Оновити існуючого користувача
     - "delete": Видалити користувача
+    
+    Передаються лише поля, задані в тілі запиту (exclude_unset): update
+    не скидає в NULL поля, яких немає в запиті.
     """
     result = UserManagementFlow.manage_user(
         db=db,
         admin_user_id=current_user.id,
         operation=operation,
-        user_data=user_data,
+        user_data=user_data.model_dump(exclude_unset=True) if user_data else None,
         target_user_id=target_user_id
     )
     
@@ -1352,78 +1758,208 @@ async def manage_user_admin(
     return result
 
 
-@app.get("/api/admin/users/list", tags=["Admin - Users"])
-async def list_all_users(
-    skip: int = 0,
-    limit: int = 100,
-    is_active: Optional[bool] = None,
+# Максимальна кількість операцій в одному пакеті (більший пакет - 422)
+USERS_BATCH_MAX_SIZE = 100
+
+
+@app.post("/api/admin/users/manage/batch", tags=["Admin - Users"])
+def manage_users_batch_admin(
+    operations: List[UserManagementOperation] = Body(..., max_length=USERS_BATCH_MAX_SIZE),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Отримати список всіх користувачів (тільки адміністратори)
+    Пакетне управління користувачами (тільки для адміністраторів)
+    
+    Операції групуються за типом і виконуються одним INSERT/UPDATE/DELETE
+    на тип та одним commit. Пакет атомарний: якщо хоча б одна операція
+    не проходить валідацію, жодна зміна не записується. Пакет понад
+    USERS_BATCH_MAX_SIZE операцій відхиляється з 422.
     """
-    if not current_user.is_admin:
+    result = UserManagementFlow.manage_users_batch(
+        db=db,
+        admin_user_id=current_user.id,
+        operations=[op.model_dump(exclude_unset=True) for op in operations]
+    )
+    
+    if not result["success"]:
+        status_code = 403 if result.get("status") == "unauthorized" else 400
+        if "details" in result:
+            raise HTTPException(
+                status_code=status_code,
+                detail={"error": result["error"], "details": result["details"]}
+            )
         raise HTTPException(
-            status_code=403,
-            detail="Only administrators can access this endpoint"
+            status_code=status_code,
+            detail=result.get("error", "Operation failed")
         )
     
-    query = db.query(models.User)
+    return result
+
+
+# Максимальний розмір сторінки списку користувачів
+USERS_LIST_MAX_LIMIT = 500
+
+
+@app.get("/api/admin/users/list", tags=["Admin - Users"])
+def list_all_users(
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    is_active: Optional[bool] = None,
+    current_user: models.User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Отримати список всіх користувачів (тільки адміністратори)
+    
+    Keyset пагінація за id: наступна сторінка запитується з after_id=next_cursor,
+    тому глибокі сторінки не сканують пропущені рядки, як OFFSET.
+    total - кількість усіх користувачів з фільтром (кешована, до 30 с застаріла),
+    page_size - кількість на поточній сторінці.
+    """
+    limit = min(max(limit, 1), USERS_LIST_MAX_LIMIT)
+    user = models.User
+    
+    # Лише колонки відповіді: рядки-кортежі перетворюються на dict, а datetime
+    # серіалізує orjson (ORJSONResponse) без isoformat() на кожен рядок
+    query = db.query(
+        user.id,
+        user.username,
+        user.email,
+        user.is_active,
+        user.is_admin,
+        user.created_at
+    )
     
     if is_active is not None:
-        query = query.filter(models.User.is_active == is_active)
+        query = query.filter(user.is_active == is_active)
+    if after_id is not None:
+        query = query.filter(user.id > after_id)
     
-    users = query.offset(skip).limit(limit).all()
+    # Зайвий рядок показує, чи є наступна сторінка
+    users = query.order_by(user.id).limit(limit + 1).all()
+    has_next = len(users) > limit
+    users = users[:limit]
     
     return {
-        "total": len(users),
-        "users": [
-            {
-                "id": u.id,
-                "username": u.username,
-                "email": u.email,
-                "is_active": u.is_active,
-                "is_admin": u.is_admin,
-                "created_at": u.created_at.isoformat()
-            }
-            for u in users
-        ]
+        "total": UserManagement.count_users(db, is_active),
+        "page_size": len(users),
+        "next_cursor": users[-1].id if has_next else None,
+        "users": [row._asdict() for row in users]
     }
 
 
+# Статистика для дашборду адміністратора кешується лише в Redis (спільний для
+# воркерів), тому дані не старші за TTL. Обчислюється один раз за TTL: паралельні
+# запити процесу на промаху чекають на блокуванні, а не запускають агрегацію повторно
+ADMIN_STATS_CACHE_TTL = 30  # секунд
+ADMIN_STATS_CACHE_KEY = "admin_statistics"
+_admin_stats_lock = threading.Lock()
+
+
 @app.get("/api/admin/statistics", tags=["Admin - System"])
-async def get_admin_statistics(
-    current_user: models.User = Depends(get_current_user),
+def get_admin_statistics(
+    current_user: models.User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
     Отримати загальну статистику системи (тільки адміністратори)
     """
-    if not current_user.is_admin:
-        raise HTTPException(
-            status_code=403,
-            detail="Only administrators can access this endpoint"
-        )
-    
-    from admin import DataManagement, UserManagement
-    
-    system_stats = DataManagement.get_system_statistics(db)
-    user_stats = UserManagement.get_user_statistics(db)
+    stats = cache_get(ADMIN_STATS_CACHE_KEY)
+    if stats is not None:
+        return stats
     
-    return {
-        "system": system_stats,
-        "users": user_stats,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    with _admin_stats_lock:
+        stats = cache_get(ADMIN_STATS_CACHE_KEY)
+        
+        if stats is None:
+            # Агрегати обмежені за часом: повільний запит не тримає з'єднання пулу
+            try:
+                with statement_timeout(db, ADMIN_STATEMENT_TIMEOUT_MS):
+                    # timestamp - час обчислення, тобто актуальність закешованих даних
+                    stats = {
+                        "system": DataManagement.get_system_statistics(db),
+                        "users": UserManagement.get_user_statistics(db),
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+            except OperationalError as e:
+                if not is_statement_timeout(e):
+                    raise
+                db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Statistics query timed out, try again later",
+                    headers={"Retry-After": "30"}
+                )
+            cache_set(ADMIN_STATS_CACHE_KEY, stats, ADMIN_STATS_CACHE_TTL)
+    
+    return stats
 
 
 # ============================================
 # ЕКСПОРТ ДАНИХ
 # ============================================
 
+# Рівень gzip для експорту CSV/JSON: рівень 1 стискає текст майже так само,
+# як максимальний 9, але в кілька разів швидше (стиснення - основна вартість відповіді)
+EXPORT_GZIP_LEVEL = 1
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """Чи приймає клієнт відповідь, стиснуту gzip"""
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def _gzip_chunks(chunks: Iterator[Union[str, bytes]]) -> Iterator[bytes]:
+    """Стиснути потік частин (текст або байти) у gzip (для StreamingResponse)"""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 - формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _export_owner_id(
+    db: Session,
+    current_user: models.User,
+    room_id: Optional[int],
+    sensor_id: Optional[int]
+) -> Optional[int]:
+    """
+    Перевірити доступ до експорту показників та повернути власника для фільтра
+    
+    Приміщення та сенсор перевіряються EXISTS без завантаження рядків (404,
+    якщо вони не належать користувачу). Адміністратор експортує дані всіх
+    користувачів (None), інші - лише своїх приміщень (current_user.id).
+    """
+    owner_id = None if current_user.is_admin else current_user.id
+    
+    if room_id:
+        room_filter = [models.Room.id == room_id]
+        if owner_id is not None:
+            room_filter.append(models.Room.user_id == owner_id)
+        
+        if not db.query(exists().where(*room_filter)).scalar():
+            raise HTTPException(status_code=404, detail="Room not found")
+    
+    if sensor_id:
+        sensor_filter = [models.Sensor.id == sensor_id]
+        if owner_id is not None:
+            sensor_filter += [
+                models.Room.id == models.Sensor.room_id,
+                models.Room.user_id == owner_id
+            ]
+        
+        if not db.query(exists().where(*sensor_filter)).scalar():
+            raise HTTPException(status_code=404, detail="Sensor not found")
+    
+    return owner_id
+
+
 @app.get("/api/export/sensor-data/csv", tags=["Data Export"])
-async def export_sensor_data_csv(
+def export_sensor_data_csv(
+    request: Request,
     room_id: Optional[int] = None,
     sensor_id: Optional[int] = None,
     start_date: Optional[datetime] = None,
@@ -1433,39 +1969,69 @@ async def export_sensor_data_csv(
 ):
     """
     Експортувати дані сенсорів у CSV форматі
-    """
-    from admin import DataExport
-    from fastapi.responses import Response
     
-    # Перевірка доступу
-    if room_id:
-        room = db.query(models.Room).filter(
-            models.Room.id == room_id,
-            models.Room.user_id == current_user.id
-        ).first()
-        
-        if not room:
-            raise HTTPException(status_code=404, detail="Room not found")
+    Якщо клієнт надсилає Accept-Encoding: gzip, CSV стискається на льоту
+    з рівнем EXPORT_GZIP_LEVEL.
+    """
+    # Перевірка доступу: лише власні приміщення та сенсори (адміністратор - усі)
+    owner_id = _export_owner_id(db, current_user, room_id, sensor_id)
     
-    csv_data = DataExport.export_sensor_data_to_csv(
+    # CSV віддається частинами в міру читання рядків з БД
+    csv_chunks = DataExport.export_sensor_data_to_csv(
         db=db,
         room_id=room_id,
         sensor_id=sensor_id,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        user_id=owner_id
     )
     
-    if not csv_data or csv_data == "":
-        raise HTTPException(
-            status_code=404,
-            detail="No data found for export"
-        )
-    
     filename = f"sensor_data_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Vary": "Accept-Encoding"
+    }
     
-    return Response(
-        content=csv_data,
+    if _accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        csv_chunks = _gzip_chunks(csv_chunks)
+    
+    return StreamingResponse(
+        csv_chunks,
         media_type="text/csv",
+        headers=headers
+    )
+
+
+@app.get("/api/export/sensor-data/parquet", tags=["Data Export"])
+def export_sensor_data_parquet(
+    room_id: Optional[int] = None,
+    sensor_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Експортувати дані сенсорів у форматі Parquet (для великих вибірок)
+    """
+    # Перевірка доступу: лише власні приміщення та сенсори (адміністратор - усі)
+    owner_id = _export_owner_id(db, current_user, room_id, sensor_id)
+    
+    parquet_chunks = DataExport.export_sensor_data_to_parquet(
+        db=db,
+        room_id=room_id,
+        sensor_id=sensor_id,
+        start_date=start_date,
+        end_date=end_date,
+        user_id=owner_id
+    )
+    
+    filename = f"sensor_data_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.parquet"
+    
+    return StreamingResponse(
+        parquet_chunks,
+        media_type="application/vnd.apache.parquet",
         headers={
             "Content-Disposition": f'attachment; filename="{filename}"'
         }
@@ -1473,29 +2039,76 @@ async def export_sensor_data_csv(
 
 
 @app.get("/api/export/configuration", tags=["Data Export"])
-async def export_system_configuration(
+def export_system_configuration(
+    request: Request,
+    format: Literal["json", "ndjson"] = "json",
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Експортувати конфігурацію системи (приміщення, сенсори, пристрої)
+    
+    Готовий JSON зберігається в Redis і скидається при зміні конфігурації,
+    тому повторні запити не звертаються до БД і не серіалізують дерево знову.
+    Відповідь має ETag (304 для незміненої конфігурації); якщо клієнт надсилає
+    Accept-Encoding: gzip, JSON стискається з рівнем EXPORT_GZIP_LEVEL.
+    
+    format=ndjson - потоковий експорт плоскими записами (один об'єкт на рядок)
+    для великих конфігурацій: без кешу, дерево не будується в пам'яті.
     """
-    from admin import DataExport
+    if format == "ndjson":
+        chunks = DataExport.export_system_configuration_ndjson(db)
+        headers = {"Vary": "Accept-Encoding"}
+        
+        if _accepts_gzip(request):
+            headers["Content-Encoding"] = "gzip"
+            chunks = _gzip_chunks(chunks)
+        
+        return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
     
-    config = DataExport.export_system_configuration(db)
+    content = cache_get_raw(SYSTEM_CONFIG_CACHE_KEY)
     
-    return config
+    if content is None:
+        content = orjson.dumps(DataExport.export_system_configuration(db))
+        cache_set_raw(SYSTEM_CONFIG_CACHE_KEY, content, SYSTEM_CONFIG_CACHE_TTL)
+    
+    return _etag_response(request, content, compress=_accepts_gzip(request))
 
 
 # ============================================
 # ОЧИЩЕННЯ ДАНИХ
 # ============================================
 
-@app.post("/api/admin/cleanup", tags=["Admin - System"])
-async def cleanup_old_data(
+# Стан завдань очищення зберігається в Redis: cleanup:{job_id}
+CLEANUP_JOB_TTL = 24 * 60 * 60  # секунд
+
+
+def _cleanup_job_key(job_id: str) -> str:
+    return f"cleanup:{job_id}"
+
+
+def _run_cleanup_job(job_id: str, days_to_keep: int):
+    """Фонове очищення старих даних з власною сесією БД"""
+    key = _cleanup_job_key(job_id)
+    cache_set(key, {"job_id": job_id, "status": "running"}, CLEANUP_JOB_TTL)
+    
+    db = SessionLocal()
+    try:
+        result = DataManagement.cleanup_old_data(db, days_to_keep)
+        cache_set(key, {"job_id": job_id, "status": "completed", "result": result}, CLEANUP_JOB_TTL)
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Cleanup job {job_id} failed: {e}")
+        cache_set(key, {"job_id": job_id, "status": "failed", "error": str(e)}, CLEANUP_JOB_TTL)
+    finally:
+        db.close()
+
+
+@app.post("/api/admin/cleanup", status_code=status.HTTP_202_ACCEPTED, tags=["Admin - System"])
+def cleanup_old_data(
+    background_tasks: BackgroundTasks,
     days_to_keep: int = 90,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(require_admin)
 ):
     """
     Очистити старі дані (тільки адміністратори)
@@ -1504,47 +2117,64 @@ async def cleanup_old_data(
     - Показники сенсорів старші за вказану кількість днів
     - Старі логи пристроїв
     - Прочитані alerts старші 30 днів
+    
+    Видалення виконується у фоні після відповіді (порціями з commit після
+    кожної), endpoint одразу повертає job_id. Стан - GET /api/admin/cleanup/{job_id}
     """
-    if not current_user.is_admin:
-        raise HTTPException(
-            status_code=403,
-            detail="Only administrators can perform cleanup"
-        )
+    job_id = uuid.uuid4().hex
+    cache_set(_cleanup_job_key(job_id), {"job_id": job_id, "status": "pending"}, CLEANUP_JOB_TTL)
+    background_tasks.add_task(_run_cleanup_job, job_id, days_to_keep)
     
-    from admin import DataManagement
+    return {"job_id": job_id, "status": "accepted"}
+
+
+@app.get("/api/admin/cleanup/{job_id}", tags=["Admin - System"])
+def get_cleanup_status(
+    job_id: str,
+    current_user: models.User = Depends(require_admin)
+):
+    """Стан фонового завдання очищення (тільки адміністратори)"""
+    job = cache_get(_cleanup_job_key(job_id))
     
-    result = DataManagement.cleanup_old_data(db, days_to_keep)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Cleanup job not found")
     
-    return result
+    return job
 
 
 # ============================================
 # ТЕСТОВИЙ ENDPOINT
 # ============================================
 
+# Відповідь незмінна, тому серіалізується один раз при імпорті модуля
+_TEST_BUSINESS_LOGIC_BODY = orjson.dumps({
+    "status": "ok",
+    "message": "Enhanced business logic is loaded",
+    "available_modules": [
+        "SensorReadingProcessor",
+        "AnalyticsService",
+        "AutoControlFlow",
+        "DataValidationFlow",
+        "UserManagementFlow",
+        "AnalyticsReportFlow"
+    ],
+    "endpoints": {
+        "sensor_processing": "/api/sensors/{sensor_id}/readings/process",
+        "validation": "/api/sensors/{sensor_id}/readings/validate",
+        "auto_control": "/api/auto-control/execute/{reading_id}",
+        "analytics": "/api/analytics/cached",
+        "report": "/api/analytics/report",
+        "admin": "/api/admin/users/manage",
+        "export": "/api/export/sensor-data/csv"
+    }
+})
+
+
 @app.get("/api/test/business-logic", tags=["Testing"])
-async def test_business_logic():
+async def test_business_logic(request: Request):
     """
     Перевірити що нова бізнес-логіка доступна
+    
+    Тіло відповіді серіалізоване заздалегідь, ETag дозволяє відповісти 304.
     """
-    return {
-        "status": "ok",
-        "message": "Enhanced business logic is loaded",
-        "available_modules": [
-            "SensorReadingProcessor",
-            "AnalyticsService",
-            "AutoControlFlow",
-            "DataValidationFlow",
-            "UserManagementFlow",
-            "AnalyticsReportFlow"
-        ],
-        "endpoints": {
-            "sensor_processing": "/api/sensors/{sensor_id}/readings/process",
-            "validation": "/api/sensors/{sensor_id}/readings/validate",
-            "auto_control": "/api/auto-control/execute/{reading_id}",
-            "analytics": "/api/analytics/cached",
-            "report": "/api/analytics/report",
-            "admin": "/api/admin/users/manage",
-            "export": "/api/export/sensor-data/csv"
-        }
-    }
\ No newline at end of file
+    return _etag_response(request, _TEST_BUSINESS_LOGIC_BODY)
\ No newline at end of file
@@ -3,7 +3,9 @@ SQLAlchemy Models для системи моніторингу клімату
 Відповідають структурі PostgreSQL бази даних
 """
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, CheckConstraint, JSON, Enum
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, Boolean, DateTime, ForeignKey, CheckConstraint, Index, JSON, Enum
+from sqlalchemy import case, type_coerce
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -43,6 +45,7 @@ class AlertType(str, enum.Enum):
     HUMIDITY_HIGH = "humidity_high"
     HUMIDITY_LOW = "humidity_low"
     DEVICE_ERROR = "device_error"
+    ANOMALY_DETECTED = "anomaly_detected"
 
 
 class AlertSeverity(str, enum.Enum):
@@ -57,6 +60,68 @@ class LogLevel(str, enum.Enum):
     ERROR = "error"
 
 
+class SmallIntEnum(TypeDecorator):
+    """
+    Зберігає значення str-Enum як SMALLINT (2 байти замість VARCHAR)
+    
+    У Python колонка працює з тими ж рядками, що й раніше ("temperature",
+    "warning", ...), а в БД записується порядковий номер значення в Enum.
+    Тому нові значення додаються лише в кінець Enum.
+    
+    Міграція існуючої БД (PostgreSQL), де ці колонки VARCHAR. Коди - позиції
+    значень в Enum; невідоме значення перетворюється на NULL, тому для
+    NOT NULL колонок міграція зупиниться з помилкою і нічого не змінить:
+        BEGIN;
+        ALTER TABLE sensor ALTER COLUMN sensor_type TYPE SMALLINT USING
+            CASE sensor_type WHEN 'temperature' THEN 0 WHEN 'humidity' THEN 1
+                             WHEN 'combined' THEN 2 END;
+        ALTER TABLE climate_device ALTER COLUMN device_type TYPE SMALLINT USING
+            CASE device_type WHEN 'air_conditioner' THEN 0 WHEN 'heater' THEN 1
+                             WHEN 'humidifier' THEN 2 WHEN 'dehumidifier' THEN 3 END;
+        ALTER TABLE device_command ALTER COLUMN command TYPE SMALLINT USING
+            CASE command WHEN 'turn_on' THEN 0 WHEN 'turn_off' THEN 1
+                         WHEN 'set_temperature' THEN 2 WHEN 'set_humidity' THEN 3 END;
+        ALTER TABLE alert ALTER COLUMN alert_type TYPE SMALLINT USING
+            CASE alert_type WHEN 'temperature_high' THEN 0 WHEN 'temperature_low' THEN 1
+                            WHEN 'humidity_high' THEN 2 WHEN 'humidity_low' THEN 3
+                            WHEN 'device_error' THEN 4 WHEN 'anomaly_detected' THEN 5 END;
+        ALTER TABLE alert ALTER COLUMN severity DROP DEFAULT;
+        ALTER TABLE alert ALTER COLUMN severity TYPE SMALLINT USING
+            CASE severity WHEN 'info' THEN 0 WHEN 'warning' THEN 1
+                          WHEN 'critical' THEN 2 END;
+        COMMIT;
+    Значення за замовчуванням severity ("info") задає модель.
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+        self._codes = {member.value: code for code, member in enumerate(enum_class)}
+        self._values = [member.value for member in enum_class]
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self._codes[getattr(value, "value", value)]
+        except KeyError:
+            raise ValueError(f"Invalid {self.enum_class.__name__} value: {value!r}")
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._values[value]
+    
+    def label_expression(self, column):
+        """SQL вираз, що перетворює код назад у рядок (для серіалізації на стороні БД)"""
+        return case(
+            {code: value for code, value in enumerate(self._values)},
+            value=type_coerce(column, SmallInteger)
+        )
+
+
 # ============================================
 # MODELS (Моделі SQLAlchemy)
 # ============================================
@@ -76,8 +141,24 @@ class User(Base):
     is_admin = Column(Boolean, default=False)
     
     # Relationships
-    rooms = relationship("Room", back_populates="user", cascade="all, delete-orphan")
-    device_commands = relationship("DeviceCommand", back_populates="user", cascade="all, delete-orphan")
+    # passive_deletes: дочірні рядки видаляє ON DELETE CASCADE у БД, тому при
+    # db.delete() ORM не завантажує колекції (SELECT на кожну) перед DELETE
+    rooms = relationship("Room", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    device_commands = relationship("DeviceCommand", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    
+    # Часткові індекси (PostgreSQL) для лічильників статистики
+    # ix_user_is_active_id - keyset пагінація списку користувачів з фільтром is_active.
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_user_active ON "user" (id) WHERE is_active = true;
+    #   CREATE INDEX CONCURRENTLY ix_user_is_active_id ON "user" (is_active, id);
+    __table_args__ = (
+        Index("ix_user_active", id, postgresql_where=(is_active == True)),
+        Index("ix_user_is_active_id", is_active, id),
+    )
+    
+    # server_default колонки (created_at) повертаються з INSERT через RETURNING,
+    # тому після створення об'єкт не потрібно перечитувати (db.refresh)
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class Room(Base):
@@ -88,15 +169,23 @@ class Room(Base):
     description = Column(String(500))
     floor = Column(Integer)
     area = Column(Float)
-    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    # Індекси на зовнішніх ключах: списки endpoint'ів фільтрують за власником
+    # та приміщенням, а ON DELETE CASCADE шукає дочірні рядки за цими колонками.
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_room_user_id ON room (user_id);
+    #   CREATE INDEX CONCURRENTLY ix_climate_device_room_id ON climate_device (room_id);
+    #   CREATE INDEX CONCURRENTLY ix_device_command_device_id ON device_command (device_id);
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     user = relationship("User", back_populates="rooms")
-    sensors = relationship("Sensor", back_populates="room", cascade="all, delete-orphan")
-    climate_devices = relationship("ClimateDevice", back_populates="room", cascade="all, delete-orphan")
-    climate_threshold = relationship("ClimateThreshold", back_populates="room", uselist=False, cascade="all, delete-orphan")
-    alerts = relationship("Alert", back_populates="room", cascade="all, delete-orphan")
+    sensors = relationship("Sensor", back_populates="room", cascade="all, delete-orphan", passive_deletes=True)
+    climate_devices = relationship("ClimateDevice", back_populates="room", cascade="all, delete-orphan", passive_deletes=True)
+    climate_threshold = relationship("ClimateThreshold", back_populates="room", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    alerts = relationship("Alert", back_populates="room", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class Sensor(Base):
@@ -105,15 +194,22 @@ class Sensor(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     device_id = Column(String(100), unique=True, nullable=False)
-    room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), nullable=False)
-    sensor_type = Column(String(20), nullable=False)  # Змінено на String замість Enum
+    room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), nullable=False, index=True)
+    sensor_type = Column(SmallIntEnum(SensorType), nullable=False)
     status = Column(String(20), default="active")  # Змінено на String замість Enum
     last_online = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     room = relationship("Room", back_populates="sensors")
-    sensor_readings = relationship("SensorReading", back_populates="sensor", cascade="all, delete-orphan")
+    sensor_readings = relationship("SensorReading", back_populates="sensor", cascade="all, delete-orphan", passive_deletes=True)
+    
+    # Частковий індекс для лічильника активних сенсорів.
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_sensor_active ON sensor (id) WHERE status = 'active';
+    __table_args__ = (
+        Index("ix_sensor_active", id, postgresql_where=(status == "active")),
+    )
 
 
 class SensorReading(Base):
@@ -128,6 +224,77 @@ class SensorReading(Base):
     
     # Relationships
     sensor = relationship("Sensor", back_populates="sensor_readings")
+    
+    # Вибірки показників сенсора за період: пошук діапазону за (sensor_id, timestamp),
+    # а INCLUDE дозволяє PostgreSQL віддати значення з індексу (index-only scan).
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_sensor_reading_sensor_timestamp
+    #       ON sensor_reading (sensor_id, timestamp) INCLUDE (temperature, humidity, is_anomaly);
+    #   CREATE INDEX CONCURRENTLY ix_sensor_room_id ON sensor (room_id);
+    __table_args__ = (
+        Index(
+            "ix_sensor_reading_sensor_timestamp",
+            sensor_id,
+            timestamp,
+            postgresql_include=["temperature", "humidity", "is_anomaly"]
+        ),
+    )
+
+
+
+class SensorReadingHourly(Base):
+    """
+    Погодинні агрегати показників по приміщенню
+    
+    Заповнюється AnalyticsRollup.refresh. Суми, суми квадратів та кількості
+    дозволяють точно об'єднати години в середнє, стандартне відхилення та мін/макс.
+    last_reading_id - найбільший id показника на момент оновлення, що записало рядок:
+    показники з більшим id ще не зведені в агрегати.
+    
+    Для існуючої БД, де таблиці ще немає:
+      CREATE TABLE sensor_reading_hourly (
+          room_id INTEGER NOT NULL REFERENCES room (id) ON DELETE CASCADE,
+          hour_bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+          reading_count INTEGER NOT NULL,
+          anomaly_count INTEGER NOT NULL,
+          temperature_count INTEGER NOT NULL,
+          temperature_sum FLOAT,
+          temperature_sum_squares FLOAT,
+          min_temperature FLOAT,
+          max_temperature FLOAT,
+          humidity_count INTEGER NOT NULL,
+          humidity_sum FLOAT,
+          humidity_sum_squares FLOAT,
+          min_humidity FLOAT,
+          max_humidity FLOAT,
+          last_reading_id INTEGER NOT NULL,
+          PRIMARY KEY (room_id, hour_bucket)
+      );
+      CREATE INDEX ix_sensor_reading_hourly_bucket ON sensor_reading_hourly (hour_bucket);
+    До створення таблиці аналітика рахується по сирих показниках.
+    """
+    __tablename__ = "sensor_reading_hourly"
+    
+    room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), primary_key=True)
+    hour_bucket = Column(DateTime(timezone=True), primary_key=True)
+    reading_count = Column(Integer, nullable=False)
+    anomaly_count = Column(Integer, nullable=False)
+    temperature_count = Column(Integer, nullable=False)
+    temperature_sum = Column(Float)
+    temperature_sum_squares = Column(Float)
+    min_temperature = Column(Float)
+    max_temperature = Column(Float)
+    humidity_count = Column(Integer, nullable=False)
+    humidity_sum = Column(Float)
+    humidity_sum_squares = Column(Float)
+    min_humidity = Column(Float)
+    max_humidity = Column(Float)
+    last_reading_id = Column(Integer, nullable=False)
+    
+    # Аналітика по всіх приміщеннях вибирає години за період
+    __table_args__ = (
+        Index("ix_sensor_reading_hourly_bucket", hour_bucket),
+    )
 
 
 class ClimateDevice(Base):
@@ -136,23 +303,30 @@ class ClimateDevice(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     device_id = Column(String(100), unique=True, nullable=False)
-    room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), nullable=False)
-    device_type = Column(String(50), nullable=False)  # Змінено на String
+    room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), nullable=False, index=True)
+    device_type = Column(SmallIntEnum(ClimateDeviceType), nullable=False)
     status = Column(String(20), default="off")  # Змінено на String
     power_consumption = Column(Float)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     room = relationship("Room", back_populates="climate_devices")
-    device_commands = relationship("DeviceCommand", back_populates="device", cascade="all, delete-orphan")
+    device_commands = relationship("DeviceCommand", back_populates="device", cascade="all, delete-orphan", passive_deletes=True)
+    
+    # Частковий індекс для лічильника увімкнених пристроїв.
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_climate_device_on ON climate_device (id) WHERE status = 'on';
+    __table_args__ = (
+        Index("ix_climate_device_on", id, postgresql_where=(status == "on")),
+    )
 
 
 class DeviceCommand(Base):
     __tablename__ = "device_command"
     
     id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(Integer, ForeignKey("climate_device.id", ondelete="CASCADE"), nullable=False)
-    command = Column(String(50), nullable=False)  # Змінено на String
+    device_id = Column(Integer, ForeignKey("climate_device.id", ondelete="CASCADE"), nullable=False, index=True)
+    command = Column(SmallIntEnum(DeviceCommandType), nullable=False)
     parameters = Column(JSON)
     issued_by = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
     issued_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -162,6 +336,8 @@ class DeviceCommand(Base):
     # Relationships
     device = relationship("ClimateDevice", back_populates="device_commands")
     user = relationship("User", back_populates="device_commands")
+    
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class ClimateThreshold(Base):
@@ -186,14 +362,33 @@ class Alert(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("room.id", ondelete="CASCADE"), nullable=False)
-    alert_type = Column(String(50), nullable=False)  # Змінено на String
+    alert_type = Column(SmallIntEnum(AlertType), nullable=False)
     message = Column(String(500), nullable=False)
-    severity = Column(String(20), default="info")  # Змінено на String
+    severity = Column(SmallIntEnum(AlertSeverity), default="info")
     is_read = Column(Boolean, default=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
     # Relationships
     room = relationship("Room", back_populates="alerts")
+    
+    # Список сповіщень (room_id, is_read, ORDER BY created_at DESC): діапазон індексу
+    # вже впорядкований, а INCLUDE дає index-only scan без сортування.
+    # Індекс також покриває пошук за зовнішнім ключем room_id.
+    # ix_alert_unread - частковий індекс для лічильника непрочитаних сповіщень.
+    # Для існуючої БД:
+    #   CREATE INDEX CONCURRENTLY ix_alert_unread ON alert (id) WHERE is_read = false;
+    #   CREATE INDEX CONCURRENTLY ix_alert_room_read_created
+    #       ON alert (room_id, is_read, created_at DESC) INCLUDE (alert_type, message, severity);
+    __table_args__ = (
+        Index("ix_alert_unread", id, postgresql_where=(is_read == False)),
+        Index(
+            "ix_alert_room_read_created",
+            room_id,
+            is_read,
+            created_at.desc(),
+            postgresql_include=["alert_type", "message", "severity"]
+        ),
+    )
 
 
 class DeviceLog(Base):
@@ -201,12 +396,24 @@ class DeviceLog(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(Integer, nullable=False)
-    device_type = Column(String(20), nullable=False)  # 'sensor' or 'climate_device'
+    device_type = Column(String(20), nullable=False)  # 'sensor', 'climate_device' або 'admin_action'
     log_level = Column(Enum(LogLevel), default=LogLevel.INFO)
     message = Column(String(1000), nullable=False)
     log_metadata = Column("metadata", JSON)  # Перейменовано в Python, але в БД залишається "metadata"
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
+    # 'admin_action' - дії адміністратора (UserManagementFlow._log_change, device_id = id адміністратора).
+    # Для існуючої БД:
+    #   ALTER TABLE device_log DROP CONSTRAINT check_device_type;
+    #   ALTER TABLE device_log ADD CONSTRAINT check_device_type
+    #       CHECK (device_type IN ('sensor', 'climate_device', 'admin_action'));
     __table_args__ = (
-        CheckConstraint("device_type IN ('sensor', 'climate_device')", name="check_device_type"),
-    )
\ No newline at end of file
+        CheckConstraint(
+            "device_type IN ('sensor', 'climate_device', 'admin_action')",
+            name="check_device_type"
+        ),
+        # Для вибірки помилок за період (get_error_summary)
+        Index("ix_device_log_level_timestamp", log_level, timestamp.desc()),
+    )
+    
+    __mapper_args__ = {"eager_defaults": True}
\ No newline at end of file
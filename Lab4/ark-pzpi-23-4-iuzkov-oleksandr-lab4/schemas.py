@@ -236,6 +236,18 @@ class AlertCreate(BaseModel):
     ]
     message: str = Field(..., min_length=1, max_length=500)
     severity: Literal["info", "warning", "critical"] = "warning"
+
+
+class AlertSeverityCount(BaseModel):
+    read: int = 0
+    unread: int = 0
+
+
+class AlertSummaryResponse(BaseModel):
+    """Кількість сповіщень без самих записів"""
+    total: int
+    unread: int
+    by_severity: Dict[str, AlertSeverityCount]
     
 # ============================================
 # DEVICE LOG SCHEMAS
@@ -286,6 +298,35 @@ class PasswordChange(BaseModel):
     new_password: str = Field(..., min_length=8, description="Новий пароль (мінімум 8 символів)")
 
 
+class UserManagementData(BaseModel):
+    """
+    Дані операції управління користувачами
+    
+    Обов'язковість полів залежить від операції (create - username, email,
+    password; delete - confirm_delete) і перевіряється в UserManagementFlow.
+    Невідомі поля відхиляються.
+    """
+    username: Optional[str] = None
+    email: Optional[str] = None
+    password: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    is_active: Optional[bool] = None
+    is_admin: Optional[bool] = None
+    confirm_delete: Optional[bool] = None
+    
+    class Config:
+        extra = "forbid"
+
+
+class UserManagementOperation(BaseModel):
+    """Операція у пакеті управління користувачами"""
+    operation: Literal["create", "update", "delete"]
+    user_data: Optional[UserManagementData] = None
+    target_user_id: Optional[int] = None
+
+
 class SensorReadingInput(BaseModel):
     temperature: Optional[float] = None
     humidity: Optional[float] = None
@@ -301,6 +342,20 @@ class SensorReadingInput(BaseModel):
         }
 
 
+class SensorBatchReadingInput(SensorReadingInput):
+    """Показник у пакеті (для кількох сенсорів одночасно)"""
+    sensor_id: int
+
+
+class SensorBatchProcessingResponse(BaseModel):
+    success: bool
+    readings_saved: int
+    readings_rejected: int
+    anomalies_detected: int
+    commands_executed: int
+    alerts_created: int
+
+
 class SensorProcessingResponse(BaseModel):
     success: bool
     reading_id: int
@@ -0,0 +1,146 @@
+"""
+Redis cache configuration
+Спільний кеш для всіх воркерів uvicorn (замість словника в пам'яті процесу)
+"""
+
+from typing import Any, Dict, Optional
+import os
+import random
+import time
+import orjson
+import redis
+from dotenv import load_dotenv
+
+# Завантаження змінних середовища з .env файлу
+load_dotenv()
+
+# Redis URL з .env файлу
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Клієнт з пулом з'єднань, один на процес.
+# Короткі таймаути: якщо Redis недоступний, запит виконується без кешу, а не чекає
+redis_client = redis.Redis.from_url(
+    REDIS_URL,
+    socket_connect_timeout=0.5,
+    socket_timeout=0.5
+)
+
+# Розкид TTL (±10%), щоб ключі, збережені одночасно, не застарівали одночасно
+CACHE_TTL_JITTER = 0.1
+
+# Single-flight блокування: лише один запит генерує значення, інші чекають на нього
+CACHE_LOCK_TTL = 30  # секунд
+CACHE_WAIT_TIMEOUT = 2.0  # секунд
+CACHE_WAIT_INTERVAL = 0.05  # секунд
+
+
+def cache_get_raw(key: str) -> Optional[bytes]:
+    """Прочитати значення з кешу як серіалізований JSON, без розбору"""
+    try:
+        return redis_client.get(key)
+    except redis.RedisError:
+        return None
+
+
+def cache_get(key: str) -> Optional[Any]:
+    """Прочитати значення з кешу (None, якщо ключа немає або Redis недоступний)"""
+    raw = cache_get_raw(key)
+    return orjson.loads(raw) if raw is not None else None
+
+
+def cache_set_raw(key: str, raw: bytes, ttl: int):
+    """Зберегти вже серіалізований JSON з терміном життя ttl секунд ±10% (SETEX)"""
+    ttl = max(1, round(ttl * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)))
+    try:
+        redis_client.setex(key, ttl, raw)
+    except redis.RedisError:
+        pass
+
+
+def cache_set(key: str, value: Any, ttl: int):
+    """Зберегти значення в кеш з терміном життя ttl секунд ±10% (SETEX)"""
+    cache_set_raw(key, orjson.dumps(value), ttl)
+
+
+def cache_delete(key: str):
+    """Видалити значення з кешу (після зміни даних, з яких воно побудоване)"""
+    try:
+        redis_client.delete(key)
+    except redis.RedisError:
+        pass
+
+
+def cache_hset(key: str, mapping: Dict[Any, Any]) -> bool:
+    """
+    Записати поля хешу (HSET) без терміну життя
+    
+    Returns:
+        False, якщо Redis недоступний (викликач зберігає дані інакше)
+    """
+    try:
+        redis_client.hset(key, mapping=mapping)
+    except redis.RedisError:
+        return False
+    return True
+
+
+def cache_hpop_all(key: str) -> Dict[bytes, bytes]:
+    """
+    Атомарно прочитати та видалити хеш (HGETALL + DEL в одній транзакції)
+    
+    Поля, записані після виклику, потрапляють у новий хеш і не губляться.
+    """
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        values, _ = pipe.execute()
+    except redis.RedisError:
+        return {}
+    return values
+
+
+def cache_lock(key: str) -> bool:
+    """
+    Захопити блокування на генерацію значення ключа (SET NX EX)
+    
+    Returns:
+        True, якщо значення має згенерувати цей запит (у т.ч. коли Redis недоступний)
+    """
+    try:
+        return bool(redis_client.set(f"lock:{key}", b"1", nx=True, ex=CACHE_LOCK_TTL))
+    except redis.RedisError:
+        return True
+
+
+def cache_unlock(key: str):
+    """Зняти блокування після збереження значення (або невдалої генерації)"""
+    try:
+        redis_client.delete(f"lock:{key}")
+    except redis.RedisError:
+        pass
+
+
+def cache_wait(key: str) -> Optional[Any]:
+    """
+    Дочекатися значення, яке генерує інший запит
+    
+    Опитує ключ кожні 50 мс до 2 секунд. Повертає None, якщо час вийшов
+    або блокування знято без збереження значення.
+    """
+    deadline = time.monotonic() + CACHE_WAIT_TIMEOUT
+    
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_WAIT_INTERVAL)
+        
+        value = cache_get(key)
+        if value is not None:
+            return value
+        
+        try:
+            if not redis_client.exists(f"lock:{key}"):
+                return None
+        except redis.RedisError:
+            return None
+    
+    return None